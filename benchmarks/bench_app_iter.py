@@ -0,0 +1,47 @@
+"""Measure the per-chunk cost of recording errors raised by the app_iter.
+
+Streams a generator of small chunks through a bare WSGI app and through
+the same app wrapped in ``ErrorLog``, and reports the difference per
+chunk.
+
+Run with ``python benchmarks/bench_app_iter.py [chunks]``.
+"""
+import sys
+import timeit
+
+from repoze.errorlog import ErrorLog
+
+
+def make_app(chunks):
+    chunk = b'x' * 64
+    def app(environ, start_response):
+        return (chunk for i in range(chunks))
+    return app
+
+
+def main(argv=sys.argv):
+    chunks = int(argv[1]) if len(argv) > 1 else 10000
+    app = make_app(chunks)
+    elog = ErrorLog(app, None, 20, '/__error_log__', ())
+    environ = {'PATH_INFO': '/'}
+
+    def consume(wsgi_app):
+        app_iter = wsgi_app(dict(environ), None)
+        for chunk in app_iter:
+            pass
+        close = getattr(app_iter, 'close', None)
+        if close is not None:
+            close()
+
+    results = {}
+    for name, wsgi_app in [('bare', app), ('errorlog', elog)]:
+        best = min(timeit.repeat(lambda: consume(wsgi_app), number=20,
+                                 repeat=5)) / 20
+        results[name] = best
+        print('%-9s %8.1f ns/chunk' % (name, best / chunks * 1e9))
+    overhead = (results['errorlog'] - results['bare']) / chunks
+    print('overhead  %8.1f ns/chunk' % (overhead * 1e9))
+
+
+if __name__ == '__main__':
+    main()
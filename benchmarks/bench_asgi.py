@@ -0,0 +1,122 @@
+"""Load test: ``ASGIErrorLog`` under many concurrent requests.
+
+An in-process ASGI client keeps ``concurrency`` requests in flight on one
+event loop; every tenth request fails 20 frames deep and is logged to a
+channel whose handler writes to an in-memory stream.  Meanwhile a ticker
+task asks to be woken every millisecond, and the worst delays it sees
+show how long the event loop was blocked.
+
+Compares a bare application, ``ASGIErrorLog`` recording errors in the
+loop's default executor, and ``ASGIErrorLog`` recording them inline on the
+event loop (which is what offloading avoids).  Python 3.5 or later.
+
+Run with ``python benchmarks/bench_asgi.py [requests] [concurrency]``.
+"""
+import asyncio
+from concurrent.futures import Executor
+from concurrent.futures import Future
+import logging
+import sys
+import time
+
+from repoze.errorlog import make_errorlog
+from repoze.errorlog._compat import NativeStream
+from repoze.errorlog.asgi import ASGIErrorLog
+
+
+async def app(scope, receive, send):
+    await asyncio.sleep(0)
+    if scope['query_string'] == b'fail':
+        def recurse(n):
+            if n:
+                recurse(n - 1)
+            raise KeyError('cart %s' % scope['path'])
+        recurse(20)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'hello world'})
+
+
+class InlineExecutor(Executor):
+    """ Runs what it is given at once, in the calling thread. """
+    def submit(self, fn, *args, **kw):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kw))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def make_scope(i):
+    return {'type': 'http', 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': '/cart', 'root_path': '',
+            'query_string': b'fail' if i % 10 == 0 else b'',
+            'headers': [(b'host', b'localhost'),
+                        (b'user-agent', b'bench/1.0'),
+                        (b'cookie', b'session=x' * 10)],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 1234)}
+
+
+async def request(application, i):
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+    async def send(message):
+        pass
+    try:
+        await application(make_scope(i), receive, send)
+    except KeyError:
+        pass
+
+
+async def ticker(delays, done):
+    while not done:
+        start = time.time()
+        await asyncio.sleep(0.001)
+        delays.append(time.time() - start - 0.001)
+
+
+async def run(application, requests, concurrency):
+    async def client(first):
+        for i in range(first, requests, concurrency):
+            await request(application, i)
+    delays = []
+    done = []
+    tick = asyncio.ensure_future(ticker(delays, done))
+    start = time.time()
+    await asyncio.gather(*[client(i) for i in range(concurrency)])
+    elapsed = time.time() - start
+    done.append(True)
+    await tick
+    delays.sort()
+    return elapsed, delays
+
+
+def main(argv=sys.argv):
+    requests = int(argv[1]) if len(argv) > 1 else 20000
+    concurrency = int(argv[2]) if len(argv) > 2 else 1000
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.StreamHandler(NativeStream()))
+    logger.propagate = False
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for name, application in [
+            ('bare', app),
+            ('offloaded', ASGIErrorLog(app, make_errorlog(
+                None, None, channel='bench'))),
+            ('inline', ASGIErrorLog(app, make_errorlog(
+                None, None, channel='bench'), InlineExecutor())),
+            ]:
+        elapsed, delays = loop.run_until_complete(
+            run(application, requests, concurrency))
+        p99 = delays[int(len(delays) * 0.99)] if delays else 0.0
+        worst = delays[-1] if delays else 0.0
+        print('%-10s %8.0f requests/s  loop delay p99 %6.2f ms, '
+              'max %6.2f ms' % (name, requests / elapsed, p99 * 1e3,
+                                worst * 1e3))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
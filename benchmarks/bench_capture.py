@@ -0,0 +1,76 @@
+"""Compare the cost of capturing an error in the request thread.
+
+"eager" is what ``ErrorLog.insert_error`` used to do: render the traceback
+with ``traceback.print_exception`` and ``pprint.pformat`` the environ at the
+moment of failure.  "snapshot" is the current ``insert_error``, which only
+records frame locations and a filtered environ copy; "snapshot+render"
+additionally renders ``Error.text``, as viewing the entry would.
+
+Run with ``python benchmarks/bench_capture.py [depth] [environ_keys]``.
+"""
+import pprint
+import sys
+import timeit
+import traceback
+
+from repoze.errorlog import ErrorLog
+from repoze.errorlog._compat import NativeStream
+
+
+def make_exc_info(depth):
+    def recurse(n):
+        if n:
+            recurse(n - 1)
+        raise KeyError('boom')
+    try:
+        recurse(depth)
+    except KeyError:
+        return sys.exc_info()
+
+
+def make_environ(keys):
+    environ = {
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': NativeStream(),
+        'wsgi.errors': NativeStream(),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'PATH_INFO': '/cart/checkout',
+    }
+    for i in range(keys):
+        environ['HTTP_X_HEADER_%d' % i] = 'value %d' % i * 4
+    return environ
+
+
+def eager(exc_info, environ):
+    f = NativeStream()
+    traceback.print_exception(exc_info[0], exc_info[1], exc_info[2], None, f)
+    return f.getvalue() + '\n\n' + pprint.pformat(environ)
+
+
+def main(argv=sys.argv):
+    depth = int(argv[1]) if len(argv) > 1 else 20
+    keys = int(argv[2]) if len(argv) > 2 else 30
+    exc_info = make_exc_info(depth)
+    environ = make_environ(keys)
+    # keep every occurrence in full, so that each one pays the whole cost
+    elog = ErrorLog(None, None, 20, '/__error_log__', (), samples=sys.maxsize)
+
+    def snapshot():
+        elog.insert_error(elog.new_identifier(), exc_info, environ)
+
+    def snapshot_render():
+        elog.insert_error(elog.new_identifier(), exc_info, environ)
+        elog.errors[0].text
+
+    print('depth=%d environ keys=%d' % (depth, len(environ)))
+    for name, func in [('eager', lambda: eager(exc_info, environ)),
+                       ('snapshot', snapshot),
+                       ('snapshot+render', snapshot_render)]:
+        number = 2000
+        best = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print('%-16s %8.1f us/capture' % (name, best * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Measure the worst-case cost of capturing local variables.
+
+Raises an error at the bottom of a deep recursion whose every frame holds
+large containers, long strings and objects with costly ``repr``s, and times
+``ErrorLog.insert_error`` with and without ``capture_locals``.  The cost of
+the capture is bounded by the ``LocalsCapture`` limits, not by the depth of
+the stack or the size of the values.
+
+Run with ``python benchmarks/bench_locals.py [depth]``.
+"""
+import sys
+import timeit
+
+from repoze.errorlog import ErrorLog
+from repoze.errorlog.variables import LocalsCapture
+
+
+class Node(object):
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return 'Node(%r)' % (self.children,)
+
+
+def make_exc_info(depth):
+    def recurse(n, *args):
+        big_list = list(range(10000))
+        big_dict = dict((str(i), [i] * 10) for i in range(1000))
+        long_string = 'x' * 100000
+        tree = Node([Node([Node([])] * 50)] * 50)
+        if n:
+            recurse(n - 1, big_list, big_dict, long_string, tree)
+        raise KeyError('boom')
+    try:
+        recurse(depth)
+    except KeyError:
+        return sys.exc_info()
+
+
+def main(argv=sys.argv):
+    depth = int(argv[1]) if len(argv) > 1 else 200
+    exc_info = make_exc_info(depth)
+    environ = {'PATH_INFO': '/'}
+    for name, capture in [('plain', None), ('locals', LocalsCapture())]:
+        # keep every occurrence in full, so that each one pays the whole cost
+        elog = ErrorLog(None, None, 20, '/__error_log__', (),
+                        samples=sys.maxsize, capture_locals=capture)
+        def insert():
+            elog.insert_error(elog.new_identifier(), exc_info, environ)
+        best = min(timeit.repeat(insert, number=20, repeat=5)) / 20
+        print('%-7s %8.1f us per error (depth %d)' % (name, best * 1e6,
+                                                      depth))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Measure the memory held by an exception history of similar errors.
+
+Records ``count`` occurrences of one error (raised 20 frames deep, with a
+typical request environ whose strings are built afresh for each request,
+as a server does) in an ``ErrorLog`` keeping them all, with and without
+interning their strings and frames, and prints what the history holds as
+measured by ``tracemalloc``, next to the size of a list of as many
+references.
+
+Run with ``python benchmarks/bench_memory.py [count]`` (Python 3).
+"""
+import gc
+import sys
+import tracemalloc
+
+from repoze.errorlog import ErrorLog
+from repoze.errorlog.store import RingBuffer
+
+
+def recurse(n):
+    if n:
+        recurse(n - 1)
+    raise KeyError('cart')
+
+
+def exc_info():
+    try:
+        recurse(20)
+    except KeyError:
+        return sys.exc_info()
+
+
+def make_environ(i):
+    environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+               'wsgi.version': (1, 0), 'wsgi.multithread': True,
+               'REMOTE_PORT': str(40000 + i % 20000)}
+    for name, value in [('PATH_INFO', '/shop/cart'),
+                        ('SERVER_NAME', 'shop.example.com'),
+                        ('SERVER_PORT', '443'),
+                        ('SERVER_PROTOCOL', 'HTTP/1.1'),
+                        ('REMOTE_ADDR', '10.0.0.1'),
+                        ('HTTP_HOST', 'shop.example.com'),
+                        ('HTTP_USER_AGENT', 'Mozilla/5.0 (X11; Linux x86_64)'),
+                        ('HTTP_ACCEPT', 'text/html,application/xhtml+xml'),
+                        ('HTTP_ACCEPT_LANGUAGE', 'en-US,en;q=0.5'),
+                        ('HTTP_ACCEPT_ENCODING', 'gzip, deflate, br')]:
+        # fresh objects, as parsed from each request
+        environ[''.join(name)] = ''.join(value)
+    return environ
+
+
+def measure(count, intern):
+    elog = ErrorLog(None, None, count, '/__error_log__', (),
+                    samples=sys.maxsize,
+                    store=RingBuffer(count, intern=intern))
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(count):
+        elog.insert_error(elog.new_identifier(), exc_info(), make_environ(i))
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held
+
+
+def main(argv=sys.argv):
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    references = sys.getsizeof([None] * count)
+    for name, intern in [('copies', False), ('interned', True)]:
+        held = measure(count, intern)
+        print('%-9s %10d bytes  %6d per error' % (name, held, held // count))
+    print('%-9s %10d bytes  %6d per error' % ('refs', references,
+                                               references // count))
+
+
+if __name__ == '__main__':
+    main()
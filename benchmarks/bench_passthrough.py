@@ -0,0 +1,62 @@
+"""Measure the cost of ``ErrorLog`` for requests which don't fail.
+
+Calls a trivial WSGI app directly and through ``ErrorLog``, and reports the
+time per request of each and the difference.  Uses ``pyperf`` when it is
+installed (pass its options after the script name); otherwise the mean and
+standard deviation of several ``timeit`` runs are printed.
+
+Run with ``python benchmarks/bench_passthrough.py``.
+"""
+import sys
+import timeit
+
+from repoze.errorlog import ErrorLog
+
+try:
+    import pyperf
+except ImportError:
+    pyperf = None
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('content-type', 'text/plain')])
+    return [b'hello']
+
+
+def start_response(status, headers):
+    pass
+
+
+def make_environ():
+    return {'PATH_INFO': '/some/page', 'SCRIPT_NAME': '',
+            'REQUEST_METHOD': 'GET', 'QUERY_STRING': ''}
+
+
+def request(wsgi_app):
+    return wsgi_app(make_environ(), start_response)
+
+
+def main(argv=sys.argv):
+    elog = ErrorLog(app, None, 20, '/__error_log__', ())
+    cases = [('bare', app), ('errorlog', elog)]
+    if pyperf is not None:
+        runner = pyperf.Runner()
+        for name, wsgi_app in cases:
+            runner.bench_func(name, request, wsgi_app)
+        return
+    number = 100000
+    results = {}
+    for name, wsgi_app in cases:
+        runs = [t / number * 1e9 for t in
+                timeit.repeat(lambda: request(wsgi_app), number=number,
+                              repeat=10)]
+        mean = sum(runs) / len(runs)
+        stdev = (sum((t - mean) ** 2 for t in runs) / len(runs)) ** 0.5
+        results[name] = mean
+        print('%-9s %7.1f ns +- %5.1f ns per request' % (name, mean, stdev))
+    print('overhead  %7.1f ns per request' %
+          (results['errorlog'] - results['bare']))
+
+
+if __name__ == '__main__':
+    main()
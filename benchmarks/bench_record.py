@@ -0,0 +1,61 @@
+"""Compare the binary record format with pickles and the rendered text.
+
+Records an error raised at the bottom of a recursion (so that its file and
+function names repeat), with a typical environ, and prints the size of its
+record, of its pickle and of its ``text``, and the time taken to encode and
+decode it either way.
+
+Run with ``python benchmarks/bench_record.py [depth]``.
+"""
+import pickle
+import sys
+import timeit
+
+from repoze.errorlog import Error
+from repoze.errorlog import TracebackSnapshot
+from repoze.errorlog.record import dumps
+from repoze.errorlog.record import loads
+
+
+def recurse(n):
+    if n:
+        recurse(n - 1)
+    raise KeyError('boom')
+
+
+def make_error(depth):
+    try:
+        recurse(depth)
+    except KeyError:
+        snapshot = TracebackSnapshot(sys.exc_info())
+    environ = {'PATH_INFO': '/some/page', 'REQUEST_METHOD': 'GET',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0)}
+    for i in range(20):
+        environ['HTTP_X_HEADER_%d' % i] = 'value %d' % i
+    return Error('1', 'KeyError: boom', snapshot, 'time', environ,
+                 '/__error_log__?entry=1', 'fp', 1.0)
+
+
+def best(func, number=1000):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main(argv=sys.argv):
+    depth = int(argv[1]) if len(argv) > 1 else 30
+    error = make_error(depth)
+    record = dumps(error)
+    pickled = pickle.dumps(error, 2)
+    text = error.text.encode('utf-8')
+    print('record %7d bytes  dumps %7.1f us  loads %7.1f us' % (
+        len(record), best(lambda: dumps(error)) * 1e6,
+        best(lambda: loads(record)) * 1e6))
+    print('pickle %7d bytes  dumps %7.1f us  loads %7.1f us' % (
+        len(pickled), best(lambda: pickle.dumps(error, 2)) * 1e6,
+        best(lambda: pickle.loads(pickled)) * 1e6))
+    print('text   %7d bytes  (%.1fx the record; depth %d)' % (
+        len(text), float(len(text)) / len(record), depth))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Load test: the cost of a failing request during an error storm.
+
+Every request fails with the same error, 20 frames deep, and is logged to
+a channel whose handler writes to an in-memory stream.  Compares the
+per-request overhead of ``ErrorLog`` capturing every error with that of
+an ``ErrorLog`` with a ``CapturePolicy`` (10 errors / second / type), and
+with a bare application for reference.
+
+Run with ``python benchmarks/bench_storm.py [requests] [threads]``.
+"""
+import logging
+import sys
+import threading
+import time
+
+from repoze.errorlog import ErrorLog
+from repoze.errorlog._compat import NativeStream
+from repoze.errorlog.policy import CapturePolicy
+
+
+def failing_app(environ, start_response):
+    def recurse(n):
+        if n:
+            recurse(n - 1)
+        raise KeyError('cart %s' % environ.get('PATH_INFO'))
+    recurse(20)
+
+
+def make_environ():
+    return {'PATH_INFO': '/cart', 'wsgi.url_scheme': 'http',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'HTTP_USER_AGENT': 'storm/1.0', 'HTTP_COOKIE': 'session=x' * 10}
+
+
+def run(app, requests, threads):
+    def worker():
+        for i in range(requests // threads):
+            try:
+                app(make_environ(), None)
+            except KeyError:
+                pass
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return (time.time() - start) / requests
+
+
+def main(argv=sys.argv):
+    requests = int(argv[1]) if len(argv) > 1 else 5000
+    threads = int(argv[2]) if len(argv) > 2 else 4
+    logger = logging.getLogger('storm')
+    logger.addHandler(logging.StreamHandler(NativeStream()))
+    logger.propagate = False
+
+    bare = run(failing_app, requests, threads)
+    print('%-10s %8.1f us/request' % ('bare', bare * 1e6))
+    for name, policy in [('capture', None),
+                         ('policy', CapturePolicy(10))]:
+        elog = ErrorLog(failing_app, 'storm', 20, '/__error_log__', (),
+                        capture_policy=policy)
+        per_request = run(elog, requests, threads)
+        print('%-10s %8.1f us/request (+%.1f us)' % (
+            name, per_request * 1e6, (per_request - bare) * 1e6))
+        if policy is not None:
+            print('           captured %d, suppressed %d' % (
+                policy.captured, policy.suppressed))
+
+
+if __name__ == '__main__':
+    main()
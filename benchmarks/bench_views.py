@@ -0,0 +1,67 @@
+"""Measure requests/sec for the index and entry views.
+
+"reparse" clears the template cache before every request, which is what
+the views used to cost; "cached" is the default and "reload" is
+``reload_templates = true`` (one ``stat`` per request).
+
+Run with ``python benchmarks/bench_views.py [keep]``.
+"""
+import sys
+import time
+
+import repoze.errorlog
+from repoze.errorlog import ErrorLog
+
+
+def make_errorlog(keep, reload_templates=False):
+    elog = ErrorLog(None, None, keep, '/__error_log__', (),
+                    reload_templates=reload_templates, max_groups=keep)
+    for i in range(keep):
+        # a distinct exception type per error, so each gets its own group
+        exc = type('Error%d' % i, (Exception,), {})
+        try:
+            raise exc('boom')
+        except exc:
+            elog.insert_error(elog.new_identifier(), sys.exc_info(), {})
+    return elog
+
+
+def make_environ(query_string=''):
+    return {'PATH_INFO': '/__error_log__', 'QUERY_STRING': query_string,
+            'wsgi.url_scheme': 'http', 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80'}
+
+
+def requests_per_second(elog, environ, before=None, duration=1.0):
+    def start_response(status, headers):
+        pass
+    count = 0
+    start = time.time()
+    while True:
+        if before is not None:
+            before()
+        for chunk in elog(dict(environ), start_response):
+            pass
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= duration:
+            return count / elapsed
+
+
+def main(argv=sys.argv):
+    keep = int(argv[1]) if len(argv) > 1 else 20
+    views = [('index', make_environ()),
+             ('entry', make_environ('entry=0'))]
+    modes = [('reparse', False, repoze.errorlog._templates.clear),
+             ('cached', False, None),
+             ('reload', True, None)]
+    print('keep=%d' % keep)
+    for view, environ in views:
+        for mode, reload_templates, before in modes:
+            elog = make_errorlog(keep, reload_templates)
+            rps = requests_per_second(elog, environ, before)
+            print('%-6s %-8s %10.0f req/s' % (view, mode, rps))
+
+
+if __name__ == '__main__':
+    main()
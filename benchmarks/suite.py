@@ -0,0 +1,273 @@
+"""Benchmark suite for the hot paths of ``ErrorLog``, with JSON baselines.
+
+Cases:
+
+- ``passthrough``: a request which doesn't fail, through ``ErrorLog``
+- ``insert_error.depth<D>.environ<E>``: recording an error raised ``D``
+  frames deep, with ``E`` extra environ keys
+- ``index.keep<K>`` / ``entry.keep<K>``: rendering the first page of the
+  index, and an entry, with ``K`` distinct errors in history
+- ``construct_url``, ``parse_querystring``: the WSGI helpers
+- ``contention.threads<T>``: ``T`` threads sending requests of which one in
+  ten fails, through one ``ErrorLog`` (time per request)
+
+Each case is timed with ``timeit``: the best and median of several runs,
+in seconds per call.
+
+Usage::
+
+    python benchmarks/suite.py run [-o results.json] [-k substring] [--quick]
+    python benchmarks/suite.py compare baseline.json [results.json]
+                                       [--threshold 0.1]
+
+``run`` prints the results and, with ``-o``, saves them as JSON; keep such
+a file (made on the same machine) as a baseline.  ``compare`` compares the
+results in a file, or of a fresh run, against a baseline, and exits with
+status 1 if a case got slower than the baseline by more than the threshold
+(a fraction, default 10%).  Best times are compared, as they are the least
+disturbed by other activity on the machine.
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+import timeit
+
+from repoze.errorlog import ErrorLog
+from repoze.errorlog import _construct_url
+from repoze.errorlog import _parse_querystring
+
+
+def app(environ, start_response):
+    if environ.get('QUERY_STRING') == 'fail':
+        raise KeyError('cart')
+    start_response('200 OK', [('content-type', 'text/plain')])
+    return [b'hello']
+
+
+def start_response(status, headers):
+    pass
+
+
+def make_environ(extra=0, query=''):
+    environ = {'PATH_INFO': '/some/page', 'SCRIPT_NAME': '',
+               'REQUEST_METHOD': 'GET', 'QUERY_STRING': query,
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'HTTP_HOST': 'localhost:8080', 'wsgi.url_scheme': 'http'}
+    for i in range(extra):
+        environ['HTTP_X_HEADER_%d' % i] = 'value %d' % i * 4
+    return environ
+
+
+def make_errorlog(keep=20):
+    # keep every error in full, as samples would otherwise stop that
+    return ErrorLog(app, None, keep, '/__error_log__', (),
+                    samples=10 ** 9, max_groups=10 ** 6)
+
+
+def raise_at(depth, exc_type=KeyError):
+    if depth:
+        raise_at(depth - 1, exc_type)
+    raise exc_type('cart')
+
+
+def exc_info_at(depth, exc_type=KeyError):
+    try:
+        raise_at(depth, exc_type)
+    except exc_type:
+        return sys.exc_info()
+
+
+def passthrough():
+    elog = make_errorlog()
+    environ = make_environ()
+    return lambda: elog(dict(environ), start_response)
+
+
+def insert_error(depth, extra):
+    elog = make_errorlog()
+    exc_info = exc_info_at(depth)
+    environ = make_environ(extra)
+    def insert():
+        elog.insert_error(elog.new_identifier(), exc_info, environ)
+    return insert
+
+
+def filled_errorlog(keep):
+    elog = make_errorlog(keep)
+    environ = make_environ(10)
+    for i in range(keep):
+        # a type of their own, so that each error is a group of its own
+        exc_type = type('Error%d' % i, (Exception,), {})
+        elog.insert_error(elog.new_identifier(), exc_info_at(5, exc_type),
+                          environ)
+    return elog
+
+
+def index(keep):
+    elog = filled_errorlog(keep)
+    return lambda: elog.index('http://localhost/__error_log__')
+
+
+def entry(keep):
+    elog = filled_errorlog(keep)
+    identifier = str(elog.counter - 1)
+    return lambda: elog.entry(identifier)
+
+
+def construct_url():
+    environ = make_environ()
+    return lambda: _construct_url(environ)
+
+
+def parse_querystring():
+    environ = make_environ(query='entry=12&page=2&limit=50&type=KeyError')
+    return lambda: _parse_querystring(environ)
+
+
+def contention(threads, requests=2000):
+    elog = make_errorlog()
+    def worker():
+        for i in range(requests // threads):
+            query = 'fail' if i % 10 == 0 else ''
+            try:
+                elog(make_environ(query=query), start_response)
+            except KeyError:
+                pass
+    def run():
+        workers = [threading.Thread(target=worker) for i in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    # timed per run of 'requests' requests; reported per request
+    run.per_call = requests
+    return run
+
+
+def cases():
+    yield 'passthrough', passthrough
+    for depth in (1, 20, 100):
+        for extra in (0, 100):
+            yield ('insert_error.depth%d.environ%d' % (depth, extra),
+                   lambda d=depth, e=extra: insert_error(d, e))
+    for keep in (20, 200, 1000):
+        yield 'index.keep%d' % keep, lambda k=keep: index(k)
+        yield 'entry.keep%d' % keep, lambda k=keep: entry(k)
+    yield 'construct_url', construct_url
+    yield 'parse_querystring', parse_querystring
+    for threads in (1, 4, 16):
+        yield ('contention.threads%d' % threads,
+               lambda t=threads: contention(t))
+
+
+def measure(func, budget, repeat):
+    """ Return the best and median time per call of 'func', timed in
+    'repeat' runs of about 'budget' seconds each.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= budget / 10 or number >= 10 ** 7:
+            break
+        number *= 10
+    number = max(1, int(number * budget / max(elapsed, 1e-9)))
+    runs = sorted(t / number for t in timer.repeat(repeat, number))
+    per_call = getattr(func, 'per_call', 1)
+    return runs[0] / per_call, runs[len(runs) // 2] / per_call
+
+
+def run(args):
+    budget, repeat = (0.05, 3) if args.quick else (0.2, 5)
+    results = {}
+    for name, setup in cases():
+        if args.k and args.k not in name:
+            continue
+        best, median = measure(setup(), budget, repeat)
+        results[name] = {'best': best, 'median': median}
+        print('%-36s %12s  (median %s)' % (name, _format(best),
+                                            _format(median)))
+    data = {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': time.time(),
+            'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    return data
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.results:
+        with open(args.results) as f:
+            current = json.load(f)
+    else:
+        current = run(args)
+    if baseline.get('python') != current.get('python'):
+        print('warning: baseline made with Python %s, results with %s' %
+              (baseline.get('python'), current.get('python')))
+    regressions = []
+    before = baseline['results']
+    after = current['results']
+    for name in sorted(set(before) | set(after)):
+        if name not in after:
+            print('%-36s missing from the results' % name)
+            continue
+        if name not in before:
+            print('%-36s new: %s' % (name, _format(after[name]['best'])))
+            continue
+        ratio = after[name]['best'] / before[name]['best']
+        flag = ''
+        if ratio > 1 + args.threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-36s %12s -> %12s  %+6.1f%%%s' % (
+            name, _format(before[name]['best']), _format(after[name]['best']),
+            (ratio - 1) * 100, flag))
+    if regressions:
+        print('%d case(s) slower by more than %d%%' % (
+            len(regressions), args.threshold * 100))
+        return 1
+    return 0
+
+
+def _format(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.2f %s' % (seconds / scale, unit)
+    return '%.1f ns' % (seconds / 1e-9)
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog='suite.py', description='Benchmark ErrorLog hot paths.')
+    commands = parser.add_subparsers(dest='command')
+    for name in ('run', 'compare'):
+        command = commands.add_parser(name)
+        if name == 'compare':
+            command.add_argument('baseline')
+            command.add_argument('results', nargs='?')
+            command.add_argument('--threshold', type=float, default=0.1)
+        command.add_argument('-o', '--output',
+                             help='save the results of the run as JSON')
+        command.add_argument('-k', help='only run cases containing this')
+        command.add_argument('--quick', action='store_true',
+                             help='shorter, noisier runs')
+    args = parser.parse_args(argv[1:])
+    if args.command == 'run':
+        run(args)
+        return 0
+    if args.command == 'compare':
+        return compare(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
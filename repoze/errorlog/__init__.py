@@ -12,23 +12,57 @@
 #
 ##############################################################################
 
+import binascii
+import hashlib
+import itertools
+import json
+import linecache
+from logging import ERROR
 from logging import getLogger
 import os
 import pprint
 import sys
 import traceback
 import time
+from xml.sax.saxutils import escape as xml_escape
 
-from ._compat import NativeStream
 from ._compat import parse_qsl
 from ._compat import quote
+from ._compat import urlencode
+from .store import GroupIndex
+from .store import RingBuffer
+from .store import make_store
+from .store import select_groups
+from .policy import CapturePolicy
+from .export import make_exporter
+from .limits import RecordLimits
+from .ignore import IgnoreRules
+from .ignore import parse_statuses
+from .ignore import resolve
+from .metrics import Metrics
+from .variables import LocalsCapture
+from .search import SearchIndex
+from .search import error_tokens
+from .search import tokenize
+from .source import shared_cache
+from .stream import Broadcaster
+from .writer import LogWriter
+from .writer import make_record
 
 import meld3
 
 _HERE = os.path.abspath(os.path.dirname(__file__))
 
-class ErrorLog:
-    def __init__(self, application, channel, keep, path, ignored_exceptions):
+# the most precise clock available, for timing captures
+_timer = getattr(time, 'perf_counter', time.time)
+
+class ErrorLog(object):
+    def __init__(self, application, channel, keep, path, ignored_exceptions,
+                 reload_templates=False, samples=5, max_groups=100,
+                 log_writer=None, store=None, capture_policy=None,
+                 record_limits=None, capture_locals=None, broadcaster=None,
+                 metrics=None, ignore_rules=None, exporters=(),
+                 context_lines=0, source_cache=None):
         """ WSGI Middleware which logs errors to a confligurable place
         and exposes a web user interface to display the last N errors.
 
@@ -44,6 +78,63 @@ class ErrorLog:
 
         o ignored_exceptions is a list of exceptions (Python references) to
           ignore (to refrain from logging or adding to exception history).
+
+        o reload_templates, if true, makes the views check the modification
+          time of their templates on each request and reparse them when
+          they change (useful while editing them).  Otherwise each template
+          is parsed once per process.
+
+        o samples is the number of occurrences of each kind of error (as
+          identified by its exception type and the functions in its
+          traceback) kept in full in the exception history at a time
+          (at least 1); further occurrences are only counted, until one of
+          those kept is evicted from the history.
+
+        o max_groups is the number of kinds of error to keep occurrence
+          counts for.
+
+        o log_writer, if not None, is a ``repoze.errorlog.writer.LogWriter``
+          used to send messages to 'channel' from a background thread, so
+          that slow log handlers don't hold up failing requests.
+
+        o store, if not None, holds the exception history instead of a
+          ``repoze.errorlog.store.RingBuffer`` of 'keep' errors private to
+          this process (see ``repoze.errorlog.store.make_store``).
+
+        o capture_policy, if not None, is a
+          ``repoze.errorlog.policy.CapturePolicy`` deciding which errors are
+          recorded and logged in full; the others are only counted.
+
+        o record_limits, if not None, is a
+          ``repoze.errorlog.limits.RecordLimits`` bounding the size of each
+          error kept in history and choosing the environ values it keeps.
+
+        o capture_locals, if not None, is a
+          ``repoze.errorlog.variables.LocalsCapture`` recording summaries of
+          the local variables of the innermost frames of each error kept in
+          history.
+
+        o broadcaster, if not None, is the
+          ``repoze.errorlog.stream.Broadcaster`` through which errors are
+          sent to the clients of the ``<path>/stream`` view.
+
+        o metrics, if not None, is the ``repoze.errorlog.metrics.Metrics``
+          counting errors and timing their capture for the
+          ``<path>/metrics`` view.
+
+        o ignore_rules, if not None, is a
+          ``repoze.errorlog.ignore.IgnoreRules`` naming more exceptions to
+          ignore, by module, message or HTTP status as well as by class.
+
+        o exporters is a sequence of ``repoze.errorlog.export.Exporter``
+          objects, each shipping the errors recorded to a file or a
+          collector from a background thread.
+
+        o context_lines is the number of lines of source shown on either
+          side of the line of each frame in the error view (only the line
+          itself if 0).  They are read when the error is viewed, from
+          'source_cache' if not None, else from the
+          ``repoze.errorlog.source.SourceCache`` shared by the process.
         """
         self.application = application
         self.channel = channel
@@ -51,76 +142,392 @@ class ErrorLog:
         self.path = path
         self.counter = 0
         self.ignored_exceptions = ignored_exceptions
-        self.errors = []
+        self.reload_templates = reload_templates
+        if store is None:
+            store = RingBuffer(keep)
+        self.history = store
+        self.groups = GroupIndex(max_groups, samples)
+        self.log_writer = log_writer
+        self.capture_policy = capture_policy
+        if record_limits is None:
+            record_limits = RecordLimits()
+        self.record_limits = record_limits
+        self.capture_locals = capture_locals
+        self.search_index = SearchIndex()
+        if broadcaster is None:
+            broadcaster = Broadcaster()
+        self.broadcaster = broadcaster
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.ignore_rules = ignore_rules
+        self.exporters = tuple(exporters)
+        self.context_lines = context_lines
+        if source_cache is None:
+            source_cache = shared_cache
+        self.source_cache = source_cache
+        self._identifiers = itertools.count()
+        self._identifier_prefix = None
+        self._pid = None
+
+    def _get_errors(self):
+        return list(self.history)
+
+    def _set_errors(self, errors):
+        self.history.clear()
+        self.search_index.clear()
+        for error in reversed(errors):
+            self._append(error)
+
+    errors = property(_get_errors, _set_errors,
+                      doc="Snapshot of the exception history, newest first.")
 
     def new_identifier(self):
-        identifier = str(self.counter)
-        self.counter += 1
-        return identifier
-        
+        # next() on an itertools.count is atomic under the GIL, so
+        # concurrent requests can never be handed the same identifier.
+        counter = next(self._identifiers)
+        self.counter = counter + 1
+        if self.history.shared:
+            # other processes number their errors from 0 too
+            return '%s-%d' % (self._process_token(), counter)
+        return str(counter)
+
+    def _process_token(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # a fresh token for each (possibly forked) process
+            self._identifier_prefix = binascii.hexlify(os.urandom(4)).decode()
+            self._pid = pid
+        return self._identifier_prefix
+
     def __call__(self, environ, start_response):
-        path_info = environ.get('PATH_INFO')
+        view, rest = _route(self.path, environ.get('PATH_INFO') or '')
+        if view == 'view':
+            return self.view(environ, start_response)
+        if view == 'api':
+            return self.api(environ, start_response, rest)
+        if view == 'stream':
+            return self.stream(environ, start_response)
+        if view == 'metrics':
+            return self.scrape(environ, start_response)
 
-        if path_info == self.path:
-            # we're being asked to render a view
-            querydata = dict(_parse_querystring(environ))
-            if 'entry' in querydata:
-                body = self.entry(querydata['entry'])
-            else:
-                url = _construct_url(environ)
-                body = self.index(url)
+        # we need to try to catch an error.  We place the error log path
+        # and identifier in the environment so the application or other
+        # middleware can form a URL to the exception; the identifier is
+        # only allocated if it is used, which few requests ever do.
+        identifier = _LazyIdentifier(self)
+        environ['repoze.errorlog.path'] = self.path
+        environ['repoze.errorlog.entryid'] = identifier
+        try:
+            app_iter = self.application(environ, start_response)
+        except self.ignored_exceptions:
+            # just reraise an ignored exception
+            self.ignored()
+            raise
+        except:
+            self.log_error(str(identifier), environ)
+            raise
+        if isinstance(app_iter, (list, tuple)):
+            # nothing left that could fail
+            return app_iter
+        if _is_file_wrapper(app_iter, environ):
+            # don't defeat the server's zero-copy sendfile path
+            return app_iter
+        return _ErrorLogIterator(self, app_iter, identifier, environ)
+
+    def view(self, environ, start_response):
+        """ Serve the exception history views found at 'path'. """
+        querydata = dict(_parse_querystring(environ))
+        if 'entry' in querydata:
+            body = self.entry(querydata['entry'])
             start_response('200 OK', [('content-type', 'text/html'),
                                       ('content-length', str(len(body)))])
             return [body]
-        else:
-            # we need to try to catch an error
-            identifier = self.new_identifier()
-            # we place the error log path and identifier in the
-            # environment so the application or other middleware can
-            # form a URL to the exception
-            environ['repoze.errorlog.path'] = self.path
-            environ['repoze.errorlog.entryid'] = identifier
-            try:
-                return self.application(environ, start_response)
-            except self.ignored_exceptions:
-                # just reraise an ignored exception
-                raise
-            except:
-                self.insert_error(identifier, sys.exc_info(), environ)
-                if self.channel is None:
-                    errors = environ.get('wsgi.errors')
-                    if errors:
-                        traceback.print_exc(None, errors)
+        url = _construct_url(environ)
+        # stream the index; its length isn't known up front
+        start_response('200 OK', [('content-type', 'text/html')])
+        return self.iter_index(url, script_name=environ.get('SCRIPT_NAME', ''),
+                               **_index_params(querydata))
+
+    def ignored(self):
+        """ Count the ignored exception being handled. """
+        self.metrics.ignore(_type_name(sys.exc_info()[0]))
+
+    def log_error(self, identifier, environ, exc_info=None):
+        """ Record the exception currently being handled in the exception
+        history and write it to the configured channel.  Must be called from
+        an ``except`` block, unless 'exc_info' (a ``sys.exc_info()`` tuple)
+        is passed.
+        """
+        started = _timer()
+        if exc_info is None:
+            exc_info = sys.exc_info()
+        if (self.ignore_rules is not None and
+                self.ignore_rules.matches(exc_info[1])):
+            self.metrics.ignore(_type_name(exc_info[0]))
+            return
+        exc_type = _type_name(exc_info[0])
+        metrics = self.metrics
+        metrics.error(exc_type)
+        if self.capture_policy is not None:
+            # decided before snapshotting the traceback, which is most of
+            # the cost of an error we'd only count
+            fingerprint = _exception_fingerprint(exc_info)
+            group = self.groups.get(fingerprint)
+            if not self.capture_policy.allow(exc_type, group is None):
+                # storm: just count it
+                if group is not None:
+                    desc = group.description
                 else:
-                    logger = getLogger(self.channel)
-                    logger.exception('\n')
-                raise
+                    desc = _root_summary(exc_info)
+                self.groups.add(fingerprint, desc, identifier, time.time(),
+                                exc_type, sample=False)
+                metrics.suppress(exc_type)
+                metrics.capture.observe(_timer() - started)
+                return
+        tb_snapshot = TracebackSnapshot(exc_info)
+        try:
+            self.insert_error(identifier, exc_info, environ, tb_snapshot)
+            captured = _timer()
+            metrics.capture.observe(captured - started)
+            if self.channel is None:
+                errors = environ.get('wsgi.errors')
+                if errors:
+                    traceback.print_exception(exc_info[0], exc_info[1],
+                                              exc_info[2], None, errors)
+            else:
+                logger = getLogger(self.channel)
+                if self.log_writer is None:
+                    logger.error('\n', exc_info=exc_info)
+                elif logger.isEnabledFor(ERROR):
+                    record = make_record(logger, '\n')
+                    self.log_writer.log(logger, record, tb_snapshot)
+            metrics.logging.observe(_timer() - captured)
+        finally:
+            del exc_info
 
-    def index(self, url):
-        template = os.path.join(_HERE, 'templates', 'errors.html')
-        root = meld3.parse_xml(template)
-        if self.errors:
-            iterator = root.findmeld('error_li').repeat(self.errors)
-            for li_element, error in iterator:
-                t = li_element.findmeld('error_time')
-                t.content(error.time)
-                url = li_element.findmeld('error_url')
-                url.attributes(href=error.url)
-                url.content(error.description)
-        else:
+    def index(self, url, page=1, limit=50, exc_type=None, since=None,
+              script_name='', query=None):
+        return b''.join(self.iter_index(url, page, limit, exc_type, since,
+                                        script_name, query))
+
+    def iter_index(self, url, page=1, limit=50, exc_type=None, since=None,
+                   script_name='', query=None):
+        """ Render page 'page' of the index, listing up to 'limit' groups,
+        as an iterable of chunks of the page.
+
+        Only groups whose exception type is (or, if not dotted, ends with)
+        'exc_type' and which were seen at or after 'since' (seconds since
+        the epoch) are listed, if those are not None, and if 'query' is not
+        None, only groups with an error containing each of its words (see
+        ``search``).  Links to errors are prefixed with 'script_name', where
+        the middleware is mounted.
+        """
+        groups, more = self._select_groups(page, limit, exc_type, since,
+                                           query)
+        root = _load_template('errors.html', self.reload_templates)
+        if not groups:
             content = root.findmeld('content')
             content.content('<h1>No Recent Errors</h1>', structure=True)
-        return root.write_xhtmlstring()
+            yield root.write_xhtmlstring()
+            return
+
+        pager = root.findmeld('pager')
+        params = dict(limit=limit, type=exc_type, since=since, q=query)
+        for name, target, show in (('newer', page - 1, page > 1),
+                                   ('older', page + 1, more)):
+            link = pager.findmeld(name)
+            if show:
+                link.attributes(href=_page_url(url, params, target))
+            else:
+                link.deparent()
+
+        # render the list item once, with placeholders to fill in for
+        # each group, and send the page around the list separately
+        li = root.findmeld('error_li')
+        for field in _INDEX_FIELDS:
+            li.findmeld(field).content(_placeholder(field))
+        li.findmeld('error_url').attributes(href=_placeholder('error_href'))
+        item = li.write_xhtmlstring(fragment=True).decode('utf-8')
+        item = item.replace('%', '%%')
+        for field in _INDEX_FIELDS + ('error_href',):
+            item = item.replace(_placeholder(field), '%%(%s)s' % field)
+        li.replace(_placeholder('items'))
+        head, tail = root.write_xhtmlstring().split(
+            _placeholder('items').encode('utf-8'))
+
+        yield head
+        for group in groups:
+            yield (item % {
+                'error_time': _escape(time.ctime(group.last_seen)),
+                # link to the latest occurrence kept in full, if any
+                'error_href': _escape(self._group_url(group, script_name) or
+                                      script_name + self.path),
+                'error_url': _escape(group.description),
+                'error_count': group.count,
+                'error_first_seen': _escape(time.ctime(group.first_seen)),
+                }).encode('utf-8')
+        yield tail
+
+    def _select_groups(self, page, limit, exc_type, since, query=None):
+        # return the groups to list on a page, and whether there are more
+        fingerprints = None
+        if query is not None:
+            fingerprints = self.search(query)
+        # one more than the page holds, to tell whether there are more
+        args = (exc_type, since, fingerprints, (page - 1) * limit, limit + 1)
+        if self.history.shared:
+            # our own counters only cover this process; the store may
+            # select its groups more efficiently
+            groups = self.history.groups(*args)
+        else:
+            groups = select_groups(self.groups, *args)
+        more = len(groups) > limit
+        del groups[limit:]
+        return groups, more
+
+    def search(self, query):
+        """ Return the fingerprints of the errors in history whose exception
+        types, messages, file names or function names contain every word
+        of 'query' (case insensitively).
+        """
+        if not self.history.shared:
+            return self.search_index.fingerprints(query)
+        # other processes add to the history too, so there is no index
+        # we could keep up to date: look at every error
+        tokens = tokenize(query)
+        return set(error.fingerprint for error in self.history
+                   if tokens and tokens <= error_tokens(error))
+
+    def etag(self):
+        """ Return an entity tag which changes whenever an error is
+        recorded or counted.
+        """
+        version = self.history.version()
+        if not self.history.shared:
+            # a history of this process only: its version (and our counts)
+            # start over in each process
+            version = '%s.%s.%d' % (self._process_token(), version,
+                                    self.groups.occurrences)
+        return '"%s"' % version
+
+    def api(self, environ, start_response, path):
+        """ Serve the JSON API below ``<path>/api/errors``.
+
+        'path' is what follows that prefix: empty for the list of groups
+        (which accepts the index view's query string parameters), or
+        ``/<identifier>`` for an error.  Responses carry an ``ETag`` and a
+        matching ``If-None-Match`` gets a bodiless 304 response.
+        """
+        if path in ('', '/'):
+            etag = self.etag()
+            if _etag_matches(environ, etag):
+                return _not_modified(start_response, etag)
+            params = _index_params(dict(_parse_querystring(environ)))
+            page = params.get('page', 1)
+            limit = params.get('limit', 50)
+            groups, more = self._select_groups(page, limit,
+                                               params.get('exc_type'),
+                                               params.get('since'),
+                                               params.get('query'))
+            script_name = environ.get('SCRIPT_NAME', '')
+            data = {'page': page, 'limit': limit, 'more': more,
+                    'groups': [self._group_data(g, script_name)
+                               for g in groups]}
+            return _json_response(start_response, '200 OK', data, etag)
+        identifier = path[1:]
+        # an error never changes once recorded; the identifiers of a shared
+        # history carry the token of their process already, those of a
+        # private one are reused by each process
+        etag = identifier.replace('"', '')
+        if not self.history.shared:
+            etag = '%s-%s' % (self._process_token(), etag)
+        etag = '"%s"' % etag
+        error = self.get_error(identifier)
+        if error is None:
+            return _json_response(start_response, '404 Not Found',
+                                  {'error': 'expired'})
+        if _etag_matches(environ, etag):
+            return _not_modified(start_response, etag)
+        data = {'identifier': error.identifier,
+                'description': error.description,
+                'type': error.exc_type,
+                'fingerprint': error.fingerprint,
+                'time': error.time,
+                'timestamp': error.timestamp,
+                'url': error.url,
+                'traceback': str(error.traceback),
+                'environ': error.environ}
+        return _json_response(start_response, '200 OK', data, etag)
+
+    def stream(self, environ, start_response):
+        """ Serve a ``text/event-stream`` of the errors recorded from now on.
+
+        Each error is sent as an ``error`` event whose data is a JSON object
+        describing it; an ``identifier`` of null means that only its
+        occurrence was counted.  If the client falls behind, a ``dropped``
+        event tells how many errors were skipped.
+        """
+        subscription = self.broadcaster.subscribe()
+        if subscription is None:
+            return _json_response(start_response, '503 Service Unavailable',
+                                  {'error': 'too many subscribers'})
+        start_response('200 OK', [('content-type', 'text/event-stream'),
+                                  ('cache-control', 'no-cache'),
+                                  # don't let nginx buffer the events
+                                  ('x-accel-buffering', 'no')])
+        return _EventStream(subscription, self.broadcaster.heartbeat)
+
+    def scrape(self, environ, start_response):
+        """ Serve the metrics in the Prometheus text exposition format. """
+        gauges = [('history_errors', 'Errors in the exception history.',
+                   len(self.history)),
+                  ('groups', 'Kinds of error counted.', len(self.groups)),
+                  ('stream_subscribers', 'Clients of the event stream.',
+                   len(self.broadcaster.subscribers))]
+        if self.log_writer is not None:
+            gauges.append(('log_dropped',
+                           'Messages dropped by the background log writer.',
+                           self.log_writer.dropped))
+        if self.exporters:
+            gauges.append(('export_dropped',
+                           'Errors dropped because an export queue was full.',
+                           sum(e.dropped for e in self.exporters)))
+            gauges.append(('export_failed',
+                           'Errors which could not be exported.',
+                           sum(e.failed for e in self.exporters)))
+        body = self.metrics.render(gauges).encode('utf-8')
+        start_response('200 OK', [
+            ('content-type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('content-length', str(len(body))),
+            ('cache-control', 'no-cache')])
+        return [body]
+
+    def _group_data(self, group, script_name):
+        return {'fingerprint': group.fingerprint,
+                'description': group.description,
+                'type': group.exc_type,
+                'count': group.count,
+                'first_seen': group.first_seen,
+                'last_seen': group.last_seen,
+                'latest': group.samples and group.samples[-1] or None,
+                'url': self._group_url(group, script_name)}
+
+    def _group_url(self, group, script_name):
+        # the URL of the latest occurrence of 'group' kept in full, or None
+        if not group.samples:
+            return None
+        return script_name + self.path + '?entry=%s' % group.samples[-1]
 
     def entry(self, identifier):
-        template = os.path.join(_HERE, 'templates', 'entry.html')
         error = self.get_error(identifier)
-        root = meld3.parse_xml(template)
+        root = _load_template('entry.html', self.reload_templates)
         if error:
             header = root.findmeld('header')
             header.content('Error at %s' % error.time)
             text = root.findmeld('text')
-            text.content(error.text)
+            text.content(error.render(self.context_lines,
+                                      self.source_cache))
         else:
             header = root.findmeld('header')
             header.content('Error Expired')
@@ -131,59 +538,773 @@ class ErrorLog:
         return root.write_xhtmlstring()
 
     def get_error(self, identifier):
-        for error in self.errors:
-            if error.identifier == identifier:
-                return error
-
-    def insert_error(self, identifier, exc_info, environ):
-        if len(self.errors) >= self.keep:
-            self.errors.pop()
-        f = NativeStream()
+        # str() allocates a request's lazy identifier, if that's passed
+        return self.history.get(str(identifier))
+
+    def insert_error(self, identifier, exc_info, environ, tb_snapshot=None):
         # we can't unpack the exception tuple or we'd cause a cycle
-        traceback.print_exception(exc_info[0],exc_info[1],exc_info[2],None,f)
-        desc = str(exc_info[0])
-        tb_rendering = f.getvalue()
-        time_str = time.ctime()
-        url = self.path +'?entry=%s' % identifier
-        error = Error(identifier, desc, tb_rendering, time_str, environ, url)
-        self.errors.insert(0, error)
-        
-class Error:
+        if tb_snapshot is None:
+            tb_snapshot = TracebackSnapshot(exc_info)
+        fingerprint = _fingerprint(tb_snapshot)
+        # the exception which started it all is the one to look at
+        desc = tb_snapshot.root_cause.summary
+        now = time.time()
+        kept = self.groups.add(fingerprint, desc, identifier, now,
+                               tb_snapshot.exc_type)
+        if not kept and self.history.shared:
+            # other processes (and retention by age) evict from a shared
+            # history without telling us: check that our samples are there
+            kept = self.groups.replace_expired(fingerprint, identifier,
+                                               self.history.contains)
+        url = '%s%s?entry=%s' % (environ.get('SCRIPT_NAME', ''),
+                                 self.path, identifier)
+        error = None
+        if kept:
+            if self.capture_locals is not None:
+                tb_snapshot.locals = self.capture_locals.capture(exc_info[2])
+            error = Error(identifier, desc, tb_snapshot, time.ctime(now),
+                          environ, url, fingerprint, now,
+                          self.record_limits)
+            self._append(error)
+        if self.broadcaster.subscribers or self.exporters:
+            group = self.groups.get(fingerprint)
+            data = {'identifier': kept and identifier or None,
+                    'description': desc,
+                    'type': tb_snapshot.exc_type,
+                    'fingerprint': fingerprint,
+                    'timestamp': now,
+                    'count': group is not None and group.count or 1,
+                    'url': kept and url or None}
+            if self.broadcaster.subscribers:
+                self.broadcaster.publish(_event('error', _json_dumps(data),
+                                                data['identifier']))
+            for exporter in self.exporters:
+                # serialized and sent by the exporter's thread
+                exporter.export(data, error)
+
+    def _append(self, error):
+        evicted = self.history.append(error) or ()
+        if evicted:
+            self.metrics.evict(len(evicted))
+        if not self.history.shared:
+            stored = True
+            for old in evicted:
+                if old is error:
+                    stored = False
+                else:
+                    self.search_index.remove(old.identifier)
+            if stored:
+                self.search_index.add(error)
+        for old in evicted:
+            # make room for a later occurrence to be kept in its place
+            self.groups.discard(old.fingerprint, old.identifier)
+
+def _fingerprint(tb_snapshot):
+    """ Identify the kind of an error by the types of its exceptions
+    (chained or grouped together) and the functions their tracebacks pass
+    through, as recorded by 'tb_snapshot'.
+
+    Line numbers are left out so that unrelated edits to a module don't
+    change the fingerprint of the errors raised in it.
+    """
+    parts = []
+    for snapshot in tb_snapshot.walk():
+        parts.append(snapshot.exc_type)
+        for filename, lineno, name in snapshot.frames:
+            parts.append('%s:%s' % (filename, name))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+def _exception_fingerprint(exc_info):
+    """ Return the ``_fingerprint`` of the snapshot of 'exc_info' (a
+    ``sys.exc_info()`` tuple), without making the snapshot.
+    """
+    parts = []
+    _exception_parts(exc_info[0], exc_info[1], exc_info[2], parts, set(), 0)
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+def _exception_parts(exc_type, value, tb, parts, seen, depth):
+    # walk the exceptions as TracebackSnapshot does
+    parts.append(_type_name(exc_type))
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        parts.append('%s:%s' % (code.co_filename, code.co_name))
+        tb = tb.tb_next
+    seen.add(id(value))
+    cause, explicit = _chained(value)
+    if cause is not None and id(cause) not in seen:
+        _exception_parts(type(cause), cause, cause.__traceback__, parts,
+                         seen, depth)
+    if isinstance(value, _GROUP_TYPES) and depth < _MAX_GROUP_DEPTH:
+        for member in value.exceptions[:_MAX_GROUP_WIDTH]:
+            _exception_parts(type(member), member, member.__traceback__,
+                             parts, seen, depth + 1)
+
+def _root_summary(exc_info):
+    # the ``summary`` of the ``root_cause`` of the snapshot of 'exc_info'
+    exc_type, value = exc_info[0], exc_info[1]
+    seen = set([id(value)])
+    cause, explicit = _chained(value)
+    while cause is not None and id(cause) not in seen:
+        exc_type, value = type(cause), cause
+        seen.add(id(value))
+        cause, explicit = _chained(value)
+    return _summary(traceback.format_exception_only(exc_type, value),
+                    _type_name(exc_type))
+
+_API_PATH = '/api/errors'
+_STREAM_PATH = '/stream'
+_METRICS_PATH = '/metrics'
+
+def _route(path, path_info):
+    """ Return which view of an error log at 'path' serves 'path_info'
+    ('view', 'api', 'stream' or 'metrics', or None for the application's
+    paths) and
+    the rest of 'path_info'.
+    """
+    if path_info.startswith(path):
+        rest = path_info[len(path):]
+        if not rest:
+            return 'view', rest
+        if rest == _API_PATH or rest.startswith(_API_PATH + '/'):
+            return 'api', rest[len(_API_PATH):]
+        if rest == _STREAM_PATH:
+            return 'stream', rest
+        if rest == _METRICS_PATH:
+            return 'metrics', rest
+    return None, path_info
+
+def _etag_matches(environ, etag):
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+def _not_modified(start_response, etag):
+    start_response('304 Not Modified', [('etag', etag)])
+    return []
+
+def _json_dumps(data):
+    return json.dumps(data, separators=(',', ':'), sort_keys=True,
+                      default=repr)
+
+def _json_response(start_response, status, data, etag=None):
+    body = _json_dumps(data).encode('utf-8')
+    headers = [('content-type', 'application/json'),
+               ('content-length', str(len(body))),
+               ('cache-control', 'no-cache')]
+    if etag is not None:
+        headers.append(('etag', etag))
+    start_response(status, headers)
+    return [body]
+
+def _event(name, data, identifier=None):
+    # a server-sent event; 'data' must be a single line
+    lines = []
+    if identifier is not None:
+        lines.append('id: %s\n' % identifier)
+    lines.append('event: %s\ndata: %s\n\n' % (name, data))
+    return ''.join(lines).encode('utf-8')
+
+class _EventStream(object):
+    """ The body of a ``stream`` response: the events published to
+    'subscription', with a comment every 'heartbeat' seconds without one.
+    """
+    def __init__(self, subscription, heartbeat):
+        self.subscription = subscription
+        self.heartbeat = heartbeat
+
+    def __iter__(self):
+        subscription = self.subscription
+        dropped = 0
+        # sent at once, so that the client knows it is connected
+        yield b': repoze.errorlog\n\n'
+        while True:
+            event = subscription.get(self.heartbeat)
+            if subscription.dropped != dropped:
+                count = subscription.dropped - dropped
+                dropped = subscription.dropped
+                yield _event('dropped', count)
+            if event is None:
+                yield b': keepalive\n\n'
+            else:
+                yield event
+
+    def close(self):
+        self.subscription.close()
+
+_INDEX_FIELDS = ('error_time', 'error_url', 'error_count',
+                 'error_first_seen')
+
+def _placeholder(name):
+    return '@@repoze.errorlog.%s@@' % name
+
+def _escape(value):
+    return xml_escape(value, {'"': '&quot;'})
+
+def _index_params(querydata):
+    # index() arguments from the query string; bad values are ignored
+    params = {}
+    for name, key, convert in (('page', 'page', int),
+                               ('limit', 'limit', int),
+                               ('type', 'exc_type', str),
+                               ('since', 'since', float),
+                               ('q', 'query', _strip)):
+        value = querydata.get(name)
+        if value:
+            try:
+                params[key] = convert(value)
+            except ValueError:
+                pass
+    if params.get('page', 1) < 1:
+        del params['page']
+    if 'page' in params:
+        # pages beyond it are empty anyway; its offsets still fit in what
+        # islice and SQLite take
+        params['page'] = min(params['page'], _MAX_PAGE)
+    if 'limit' in params:
+        params['limit'] = min(max(params['limit'], 1), _MAX_LIMIT)
+    return params
+
+_MAX_LIMIT = 1000
+# the stop offset of the page's groups, page * limit + 1, fits in an index
+_MAX_PAGE = sys.maxsize // (_MAX_LIMIT + 1)
+
+def _strip(value):
+    value = value.strip()
+    if not value:
+        raise ValueError(value)
+    return value
+
+def _page_url(url, params, page):
+    query = [(name, value) for name, value in sorted(params.items())
+             if value is not None]
+    query.append(('page', page))
+    return '%s?%s' % (url, urlencode(query))
+
+class _ErrorLogIterator(object):
+    """ Wrap a WSGI app_iter so that errors raised while it is iterated or
+    closed are recorded too.  Chunks are passed through as they come.
+    """
+    __slots__ = ('errorlog', 'app_iter', 'identifier', 'environ')
+
+    def __init__(self, errorlog, app_iter, identifier, environ):
+        self.errorlog = errorlog
+        self.app_iter = app_iter
+        self.identifier = identifier
+        self.environ = environ
+
+    def __iter__(self):
+        try:
+            for chunk in self.app_iter:
+                yield chunk
+        except GeneratorExit:
+            raise
+        except self.errorlog.ignored_exceptions:
+            self.errorlog.ignored()
+            raise
+        except:
+            self._log_error()
+            raise
+
+    def close(self):
+        close = getattr(self.app_iter, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except self.errorlog.ignored_exceptions:
+                self.errorlog.ignored()
+                raise
+            except:
+                self._log_error()
+                raise
+
+    def _log_error(self):
+        identifier = self.identifier
+        if identifier is None:
+            # the request already has an entry; don't overwrite it
+            identifier = self.errorlog.new_identifier()
+        self.identifier = None
+        self.errorlog.log_error(str(identifier), self.environ)
+
+class _LazyIdentifier(object):
+    """ The identifier of the error a request would cause, allocated the
+    first time it is turned into a string (or compared to one).
+    """
+    __slots__ = ('errorlog', 'value')
+
+    def __init__(self, errorlog):
+        self.errorlog = errorlog
+        self.value = None
+
+    def __str__(self):
+        if self.value is None:
+            self.value = self.errorlog.new_identifier()
+        return self.value
+
+    def __eq__(self, other):
+        return str(self) == other
+
+    def __ne__(self, other):
+        return str(self) != other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __add__(self, other):
+        return str(self) + other
+
+    def __radd__(self, other):
+        return other + str(self)
+
+    def __repr__(self):
+        return repr(str(self))
+
+def _is_file_wrapper(app_iter, environ):
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper is None:
+        return False
+    try:
+        return isinstance(app_iter, file_wrapper)
+    except TypeError:
+        # wsgi.file_wrapper is allowed to be any callable, not just a class
+        return False
+
+_templates = {}
+
+def _load_template(name, reload=False):
+    """Return a private copy of the parsed template 'name'.
+
+    Templates are parsed once per process and cloned for each render.  If
+    'reload' is true, a template whose file has changed since it was parsed
+    is parsed again.
+    """
+    filename = os.path.join(_HERE, 'templates', name)
+    cached = _templates.get(filename)
+    if reload:
+        mtime = os.path.getmtime(filename)
+        if cached is not None and cached[0] != mtime:
+            cached = None
+    else:
+        mtime = None
+    if cached is None:
+        cached = _templates[filename] = (mtime, meld3.parse_xml(filename))
+    return cached[1].clone()
+
+class TracebackSnapshot(object):
+    """Compact, picklable summary of an exception and its traceback.
+
+    Only ``(filename, lineno, name)`` is recorded for each frame, plus the
+    formatted exception line(s); source lines are looked up and the text
+    assembled by ``render`` (or ``str()``), which yields the same output as
+    ``traceback.print_exception``.  Like ``traceback.TracebackException``,
+    it is a tree: the exception this one was chained to (``__cause__`` /
+    ``__context__``) is snapshotted as ``cause``, and the members of an
+    exception group as ``exceptions``.  ``omitted`` counts the outermost
+    frames dropped to save space.  ``locals``, if not None, holds the
+    summaries of the local variables of each frame made by a
+    ``repoze.errorlog.variables.LocalsCapture``; ``render`` only includes
+    them if asked to.
+    """
+    omitted = 0
+    locals = None
+    exceptions = None
+    more_exceptions = 0
+
+    def __init__(self, exc_info, frames=None, _seen=None, _depth=0):
+        if frames is None:
+            frames = _extract_frames(exc_info[2])
+        self.frames = frames
+        self.exc_type = _type_name(exc_info[0])
+        self.exception = traceback.format_exception_only(exc_info[0],
+                                                         exc_info[1])
+        self.cause = None
+        self.explicit_cause = False
+        value = exc_info[1]
+        if _seen is None:
+            _seen = set()
+        _seen.add(id(value))
+        cause, explicit = _chained(value)
+        if cause is not None and id(cause) not in _seen:
+            self.cause = TracebackSnapshot(
+                (type(cause), cause, cause.__traceback__), _seen=_seen,
+                _depth=_depth)
+            self.explicit_cause = explicit
+        if isinstance(value, _GROUP_TYPES) and _depth < _MAX_GROUP_DEPTH:
+            members = value.exceptions
+            self.exceptions = [
+                TracebackSnapshot((type(e), e, e.__traceback__),
+                                  _seen=_seen, _depth=_depth + 1)
+                for e in members[:_MAX_GROUP_WIDTH]]
+            self.more_exceptions = max(len(members) - _MAX_GROUP_WIDTH, 0)
+
+    @property
+    def root_cause(self):
+        """ The snapshot of the first exception of the chain. """
+        snapshot = self
+        while snapshot.cause is not None:
+            snapshot = snapshot.cause
+        return snapshot
+
+    @property
+    def summary(self):
+        """ The exception's type and the first line of its message. """
+        return _summary(self.exception, self.exc_type)
+
+    def walk(self):
+        """ Yield this snapshot and then, depth first, those of the
+        exception it was chained to and of the members of its group.
+        """
+        yield self
+        if self.cause is not None:
+            for snapshot in self.cause.walk():
+                yield snapshot
+        for member in self.exceptions or ():
+            for snapshot in member.walk():
+                yield snapshot
+
+    def render(self, show_locals=False, context_lines=0, source=None):
+        """ Return the text of the traceback.  If 'context_lines' is not
+        0, that many lines of source are shown on either side of the line of
+        each frame, as read from the ``repoze.errorlog.source.SourceCache``
+        'source' (the one shared by the process if None).
+        """
+        context = _RenderContext()
+        if context_lines:
+            context.context_lines = context_lines
+            if source is None:
+                source = shared_cache
+            context.source = source
+        self._render(context, show_locals)
+        return ''.join(context.lines)
+
+    def __str__(self):
+        return self.render()
+
+    def _render(self, context, show_locals):
+        # the layout of traceback.TracebackException.format
+        if self.cause is not None:
+            self.cause._render(context, show_locals)
+            if self.explicit_cause:
+                context.emit(_CAUSE_MESSAGE)
+            else:
+                context.emit(_CONTEXT_MESSAGE)
+        if self.exceptions is None:
+            if self.frames:
+                context.emit('Traceback (most recent call last):\n')
+            self._render_frames(context, show_locals)
+            context.emit(''.join(self.exception))
+            return
+        toplevel = context.depth == 0
+        if toplevel:
+            context.depth += 1
+        if self.frames:
+            context.emit('Exception Group Traceback (most recent call '
+                         'last):\n', toplevel and '+' or '|')
+        self._render_frames(context, show_locals)
+        context.emit(''.join(self.exception))
+        count = len(self.exceptions) + (self.more_exceptions and 1)
+        for index in range(count):
+            last = index == count - 1
+            title = '%d' % (index + 1)
+            if index == _MAX_GROUP_WIDTH:
+                title = '...'
+            context.lines.append('%s%s+---------------- %s ----------------'
+                                 '\n' % (context.indent(),
+                                         index and '  ' or '+-', title))
+            context.depth += 1
+            if index < len(self.exceptions):
+                self.exceptions[index]._render(context, show_locals)
+            else:
+                context.emit('and %d more exception%s\n' % (
+                    self.more_exceptions,
+                    self.more_exceptions > 1 and 's' or ''))
+            if last:
+                context.lines.append(context.indent() +
+                                     '+------------------------------------'
+                                     '\n')
+            context.depth -= 1
+        if toplevel:
+            context.depth = 0
+
+    def _render_frames(self, context, show_locals):
+        variables = self.locals
+        if not show_locals or variables is None:
+            variables = itertools.repeat(None)
+        lines = []
+        if self.omitted:
+            lines.append('  [%d frames omitted]\n' % self.omitted)
+        for (filename, lineno, name), names in zip(self.frames, variables):
+            lines.append('  File "%s", line %d, in %s\n' %
+                         (filename, lineno, name))
+            if context.context_lines:
+                lines.extend(_snippet(context.source, filename, lineno,
+                                      context.context_lines))
+            else:
+                line = linecache.getline(filename, lineno).strip()
+                if line:
+                    lines.append('    %s\n' % line)
+            for variable, summary in names or ():
+                lines.append('      %s = %s\n' % (variable, summary))
+        context.emit(''.join(lines))
+
+class _RenderContext(object):
+    # the state of traceback._ExceptionPrintContext
+    context_lines = 0
+    source = None
+
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+
+    def indent(self):
+        return ' ' * (2 * self.depth)
+
+    def emit(self, text, margin='|'):
+        prefix = self.indent()
+        if self.depth:
+            prefix += margin + ' '
+        for line in text.splitlines(True):
+            self.lines.append(prefix + line)
+
+def _snippet(source, filename, lineno, context_lines):
+    # the lines around 'lineno', numbered, the line itself marked, and
+    # dedented together
+    first, lines = source.context(filename, lineno, context_lines)
+    if lineno - first >= len(lines):
+        # no such line
+        return []
+    indent = min([len(line) - len(line.lstrip()) for line in lines
+                  if line.strip()] or [0])
+    width = len(str(first + len(lines) - 1))
+    snippet = []
+    for number, line in enumerate(lines, first):
+        snippet.append('  %s %*d  %s\n' % (
+            number == lineno and '->' or '  ', width, number,
+            line[indent:].rstrip()))
+    return snippet
+
+try:
+    _GROUP_TYPES = (BaseExceptionGroup,)
+except NameError: #pragma NO COVER Python < 3.11
+    _GROUP_TYPES = ()
+
+# as in traceback.TracebackException
+_MAX_GROUP_WIDTH = 15
+_MAX_GROUP_DEPTH = 10
+
+_CAUSE_MESSAGE = ('\nThe above exception was the direct cause '
+                  'of the following exception:\n\n')
+
+_CONTEXT_MESSAGE = ('\nDuring handling of the above exception, '
+                    'another exception occurred:\n\n')
+
+def _chained(value):
+    # the exception 'value' was chained to, and whether explicitly
+    cause = getattr(value, '__cause__', None)
+    explicit = cause is not None
+    if not explicit and not getattr(value, '__suppress_context__', False):
+        cause = getattr(value, '__context__', None)
+    return cause, explicit
+
+def _summary(exception, exc_type):
+    # the first line of the formatted 'exception' lines
+    for line in exception:
+        # skip the location lines of a SyntaxError
+        if line and not line[0].isspace():
+            return line.splitlines()[0]
+    return exc_type
+
+def _type_name(exc_type):
+    # 'KeyError' for builtins, 'package.module.Error' otherwise
+    module = exc_type.__module__
+    if module in ('builtins', 'exceptions'):
+        return exc_type.__name__
+    return '%s.%s' % (module, exc_type.__name__)
+
+def _extract_frames(tb):
+    # like traceback.extract_tb, but without reading any source files
+    frames = []
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append((code.co_filename, tb.tb_lineno, code.co_name))
+        tb = tb.tb_next
+    return frames
+
+_DEFAULT_LIMITS = RecordLimits()
+
+class Error(object):
     """Capture information about a single exception.
+
+    'tb_rendering' is either the traceback text or an object (such as a
+    ``TracebackSnapshot``) which renders it when passed to ``str()``; the
+    name of the exception type is taken from the latter's ``exc_type``.  Only
+    a filtered copy of 'environ' is kept, and the record is cut down to fit
+    the ``repoze.errorlog.limits.RecordLimits`` passed as 'limits'; its
+    ``size`` is an estimate of the bytes it holds.  ``text`` is rendered
+    each time it is asked for rather than kept, so that viewing an error
+    doesn't make it hold more than ``size`` says.
     """
-    def __init__(self, identifier, desc, tb_rendering, time, environ, url):
+    __slots__ = ('identifier', 'description', 'traceback', 'exc_type',
+                 'environ', 'time', 'url', 'fingerprint', 'timestamp',
+                 'size')
+
+    def __init__(self, identifier, desc, tb_rendering, time, environ, url,
+                 fingerprint=None, timestamp=None, limits=None):
+        if limits is None:
+            limits = _DEFAULT_LIMITS
         self.identifier = identifier
         self.description = desc
-        self.text = tb_rendering + '\n\n' + pprint.pformat(environ)
+        self.traceback = tb_rendering
+        self.exc_type = getattr(tb_rendering, 'exc_type', None)
+        self.environ = limits.snapshot_environ(environ)
         self.time = time
         self.url = url
-    
+        self.fingerprint = fingerprint
+        self.timestamp = timestamp
+        limits.shrink(self)
+
+    # without these, instances (having __slots__ but no __dict__) can't be
+    # pickled with protocols 0 and 1, the default ones on Python 2
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def text(self):
+        if getattr(self.traceback, 'locals', None) is not None:
+            rendering = self.traceback.render(show_locals=True)
+        else:
+            rendering = str(self.traceback)
+        return rendering + '\n\n' + pprint.pformat(self.environ)
+
+    def render(self, context_lines=0, source=None):
+        """ Return ``text``, but with 'context_lines' lines of source on
+        either side of the line of each frame, read from 'source' (see
+        ``TracebackSnapshot.render``).
+        """
+        if not context_lines or not hasattr(self.traceback, 'frames'):
+            return self.text
+        rendering = self.traceback.render(
+            self.traceback.locals is not None, context_lines, source)
+        return rendering + '\n\n' + pprint.pformat(self.environ)
+
 def make_errorlog(app, global_conf, **local_conf):
     """Paste filterapp factory.
     """
     channel = local_conf.get('channel', None)
     keep = int(local_conf.get('keep', 20))
     path = local_conf.get('path', '/__error_log__')
-    ignore = local_conf.get('ignore', None)
-    # e.g. Paste.httpexceptions.HTTPFound,
-    # Paste.httpexceptions.HTTPUnauthorized, Paste.httpexceptions.HTTPNotFound
-    ignored_exceptions = []
-    if ignore:
-        from pkg_resources import EntryPoint
-        ignore_names = [ name.strip() for name in ignore.split() ]
-        bdict = __builtins__
-        if not isinstance(bdict, dict): #pragma NO COVER pypy
-            bdict = bdict.__dict__
-        for name in ignore_names:
-            if name in bdict:
-                ignored_exc = bdict[name]
-            else:
-                ep = EntryPoint.parse('x=%s' % name)
-                ignored_exc = EntryPoint.parse('x=%s' % name).resolve()
+    reload_templates = _asbool(local_conf.get('reload_templates', False))
+    samples = int(local_conf.get('samples', 5))
+    max_groups = int(local_conf.get('max_groups', 100))
+    max_age = local_conf.get('max_age', None)
+    if max_age is not None:
+        max_age = float(max_age)
+    max_history_size = local_conf.get('max_history_size', None)
+    if max_history_size is not None:
+        max_history_size = int(max_history_size)
+    store = make_store(local_conf.get('store', None), keep, max_age,
+                       max_history_size)
+    record_limits = RecordLimits(
+        _asint(local_conf.get('max_record_size', 65536)),
+        _asint(local_conf.get('max_value_length', 4096)),
+        _aslist(local_conf.get('environ_include', None)),
+        _aslist(local_conf.get('environ_exclude', None)))
+    capture_policy = None
+    capture_rate = local_conf.get('capture_rate', None)
+    if capture_rate is not None:
+        capture_burst = local_conf.get('capture_burst', None)
+        if capture_burst is not None:
+            capture_burst = float(capture_burst)
+        capture_policy = CapturePolicy(
+            float(capture_rate), capture_burst,
+            float(local_conf.get('sample_rate', 0.0)))
+    log_writer = None
+    if _asbool(local_conf.get('async_logging', False)):
+        policy = local_conf.get('log_queue_policy', 'drop')
+        if policy not in ('drop', 'block'):
+            raise ValueError('log_queue_policy must be "drop" or "block", '
+                             'not %r' % policy)
+        timeout = local_conf.get('log_queue_timeout', None)
+        if timeout is not None:
+            timeout = float(timeout)
+        log_writer = LogWriter(int(local_conf.get('log_queue_size', 1000)),
+                               block=policy == 'block', timeout=timeout)
+    capture_locals = None
+    if _asbool(local_conf.get('capture_locals', False)):
+        capture_locals = LocalsCapture(
+            int(local_conf.get('locals_max_frames', 10)),
+            int(local_conf.get('locals_max_vars', 20)),
+            int(local_conf.get('locals_max_length', 200)),
+            int(local_conf.get('locals_max_depth', 2)))
+    broadcaster = Broadcaster(
+        int(local_conf.get('stream_buffer_size', 100)),
+        int(local_conf.get('stream_max_subscribers', 10)),
+        float(local_conf.get('stream_heartbeat', 15.0)))
+    exporters = []
+    for spec in local_conf.get('export', '').split():
+        exporters.append(make_exporter(
+            spec, local_conf.get('export_spill_dir', None),
+            _asbool(local_conf.get('export_compress', True)),
+            float(local_conf.get('export_timeout', 5.0)),
+            _asint(local_conf.get('export_file_max_bytes', 10485760)),
+            int(local_conf.get('export_file_backups', 5)),
+            maxsize=int(local_conf.get('export_queue_size', 1000)),
+            batch_size=int(local_conf.get('export_batch_size', 100)),
+            interval=float(local_conf.get('export_interval', 1.0)),
+            retries=int(local_conf.get('export_retries', 3)),
+            max_spill_bytes=int(local_conf.get('export_max_spill_bytes',
+                                               104857600))))
+    context_lines = int(local_conf.get('context_lines', 0))
+    # e.g. Paste.httpexceptions:HTTPFound,
+    # Paste.httpexceptions:HTTPUnauthorized, Paste.httpexceptions.HTTPNotFound
+    ignored_exceptions = tuple(
+        resolve(name) for name in local_conf.get('ignore', '').split())
+    ignore_rules = IgnoreRules(
+        modules=local_conf.get('ignore_modules', '').split(),
+        messages=[line.strip() for line in
+                  local_conf.get('ignore_messages', '').splitlines()
+                  if line.strip()],
+        statuses=parse_statuses(local_conf.get('ignore_statuses', '')))
+    return ErrorLog(app, channel, keep, path, ignored_exceptions,
+                    reload_templates=reload_templates, samples=samples,
+                    max_groups=max_groups, log_writer=log_writer,
+                    store=store, capture_policy=capture_policy,
+                    record_limits=record_limits,
+                    capture_locals=capture_locals, broadcaster=broadcaster,
+                    ignore_rules=ignore_rules or None, exporters=exporters,
+                    context_lines=context_lines)
 
-            ignored_exceptions.append(ignored_exc)
-    ignored_exceptions = tuple(ignored_exceptions)
-    return ErrorLog(app, channel, keep, path, ignored_exceptions)
+
+def _asint(value):
+    # an integer, or None for "none" (no limit)
+    if value is None or str(value).strip().lower() == 'none':
+        return None
+    return int(value)
+
+def _aslist(value):
+    # whitespace separated words, or None
+    if value is None:
+        return None
+    return value.split()
+
+def _asbool(value):
+    """Interpret a Paste configuration value as a boolean.
+
+    Forked / simplified from ``paste.deploy.converters.asbool``.
+    """
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ('true', 'yes', 'on', 'y', 't', '1'):
+            return True
+        if value in ('false', 'no', 'off', 'n', 'f', '0', ''):
+            return False
+        raise ValueError('String is not true/false: %r' % value)
+    return bool(value)
 
 
 def _parse_querystring(environ):
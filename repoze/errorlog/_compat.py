@@ -3,15 +3,53 @@ import sys
 
 if sys.version_info[0] < 3:
     NativeStream = io.BytesIO
+    SIMPLE_TYPES = (str, unicode, int, long, float, bool, type(None))
+    INTEGER_TYPES = (int, long)
+    # indexing yields ints (a copy, as a memoryview would yield strings)
+    byte_view = bytearray
+    # an mmap has no new-style buffer: slices of the map itself are copies
+    # of just the slice
+    def map_view(mapped):
+        return mapped
 else:   #pragma: NO COVER Py3k
     NativeStream = io.StringIO
+    SIMPLE_TYPES = (str, bytes, int, float, bool, type(None))
+    INTEGER_TYPES = (int,)
+    byte_view = memoryview
+    map_view = memoryview
 
 try:
     from urllib import quote
+    from urllib import urlencode
 except:  # pragma: NO COVER Py3k
     from urllib.parse import quote
+    from urllib.parse import urlencode
 
 try:
     from urlparse import parse_qsl
 except:   #pragma: NO COVER Py3k
     from urllib.parse import parse_qsl
+
+try:
+    import Queue as queue
+except:   #pragma: NO COVER Py3k
+    import queue
+
+try:
+    import __builtin__ as builtins
+except:   #pragma: NO COVER Py3k
+    import builtins
+
+try:
+    from repr import Repr
+except:   #pragma: NO COVER Py3k
+    from reprlib import Repr
+
+try:
+    from httplib import HTTPConnection
+    from httplib import HTTPSConnection
+    from urlparse import urlsplit
+except:   #pragma: NO COVER Py3k
+    from http.client import HTTPConnection
+    from http.client import HTTPSConnection
+    from urllib.parse import urlsplit
@@ -0,0 +1,224 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" ASGI version of the ``ErrorLog`` middleware (Python 3.5 and later). """
+
+import asyncio
+import sys
+
+from . import _LazyIdentifier
+from . import _event
+from . import _json_dumps
+from . import _route
+
+
+class ASGIErrorLog(object):
+    def __init__(self, application, errorlog, executor=None):
+        """ ASGI Middleware which records the errors of an ASGI application
+        in the exception history of an ``ErrorLog`` and serves its views.
+
+        o 'application' is the ASGI application to watch.
+
+        o 'errorlog' is the ``repoze.errorlog.ErrorLog`` (e.g. made by
+          ``make_errorlog``) whose configuration, exception history and
+          views are used.  Its own application isn't called, and may be
+          None; one ErrorLog can watch WSGI and ASGI applications at once.
+
+        o 'executor', if not None, is the ``concurrent.futures.Executor`` in
+          which errors are recorded and logged and views are rendered, so
+          that the event loop isn't held up; by default it is the loop's
+          default executor.
+        """
+        self.application = application
+        self.errorlog = errorlog
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            # lifespan events and the like
+            await self.application(scope, receive, send)
+            return
+        errorlog = self.errorlog
+        if scope['type'] == 'http':
+            view, rest = _route(errorlog.path, _path_info(scope))
+            if view == 'stream':
+                await self.stream(scope, receive, send)
+                return
+            if view is not None:
+                await self.view(scope, receive, send)
+                return
+
+        # as in ErrorLog.__call__; ASGI servers pass extra scope keys along
+        identifier = _LazyIdentifier(errorlog)
+        scope = dict(scope)
+        scope['repoze.errorlog.path'] = errorlog.path
+        scope['repoze.errorlog.entryid'] = identifier
+        try:
+            # exceptions raised by ``send`` (while the response is sent)
+            # go through the application to here as well
+            await self.application(scope, receive, send)
+        except errorlog.ignored_exceptions:
+            errorlog.ignored()
+            raise
+        except asyncio.CancelledError:
+            # the server gave up on the request; not the application's fault
+            raise
+        except:
+            exc_info = sys.exc_info()
+            try:
+                await self._run(self._log_error, identifier, scope, exc_info)
+            finally:
+                del exc_info
+            raise
+
+    def _log_error(self, identifier, scope, exc_info):
+        # in the executor: capturing and formatting take a while
+        self.errorlog.log_error(str(identifier), scope_environ(scope),
+                                exc_info)
+
+    def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, func, *args)
+
+    async def view(self, scope, receive, send):
+        """ Serve the exception history views, the JSON API and the
+        metrics.
+        """
+        status, headers, body = await self._run(_call_view, self.errorlog,
+                                                scope_environ(scope))
+        await send({'type': 'http.response.start',
+                    'status': int(status.split()[0]),
+                    'headers': [(name.encode('latin-1'),
+                                 value.encode('latin-1'))
+                                for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def stream(self, scope, receive, send):
+        """ Serve the ``text/event-stream`` of ``ErrorLog.stream`` without
+        holding a thread; events are waited for on the event loop.
+        """
+        broadcaster = self.errorlog.broadcaster
+        loop = asyncio.get_event_loop()
+        ready = asyncio.Event()
+
+        def notify():
+            # called by whichever thread records an error
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # the loop is closed
+                pass
+
+        subscription = broadcaster.subscribe(notify)
+        if subscription is None:
+            body = _json_dumps({'error': 'too many subscribers'})
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'cache-control', b'no-cache')]})
+            await send({'type': 'http.response.body',
+                        'body': body.encode('utf-8')})
+            return
+
+        closed = []
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            closed.append(True)
+            ready.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'),
+                                    (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')]})
+            await _send_chunk(send, b': repoze.errorlog\n\n')
+            dropped = 0
+            while not closed:
+                ready.clear()
+                event = subscription.pop()
+                if subscription.dropped != dropped:
+                    count = subscription.dropped - dropped
+                    dropped = subscription.dropped
+                    await _send_chunk(send, _event('dropped', count))
+                if event is None:
+                    try:
+                        await asyncio.wait_for(ready.wait(),
+                                               broadcaster.heartbeat)
+                        continue
+                    except asyncio.TimeoutError:
+                        event = b': keepalive\n\n'
+                await _send_chunk(send, event)
+        finally:
+            subscription.close()
+            watcher.cancel()
+
+
+def _send_chunk(send, chunk):
+    return send({'type': 'http.response.body', 'body': chunk,
+                 'more_body': True})
+
+def _call_view(errorlog, environ):
+    # run a view of 'errorlog', in the executor
+    response = []
+    def start_response(status, headers):
+        response[:] = [status, headers]
+    app_iter = errorlog(environ, start_response)
+    try:
+        body = b''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    status, headers = response
+    return status, headers, body
+
+def _path_info(scope):
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        return path[len(root_path):]
+    return path
+
+def scope_environ(scope):
+    """ Return a WSGI environ describing the request of ASGI 'scope', as
+    recorded with its errors (it has no ``wsgi.input``).
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope.get('method', 'GET'),
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': _path_info(scope),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.errors': sys.stderr,
+        'asgi.scope_type': scope['type'],
+    }
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    for key in ('repoze.errorlog.path', 'repoze.errorlog.entryid'):
+        if key in scope:
+            environ[key] = scope[key]
+    return environ
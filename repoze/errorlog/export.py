@@ -0,0 +1,413 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+import errno
+import hashlib
+import json
+import os
+import socket
+import time
+import zlib
+
+from ._compat import HTTPConnection
+from ._compat import HTTPSConnection
+from ._compat import queue
+from ._compat import urlsplit
+from .writer import BackgroundQueue
+from .writer import _STOP
+
+_SPILL_SUFFIX = '.jsonl.gz'
+
+
+class Exporter(BackgroundQueue):
+    """ Ship errors to 'sink', as JSON lines, from a background thread.
+
+    ``export`` never waits: errors are handed over through a queue holding
+    at most 'maxsize' of them, and dropped (counted in ``dropped``) when it
+    is full.  The thread sends them in batches of up to 'batch_size' errors
+    or 'batch_bytes' bytes, at most 'interval' seconds after the first
+    error of a batch arrived.
+
+    After the sink fails to send a batch, it is left alone for a delay
+    doubling from 'backoff' up to 'max_backoff' seconds.  If 'spill_dir' is
+    not None, batches are written (compressed) to that directory meanwhile,
+    and sent again, oldest first, once the sink recovers; at most
+    'max_spill_bytes' bytes of them are kept, the oldest being dropped
+    beyond that.  Batches spilled by an earlier process are sent too.
+    Without a 'spill_dir', a batch is retried 'retries' times before being
+    dropped.  Errors dropped either way are counted in ``failed``.
+    """
+    thread_name = 'repoze.errorlog exporter'
+
+    def __init__(self, sink, maxsize=1000, batch_size=100,
+                 batch_bytes=1048576, interval=1.0, retries=3, backoff=0.5,
+                 max_backoff=60.0, spill_dir=None, max_spill_bytes=104857600):
+        BackgroundQueue.__init__(self, maxsize)
+        self.sink = sink
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.interval = interval
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self.spilled = 0
+        self._failures = 0
+        self._retry_at = 0
+        self._backlog = None
+        self._spills = 0
+
+    def export(self, data, error=None):
+        """ Queue an error for export: 'data' is a dict describing it (as
+        sent to the event stream), and 'error', if not None, the ``Error``
+        recorded for it, whose traceback and environ are exported too.
+        """
+        self._start()
+        try:
+            self.queue.put_nowait((data, error))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        q = self.queue
+        if self._backlog is None:
+            self._backlog = self._list_spills()
+        batch = []
+        size = 0
+        deadline = None
+        while True:
+            now = time.time()
+            if batch:
+                timeout = max(deadline - now, 0)
+            elif self._backlog:
+                timeout = max(self._retry_at - now, 0)
+            else:
+                timeout = None
+            try:
+                item = q.get(True, timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                if batch:
+                    self._deliver(batch, final=True)
+                break
+            if item is not None:
+                line = encode(error_record(*item))
+                batch.append(line)
+                size += len(line)
+                if deadline is None:
+                    deadline = time.time() + self.interval
+            if batch and (len(batch) >= self.batch_size or
+                          size >= self.batch_bytes or
+                          time.time() >= deadline):
+                self._deliver(batch)
+                batch = []
+                size = 0
+                deadline = None
+            elif self._backlog and time.time() >= self._retry_at:
+                self._resend()
+
+    def _send(self, lines):
+        # True if the sink took 'lines'
+        try:
+            self.sink.send(lines)
+        except Exception:
+            self._failures += 1
+            delay = self.backoff * 2 ** min(self._failures - 1, 30)
+            self._retry_at = time.time() + min(delay, self.max_backoff)
+            return False
+        self._failures = 0
+        self._retry_at = 0
+        self.exported += len(lines)
+        return True
+
+    def _deliver(self, lines, final=False):
+        if self.spill_dir is None:
+            for attempt in range(self.retries + 1):
+                if self._send(lines):
+                    return
+                if final:
+                    break
+                if attempt < self.retries:
+                    time.sleep(max(self._retry_at - time.time(), 0))
+            self.failed += len(lines)
+        elif self._backlog or time.time() < self._retry_at:
+            # keep the order, and leave a failing sink alone for a while
+            self._spill(lines)
+        elif not self._send(lines):
+            self._spill(lines)
+
+    def _list_spills(self):
+        # [(name, size)] of the spilled batches, oldest first
+        if self.spill_dir is None:
+            return []
+        try:
+            names = sorted(name for name in os.listdir(self.spill_dir)
+                           if name.endswith(_SPILL_SUFFIX))
+        except OSError:
+            return []
+        backlog = []
+        for name in names:
+            try:
+                size = os.path.getsize(os.path.join(self.spill_dir, name))
+            except OSError:
+                continue
+            backlog.append((name, size))
+        return backlog
+
+    def _spill(self, lines):
+        data = _gzip(b''.join(lines))
+        self._spills += 1
+        # sorts by time; the count of errors is the last part
+        name = '%017d-%d-%d-%d%s' % (time.time() * 1e6, os.getpid(),
+                                     self._spills, len(lines), _SPILL_SUFFIX)
+        total = sum(size for n, size in self._backlog) + len(data)
+        while self._backlog and total > self.max_spill_bytes:
+            oldest, size = self._backlog.pop(0)
+            total -= size
+            self.failed += _spilled_count(oldest)
+            _remove(os.path.join(self.spill_dir, oldest))
+        if total > self.max_spill_bytes:
+            self.failed += len(lines)
+            return
+        path = os.path.join(self.spill_dir, name)
+        # written under a name _list_spills skips, then renamed, so that
+        # no process ever resends half a batch
+        temporary = os.path.join(self.spill_dir, '.' + name)
+        try:
+            _makedirs(self.spill_dir)
+            with open(temporary, 'wb') as f:
+                f.write(data)
+            os.rename(temporary, path)
+        except (IOError, OSError):
+            self.failed += len(lines)
+            return
+        self._backlog.append((name, len(data)))
+        self.spilled += len(lines)
+
+    def _resend(self):
+        name, size = self._backlog[0]
+        path = os.path.join(self.spill_dir, name)
+        claimed = path + '.sending'
+        try:
+            # other processes sharing the directory skip it meanwhile
+            os.rename(path, claimed)
+        except OSError:
+            self._backlog.pop(0)
+            return
+        try:
+            with open(claimed, 'rb') as f:
+                lines = _gunzip(f.read()).splitlines(True)
+        except (IOError, OSError, zlib.error):
+            self._backlog.pop(0)
+            self.failed += _spilled_count(name)
+            _remove(claimed)
+            return
+        if self._send(lines):
+            self._backlog.pop(0)
+            _remove(claimed)
+        else:
+            os.rename(claimed, path)
+
+
+def error_record(data, error=None):
+    """ Return the dict exported for an error, described by 'data' and, if
+    it was recorded, 'error'.
+    """
+    record = dict(data)
+    if error is not None:
+        record['time'] = error.time
+        record['traceback'] = str(error.traceback)
+        record['environ'] = error.environ
+    return record
+
+def encode(record):
+    """ Return 'record' as a line of JSON, in bytes. """
+    line = json.dumps(record, separators=(',', ':'), sort_keys=True,
+                      default=repr)
+    return (line + '\n').encode('utf-8')
+
+
+class FileSink(object):
+    """ Append batches to 'filename', which is rotated (to
+    ``<filename>.1``, ``<filename>.2``, ... up to 'backups' of them) before
+    it would grow beyond 'max_bytes' bytes (never if None).
+    """
+    def __init__(self, filename, max_bytes=10485760, backups=5):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def send(self, lines):
+        data = b''.join(lines)
+        if self.max_bytes is not None:
+            try:
+                size = os.path.getsize(self.filename)
+            except OSError:
+                size = 0
+            if size and size + len(data) > self.max_bytes:
+                self.rotate()
+        with open(self.filename, 'ab') as f:
+            f.write(data)
+
+    def rotate(self):
+        for i in range(self.backups, 0, -1):
+            source = self.filename
+            if i > 1:
+                source = '%s.%d' % (self.filename, i - 1)
+            if os.path.exists(source):
+                target = '%s.%d' % (self.filename, i)
+                _remove(target)
+                os.rename(source, target)
+        _remove(self.filename)
+
+
+class HTTPSink(object):
+    """ POST batches to 'url' as ``application/x-ndjson``, gzipped if
+    'compress' is true.  Responses other than 2xx count as failures.
+    """
+    def __init__(self, url, timeout=5.0, compress=True):
+        self.url = url
+        self.timeout = timeout
+        self.compress = compress
+        parts = urlsplit(url)
+        if parts.scheme == 'https':
+            self._connection_class = HTTPSConnection
+        else:
+            self._connection_class = HTTPConnection
+        self._netloc = parts.netloc
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += '?' + parts.query
+
+    def send(self, lines):
+        body = b''.join(lines)
+        headers = {'Content-Type': 'application/x-ndjson'}
+        if self.compress:
+            body = _gzip(body)
+            headers['Content-Encoding'] = 'gzip'
+        connection = self._connection_class(self._netloc,
+                                            timeout=self.timeout)
+        try:
+            connection.request('POST', self._path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        if not 200 <= response.status < 300:
+            raise IOError('%s answered %d %s' % (self.url, response.status,
+                                                  response.reason))
+
+
+class UDPSink(object):
+    """ Send batches to 'host' and 'port' over UDP, as datagrams of whole
+    lines up to 'max_datagram' bytes each (one line, if longer), gzipped if
+    'compress' is true.  Lines too long for any datagram are dropped and
+    counted in ``oversized``.  Nothing tells if datagrams are lost.
+    """
+    # the most an IPv4 UDP datagram can carry
+    max_payload = 65507
+
+    def __init__(self, host, port, max_datagram=8192, compress=False):
+        self.address = (host, port)
+        self.max_datagram = max_datagram
+        self.compress = compress
+        self.oversized = 0
+        self._socket = None
+
+    def send(self, lines):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        datagram = []
+        size = 0
+        for line in lines:
+            if len(line) > self.max_payload:
+                self.oversized += 1
+                continue
+            if datagram and size + len(line) > self.max_datagram:
+                self._send(b''.join(datagram))
+                datagram = []
+                size = 0
+            datagram.append(line)
+            size += len(line)
+        if datagram:
+            self._send(b''.join(datagram))
+
+    def _send(self, payload):
+        if self.compress:
+            payload = _gzip(payload)
+        self._socket.sendto(payload, self.address)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def make_exporter(spec, spill_dir=None, compress=True, timeout=5.0,
+                  max_bytes=10485760, backups=5, **kw):
+    """ Make an ``Exporter`` for the ``export`` setting 'spec':
+    ``file:<filename>`` (a ``FileSink`` rotated at 'max_bytes' bytes,
+    keeping 'backups' old files), an ``http://`` or ``https://`` URL (an
+    ``HTTPSink``) or ``udp:<host>:<port>`` (a ``UDPSink``).
+
+    Each exporter spills to its own subdirectory of 'spill_dir', if that
+    is not None.  Other keyword arguments are passed to the ``Exporter``.
+    """
+    scheme, sep, rest = spec.partition(':')
+    if scheme == 'file' and rest:
+        sink = FileSink(rest, max_bytes, backups)
+    elif scheme in ('http', 'https') and rest:
+        sink = HTTPSink(spec, timeout, compress)
+    elif scheme == 'udp' and ':' in rest:
+        host, port = rest.rsplit(':', 1)
+        sink = UDPSink(host, int(port), compress=compress)
+    else:
+        raise ValueError('Unknown exporter %r' % spec)
+    if spill_dir is not None:
+        digest = hashlib.sha1(spec.encode('utf-8')).hexdigest()[:12]
+        spill_dir = os.path.join(spill_dir, digest)
+    return Exporter(sink, spill_dir=spill_dir, **kw)
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def _gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+def _spilled_count(name):
+    try:
+        return int(name[:-len(_SPILL_SUFFIX)].rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,156 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+import importlib
+import re
+
+from ._compat import builtins
+
+
+def resolve(name):
+    """ Return the object named by 'name': a builtin (``KeyError``), a
+    dotted name (``my.module.MyError``) or a ``module:attribute`` name
+    (``my.module:MyError``).  Raises ImportError if there is none.
+    """
+    if ':' in name:
+        module_name, attrs = name.split(':', 1)
+        obj = importlib.import_module(module_name)
+        return _getattrs(obj, attrs.split('.'), name)
+    if '.' not in name:
+        try:
+            return getattr(builtins, name)
+        except AttributeError:
+            return importlib.import_module(name)
+    parts = name.split('.')
+    # the longest importable prefix is the module
+    for i in range(len(parts), 0, -1):
+        module_name = '.'.join(parts[:i])
+        try:
+            obj = importlib.import_module(module_name)
+        except ImportError:
+            if i == 1:
+                raise
+            continue
+        return _getattrs(obj, parts[i:], name)
+
+def _getattrs(obj, attrs, name):
+    for attr in attrs:
+        try:
+            obj = getattr(obj, attr)
+        except AttributeError:
+            raise ImportError('cannot resolve %r' % name)
+    return obj
+
+
+class IgnoreRules(object):
+    """ Decide which exceptions an ``ErrorLog`` leaves alone.
+
+    An exception is ignored if it is an instance of one of 'classes', if
+    its class or one of its bases is defined in a module named by one of
+    the 'modules' prefixes (``webob.exc`` covers ``webob.exc`` and its
+    submodules), if its message matches one of the 'messages' regular
+    expressions, or if its HTTP status (a ``status_code``, ``code`` or
+    ``status`` attribute) is one of 'statuses'.
+
+    What its class alone decides is cached per class, so after the first
+    exception of a class, only the message and status rules (if any) cost
+    anything.
+    """
+    # forget every decision rather than let the cache grow without bound
+    max_classes = 1000
+
+    def __init__(self, classes=(), modules=(), messages=(), statuses=()):
+        self.classes = tuple(classes)
+        self.modules = tuple(modules)
+        self.messages = tuple(messages)
+        self.statuses = frozenset(statuses)
+        self._message = None
+        if self.messages:
+            # one pass over the message for all of them
+            self._message = re.compile('|'.join('(?:%s)' % pattern
+                                                for pattern in messages))
+        self._cache = {}
+
+    def __bool__(self):
+        return bool(self.classes or self.modules or self.messages or
+                    self.statuses)
+
+    __nonzero__ = __bool__
+
+    def matches(self, exc):
+        """ Return True if the exception instance 'exc' is to be ignored.
+        """
+        cls = type(exc)
+        decision = self._cache.get(cls)
+        if decision is None:
+            decision = self._decide(cls)
+            if len(self._cache) >= self.max_classes:
+                self._cache.clear()
+            self._cache[cls] = decision
+        if decision is _CHECK:
+            return self._check(exc)
+        return decision
+
+    def _decide(self, cls):
+        if self.classes and issubclass(cls, self.classes):
+            return True
+        for base in getattr(cls, '__mro__', (cls,)):
+            module = getattr(base, '__module__', None) or ''
+            for prefix in self.modules:
+                if module == prefix or module.startswith(prefix + '.'):
+                    return True
+        if self._message is not None or self.statuses:
+            return _CHECK
+        return False
+
+    def _check(self, exc):
+        if self.statuses and _status(exc) in self.statuses:
+            return True
+        if self._message is not None:
+            try:
+                message = str(exc)
+            except Exception:
+                return False
+            return self._message.search(message) is not None
+        return False
+
+
+# the class doesn't decide; look at the exception
+_CHECK = object()
+
+def _status(exc):
+    # 404 from a code of 404, a status_code of '404' or a status of
+    # '404 Not Found'
+    for attr in ('status_code', 'code', 'status'):
+        value = getattr(exc, attr, None)
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str) and value[:3].isdigit():
+            return int(value[:3])
+    return None
+
+def parse_statuses(value):
+    """ Return the statuses listed in 'value', whitespace separated
+    numbers (``404``) or inclusive ranges (``500-599``).
+    """
+    statuses = set()
+    for word in value.split():
+        if '-' in word:
+            low, high = word.split('-', 1)
+            statuses.update(range(int(low), int(high) + 1))
+        else:
+            statuses.add(int(word))
+    return statuses
@@ -0,0 +1,174 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+from fnmatch import fnmatchcase
+import sys
+
+from ._compat import SIMPLE_TYPES
+
+
+class RecordLimits(object):
+    """ Bound the memory held by each recorded error.
+
+    Only environ keys matching one of the 'include' glob patterns (all keys
+    if it is None) and none of the 'exclude' ones are kept.  String values
+    longer than 'max_value_length' are truncated, and values which aren't
+    cheap, picklable ones (``wsgi.input``, objects put there by other
+    middleware) are replaced by a placeholder naming their type.
+
+    If an error still takes more than 'max_size' bytes, its largest environ
+    values are dropped first, then the local variables recorded for its
+    frames, then the exceptions it was chained to, then the members of its
+    exception group (the last first), then the outermost frames of its
+    traceback.
+    """
+    def __init__(self, max_size=65536, max_value_length=4096,
+                 include=None, exclude=None):
+        self.max_size = max_size
+        self.max_value_length = max_value_length
+        self.include = include
+        self.exclude = exclude or ()
+
+    def wanted(self, key):
+        """ Return True if the environ value for 'key' should be kept. """
+        if self.include is not None:
+            if not any(fnmatchcase(key, p) for p in self.include):
+                return False
+        return not any(fnmatchcase(key, p) for p in self.exclude)
+
+    def truncate(self, value):
+        """ Return 'value', cut down to 'max_value_length' if a string. """
+        limit = self.max_value_length
+        if limit is not None and isinstance(value, _STRING_TYPES):
+            if len(value) > limit:
+                suffix = '... (%d more)' % (len(value) - limit)
+                if isinstance(value, bytes):
+                    suffix = suffix.encode('ascii')
+                return value[:limit] + suffix
+        return value
+
+    def snapshot_environ(self, environ):
+        """ Return the filtered, shallow copy of 'environ' to record. """
+        snapshot = {}
+        for key, value in environ.items():
+            if not self.wanted(key):
+                continue
+            if isinstance(value, SIMPLE_TYPES):
+                value = self.truncate(value)
+            elif (isinstance(value, tuple) and
+                  all(isinstance(v, SIMPLE_TYPES) for v in value)):
+                value = tuple(self.truncate(v) for v in value)
+            else:
+                from . import _LazyIdentifier
+                if isinstance(value, _LazyIdentifier):
+                    # repoze.errorlog.entryid
+                    value = str(value)
+                else:
+                    value = '<%s object>' % type(value).__name__
+            snapshot[key] = value
+        return snapshot
+
+    def shrink(self, error):
+        """ Make 'error' fit in 'max_size' bytes, as far as possible, and
+        set its ``size``.
+        """
+        size = error.size = record_size(error)
+        if self.max_size is None or size <= self.max_size:
+            return
+        environ = error.environ
+        by_size = sorted(environ, key=lambda k: _sizeof(environ[k]))
+        while size > self.max_size and by_size:
+            key = by_size.pop()
+            value = environ[key]
+            environ[key] = '<%d bytes dropped>' % _sizeof(value)
+            size += _sizeof(environ[key]) - _sizeof(value)
+        rendering = error.traceback
+        if size > self.max_size and isinstance(rendering, str):
+            # a rendered traceback: keep its end, where the error is
+            keep = max(len(rendering) - (size - self.max_size), 0)
+            error.traceback = ('(truncated)\n' +
+                               rendering[len(rendering) - keep:])
+        elif size > self.max_size and hasattr(rendering, 'frames'):
+            snapshots = list(rendering.walk())
+            if any(s.locals is not None for s in snapshots):
+                for snapshot in snapshots:
+                    snapshot.locals = None
+                size = record_size(error)
+            if size > self.max_size:
+                rendering.cause = None
+                rendering.exception = [self.truncate(line)
+                                       for line in rendering.exception]
+                size = record_size(error)
+            members = rendering.exceptions or ()
+            keep = len(members)
+            while size > self.max_size and keep:
+                keep -= 1
+                size -= sum(_snapshot_size(s) for s in members[keep].walk())
+            if keep < len(members):
+                rendering.exceptions = members[:keep]
+                rendering.more_exceptions += len(members) - keep
+            frames = rendering.frames
+            drop = 0
+            while size > self.max_size and drop < len(frames) - 1:
+                filename, lineno, name = frames[drop]
+                size -= _FRAME_SIZE + _sizeof(filename) + _sizeof(name)
+                drop += 1
+            if drop:
+                rendering.frames = frames[drop:]
+                rendering.omitted += drop
+        error.size = record_size(error)
+
+
+_STRING_TYPES = (bytes, type(u''))
+
+# what a (filename, lineno, name) tuple costs besides its strings
+_FRAME_SIZE = sys.getsizeof((None, 0, None)) + sys.getsizeof(0)
+
+def _sizeof(value):
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+def record_size(error):
+    """ Return roughly how many bytes 'error' keeps alive. """
+    size = sys.getsizeof(error)
+    for value in (error.identifier, error.description, error.time,
+                  error.url, error.fingerprint, error.timestamp):
+        size += sys.getsizeof(value)
+    environ = error.environ
+    size += sys.getsizeof(environ)
+    for key, value in environ.items():
+        size += sys.getsizeof(key) + _sizeof(value)
+    rendering = error.traceback
+    if hasattr(rendering, 'frames'):
+        for snapshot in rendering.walk():
+            size += _snapshot_size(snapshot)
+    elif rendering is not None:
+        size += sys.getsizeof(rendering)
+    return size
+
+def _snapshot_size(snapshot):
+    # the size of one TracebackSnapshot, less those it is chained or
+    # grouped with
+    size = sys.getsizeof(snapshot) + sys.getsizeof(snapshot.frames)
+    for filename, lineno, name in snapshot.frames:
+        size += _FRAME_SIZE + sys.getsizeof(filename) + sys.getsizeof(name)
+    for line in snapshot.exception:
+        size += sys.getsizeof(line)
+    if snapshot.exceptions is not None:
+        size += sys.getsizeof(snapshot.exceptions)
+    for names in snapshot.locals or ():
+        for name, summary in names or ():
+            size += _FRAME_SIZE + sys.getsizeof(name) + sys.getsizeof(summary)
+    return size
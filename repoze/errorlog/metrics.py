@@ -0,0 +1,147 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+from bisect import bisect_left
+import threading
+
+
+# seconds; from a tenth of a millisecond to a second
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+PREFIX = 'repoze_errorlog_'
+
+
+class Metrics(object):
+    """ Counters and histograms of what an ``ErrorLog`` does, rendered in
+    the Prometheus text exposition format by ``render``.
+
+    They are only updated when something fails (or is ignored), each
+    update holding a lock just long enough to bump a number, so requests
+    which succeed don't pay for them.  At most 'max_types' exception types
+    are counted by name; the others are counted as ``other``.
+    """
+    max_types = 100
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.errors = {}
+        self.ignored = {}
+        self.suppressed = {}
+        self.evictions = 0
+        self.capture = Histogram(buckets)
+        self.logging = Histogram(buckets)
+        self._lock = threading.Lock()
+
+    def error(self, exc_type):
+        """ Count an error of type 'exc_type' (a name). """
+        self._count(self.errors, exc_type)
+
+    def ignore(self, exc_type):
+        """ Count an ignored exception of type 'exc_type' (a name). """
+        self._count(self.ignored, exc_type)
+
+    def suppress(self, exc_type):
+        """ Count an error only counted because of the capture policy. """
+        self._count(self.suppressed, exc_type)
+
+    def evict(self, count):
+        """ Count 'count' errors pushed out of the exception history. """
+        with self._lock:
+            self.evictions += count
+
+    def _count(self, counter, exc_type):
+        with self._lock:
+            if exc_type not in counter and len(counter) >= self.max_types:
+                exc_type = 'other'
+            counter[exc_type] = counter.get(exc_type, 0) + 1
+
+    def render(self, gauges=()):
+        """ Return the metrics, and the ``(name, help, value)`` 'gauges',
+        as a text exposition.
+        """
+        with self._lock:
+            counters = [
+                ('errors_total', 'Errors seen, by exception type.',
+                 sorted(self.errors.items())),
+                ('ignored_total', 'Ignored exceptions, by type.',
+                 sorted(self.ignored.items())),
+                ('suppressed_total',
+                 'Errors only counted because of the capture policy, '
+                 'by exception type.',
+                 sorted(self.suppressed.items())),
+                ]
+            evictions = self.evictions
+        lines = []
+        for name, help, values in counters:
+            _header(lines, name, help, 'counter')
+            for exc_type, count in values:
+                lines.append('%s%s{type="%s"} %d' % (
+                    PREFIX, name, _escape(exc_type), count))
+        _header(lines, 'evictions_total',
+                'Errors evicted from the exception history.', 'counter')
+        lines.append('%sevictions_total %d' % (PREFIX, evictions))
+        self.capture.render(lines, 'capture_seconds',
+                            'Time spent recording errors.')
+        self.logging.render(lines, 'logging_seconds',
+                            'Time spent writing errors to the channel.')
+        for name, help, value in gauges:
+            _header(lines, name, help, 'gauge')
+            lines.append('%s%s %s' % (PREFIX, name, _number(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class Histogram(object):
+    """ Counts of observed values, by upper bound ('buckets'), and their
+    sum.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # the last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, lines, name, help):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        _header(lines, name, help, 'histogram')
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('%s%s_bucket{le="%s"} %d' % (
+                PREFIX, name, _number(bound), cumulative))
+        lines.append('%s%s_sum %s' % (PREFIX, name, _number(total)))
+        lines.append('%s%s_count %d' % (PREFIX, name, cumulative))
+
+
+def _header(lines, name, help, kind):
+    lines.append('# HELP %s%s %s' % (PREFIX, name, help))
+    lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+
+def _escape(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+                 .replace('\n', '\\n'))
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value))
@@ -0,0 +1,72 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+import random
+import threading
+import time
+
+
+class CapturePolicy(object):
+    """ Limit how many errors are captured in full during an error storm.
+
+    Each exception type gets a token bucket holding up to 'burst' tokens
+    and refilled at 'rate' tokens per second; an error is captured if its
+    type's bucket has a token to spend.  Beyond that, errors are captured
+    with probability 'sample_rate'.  The first occurrence of a new kind of
+    error is always captured.  Errors which aren't captured should only be
+    counted.
+    """
+    # forget every bucket rather than let them grow without bound
+    max_buckets = 1000
+
+    def __init__(self, rate, burst=None, sample_rate=0.0,
+                 clock=time.time, random=random.random):
+        self.rate = rate
+        if burst is None:
+            burst = max(rate, 1)
+        self.burst = burst
+        self.sample_rate = sample_rate
+        self.captured = 0
+        self.suppressed = 0
+        self._clock = clock
+        self._random = random
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, exc_type, new):
+        """ Return True if an error of type 'exc_type' (a name) should be
+        captured in full.  'new' tells whether it is the first of its kind.
+        """
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(exc_type)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._buckets.clear()
+                bucket = self._buckets[exc_type] = [self.burst, now]
+            else:
+                tokens = bucket[0] + (now - bucket[1]) * self.rate
+                bucket[0] = min(tokens, self.burst)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                allowed = True
+            else:
+                allowed = new or (self.sample_rate > 0 and
+                                  self._random() < self.sample_rate)
+            if allowed:
+                self.captured += 1
+            else:
+                self.suppressed += 1
+            return allowed
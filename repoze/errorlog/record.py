@@ -0,0 +1,352 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+""" Compact binary format for ``Error`` records.
+
+A record is ``MAGIC``, a version byte, a table of the distinct strings of
+the record (each stored once, however often it appears: file names,
+function names and exception types repeat heavily across the frames of a
+traceback and its chained exceptions), and the fields of the error, in
+which strings are indexes into the table.  Numbers are varints.
+
+``dumps`` returns the record as bytes; ``loads`` takes any buffer
+(``bytes``, ``bytearray``, ``mmap`` or ``memoryview``) and reads it in
+place, without copying it first.
+"""
+
+import codecs
+import struct
+
+from ._compat import INTEGER_TYPES
+from ._compat import byte_view
+
+MAGIC = b'RZE'
+VERSION = 1
+
+# value tags
+_NONE = 0
+_TRUE = 1
+_FALSE = 2
+_INT = 3
+_FLOAT = 4
+_TEXT = 5
+_BYTES = 6
+_TUPLE = 7
+_SNAPSHOT = 8
+
+# snapshot flags
+_EXPLICIT_CAUSE = 1
+_CAUSE = 2
+_EXCEPTIONS = 4
+_LOCALS = 8
+
+_DOUBLE = struct.Struct('<d')
+_TEXT_TYPE = type(u'')
+
+
+class RecordError(ValueError):
+    """ Raised by ``loads`` for data which isn't a valid record. """
+
+
+def dumps(error):
+    """ Return ``Error`` 'error' as a record, in bytes. """
+    encoder = _Encoder()
+    encoder.error(error)
+    return encoder.getvalue()
+
+def loads(data):
+    """ Return the ``Error`` stored in the record 'data' (any buffer).
+    Raises ``RecordError`` if it isn't a record this version can read.
+    """
+    try:
+        return _Decoder(data).error()
+    except (IndexError, struct.error, UnicodeDecodeError,
+            RuntimeError) as e:
+        # RuntimeError: garbage nesting snapshots beyond the recursion limit
+        raise RecordError('corrupt record: %s' % e)
+
+def is_record(data):
+    """ Return True if 'data' (any buffer) starts like a record. """
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+class _Encoder(object):
+    def __init__(self):
+        self.strings = {}
+        self.table = bytearray()
+        self.body = bytearray()
+
+    def getvalue(self):
+        header = bytearray(MAGIC)
+        header.append(VERSION)
+        _put_varint(header, len(self.strings))
+        return bytes(header + self.table + self.body)
+
+    def string(self, value):
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+            data = value.encode('utf-8', 'surrogatepass')
+            _put_varint(self.table, len(data))
+            self.table += data
+        if index < 0x80:
+            self.body.append(index)
+        else:
+            _put_varint(self.body, index)
+
+    def varint(self, value):
+        _put_varint(self.body, value)
+
+    def value(self, value):
+        body = self.body
+        if value is None:
+            body.append(_NONE)
+        elif value is True:
+            body.append(_TRUE)
+        elif value is False:
+            body.append(_FALSE)
+        elif isinstance(value, _TEXT_TYPE):
+            body.append(_TEXT)
+            self.string(value)
+        elif isinstance(value, bytes):
+            body.append(_BYTES)
+            _put_varint(body, len(value))
+            body += value
+        elif isinstance(value, float):
+            body.append(_FLOAT)
+            body += _DOUBLE.pack(value)
+        elif isinstance(value, tuple):
+            body.append(_TUPLE)
+            _put_varint(body, len(value))
+            for item in value:
+                self.value(item)
+        elif isinstance(value, INTEGER_TYPES):
+            body.append(_INT)
+            # zigzag, so that small negative numbers stay small
+            _put_varint(body, value * 2 if value >= 0 else -value * 2 - 1)
+        elif hasattr(value, 'frames'):
+            body.append(_SNAPSHOT)
+            self.snapshot(value)
+        else:
+            # a rendering of some other kind
+            body.append(_TEXT)
+            self.string(str(value))
+
+    def error(self, error):
+        for value in (error.identifier, error.description, error.time,
+                      error.url, error.fingerprint, error.timestamp,
+                      error.exc_type, error.traceback):
+            self.value(value)
+        # as measured when it was recorded, rather than measured again
+        self.varint(error.size)
+        environ = error.environ
+        self.varint(len(environ))
+        for key, value in environ.items():
+            self.string(key)
+            self.value(value)
+
+    def snapshot(self, snapshot):
+        string = self.string
+        varint = self.varint
+        string(snapshot.exc_type)
+        varint(snapshot.omitted)
+        varint(len(snapshot.frames))
+        for filename, lineno, name in snapshot.frames:
+            string(filename)
+            _put_varint(self.body, lineno)
+            string(name)
+        varint(len(snapshot.exception))
+        for line in snapshot.exception:
+            string(line)
+        flags = 0
+        if snapshot.explicit_cause:
+            flags |= _EXPLICIT_CAUSE
+        if snapshot.cause is not None:
+            flags |= _CAUSE
+        if snapshot.exceptions is not None:
+            flags |= _EXCEPTIONS
+        if snapshot.locals is not None:
+            flags |= _LOCALS
+        self.body.append(flags)
+        if snapshot.cause is not None:
+            self.snapshot(snapshot.cause)
+        if snapshot.exceptions is not None:
+            varint(len(snapshot.exceptions))
+            for member in snapshot.exceptions:
+                self.snapshot(member)
+            varint(snapshot.more_exceptions)
+        if snapshot.locals is not None:
+            varint(len(snapshot.locals))
+            for names in snapshot.locals:
+                # 0 for a frame whose variables weren't captured
+                if names is None:
+                    varint(0)
+                    continue
+                varint(len(names) + 1)
+                for name, summary in names:
+                    string(name)
+                    string(summary)
+
+
+class _Decoder(object):
+    def __init__(self, data):
+        view = byte_view(data)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise RecordError('not a record')
+        if view[len(MAGIC)] != VERSION:
+            raise RecordError('unknown record version %d' %
+                              view[len(MAGIC)])
+        self.view = view
+        count, pos = _get_varint(view, len(MAGIC) + 1)
+        strings = self.strings = []
+        decode = codecs.utf_8_decode
+        end = len(view)
+        for i in range(count):
+            # the common one byte varint inline: this is the hot loop
+            length = view[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = _get_varint(view, pos)
+            start = pos
+            pos += length
+            if pos > end:
+                raise IndexError('string past the end of the record')
+            strings.append(decode(view[start:pos], 'surrogatepass',
+                                  True)[0])
+        self.pos = pos
+
+    def varint(self):
+        value, self.pos = _get_varint(self.view, self.pos)
+        return value
+
+    def string(self):
+        return self.strings[self.varint()]
+
+    def value(self):
+        tag = self.view[self.pos]
+        self.pos += 1
+        if tag == _TEXT:
+            return self.string()
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT:
+            value = self.varint()
+            return value >> 1 if not value & 1 else -((value + 1) >> 1)
+        if tag == _FLOAT:
+            start = self.pos
+            self.pos += _DOUBLE.size
+            return _DOUBLE.unpack_from(self.view, start)[0]
+        if tag == _BYTES:
+            length = self.varint()
+            start = self.pos
+            self.pos += length
+            if self.pos > len(self.view):
+                raise IndexError('bytes past the end of the record')
+            return bytes(self.view[start:self.pos])
+        if tag == _TUPLE:
+            return tuple([self.value() for i in range(self.varint())])
+        if tag == _SNAPSHOT:
+            return self.snapshot()
+        raise RecordError('unknown value tag %d' % tag)
+
+    def error(self):
+        from . import Error
+        error = Error.__new__(Error)
+        (error.identifier, error.description, error.time, error.url,
+         error.fingerprint, error.timestamp, error.exc_type,
+         error.traceback) = [self.value() for i in range(8)]
+        error.size = self.varint()
+        environ = error.environ = {}
+        for i in range(self.varint()):
+            key = self.string()
+            environ[key] = self.value()
+        return error
+
+    def snapshot(self):
+        from . import TracebackSnapshot
+        string = self.string
+        varint = self.varint
+        snapshot = TracebackSnapshot.__new__(TracebackSnapshot)
+        snapshot.exc_type = string()
+        omitted = varint()
+        if omitted:
+            snapshot.omitted = omitted
+        snapshot.frames = self.frames(varint())
+        snapshot.exception = [string() for i in range(varint())]
+        flags = self.view[self.pos]
+        self.pos += 1
+        snapshot.explicit_cause = bool(flags & _EXPLICIT_CAUSE)
+        snapshot.cause = None
+        if flags & _CAUSE:
+            snapshot.cause = self.snapshot()
+        if flags & _EXCEPTIONS:
+            snapshot.exceptions = [self.snapshot()
+                                   for i in range(varint())]
+            more = varint()
+            if more:
+                snapshot.more_exceptions = more
+        if flags & _LOCALS:
+            variables = snapshot.locals = []
+            for i in range(varint()):
+                count = varint()
+                if not count:
+                    variables.append(None)
+                    continue
+                variables.append([(string(), string())
+                                  for j in range(count - 1)])
+        return snapshot
+
+    def frames(self, count):
+        # like [(string(), varint(), string()) for i in range(count)], with
+        # the common one byte varints inline
+        view = self.view
+        strings = self.strings
+        pos = self.pos
+        frames = []
+        for i in range(count):
+            fields = []
+            for j in range(3):
+                value = view[pos]
+                if value < 0x80:
+                    pos += 1
+                else:
+                    value, pos = _get_varint(view, pos)
+                fields.append(value)
+            filename, lineno, name = fields
+            frames.append((strings[filename], lineno, strings[name]))
+        self.pos = pos
+        return frames
+
+
+def _get_varint(view, pos):
+    # return the varint at 'pos' in 'view', and the position after it
+    value = 0
+    shift = 0
+    while True:
+        byte = view[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _put_varint(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
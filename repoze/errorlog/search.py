@@ -0,0 +1,145 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+import re
+import threading
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """ Return the set of lower-cased words in 'text', including the parts
+    of those joined by underscores.
+    """
+    tokens = set()
+    for word in _WORD.findall(text.lower()):
+        tokens.add(word)
+        if '_' in word:
+            tokens.update(part for part in word.split('_') if part)
+    return tokens
+
+
+def error_tokens(error):
+    """ Return the words an error can be found by: the types and messages
+    of its exceptions and the file and function names of their frames.
+    """
+    rendering = error.traceback
+    if not hasattr(rendering, 'walk'):
+        # no snapshot to look at (e.g. a traceback rendered elsewhere)
+        return tokenize('%s %s' % (error.exc_type or '', error.description))
+    parts = []
+    for snapshot in rendering.walk():
+        parts.append(snapshot.exc_type)
+        parts.append(snapshot.summary)
+        for filename, lineno, name in snapshot.frames:
+            parts.append(filename)
+            parts.append(name)
+    return tokenize(' '.join(parts))
+
+
+class SearchIndex(object):
+    """ Inverted index of the errors in an exception history.
+
+    Errors with the same fingerprint and words (see ``error_tokens``), as
+    the occurrences of one error usually are, form one class, held once.
+    Each word maps to the classes it appears in, and each class to the
+    identifiers of its errors, so that a search costs time proportional to
+    the number of classes matching its rarest word rather than to the size
+    of the history, and an error adds little more than its identifier to
+    the index.  Errors must be added as they are recorded and removed as
+    they are evicted.
+    """
+    def __init__(self):
+        # word -> classes; a class is a (fingerprint, frozenset of words)
+        self._postings = {}
+        # class -> identifiers of its errors
+        self._classes = {}
+        # identifier -> class
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def add(self, error):
+        key = (error.fingerprint, frozenset(error_tokens(error)))
+        with self._lock:
+            self._remove(error.identifier)
+            members = self._classes.get(key)
+            if members is None:
+                members = self._classes[key] = set()
+                for token in key[1]:
+                    self._postings.setdefault(token, set()).add(key)
+            else:
+                # the class's own key, rather than an equal copy
+                key = self._documents[next(iter(members))]
+            members.add(error.identifier)
+            self._documents[error.identifier] = key
+
+    def remove(self, identifier):
+        with self._lock:
+            self._remove(identifier)
+
+    def _remove(self, identifier):
+        # the lock must be held
+        key = self._documents.pop(identifier, None)
+        if key is None:
+            return
+        members = self._classes[key]
+        members.discard(identifier)
+        if members:
+            return
+        del self._classes[key]
+        for token in key[1]:
+            posting = self._postings[token]
+            posting.discard(key)
+            if not posting:
+                del self._postings[token]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._classes.clear()
+            self._documents.clear()
+
+    def _search(self, query):
+        # the classes containing every word of 'query'; the lock must be
+        # held
+        tokens = tokenize(query)
+        if not tokens:
+            return set()
+        postings = []
+        for token in tokens:
+            posting = self._postings.get(token)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def search(self, query):
+        """ Return the identifiers of the errors containing every word of
+        'query'.
+        """
+        with self._lock:
+            identifiers = set()
+            for key in self._search(query):
+                identifiers.update(self._classes[key])
+            return identifiers
+
+    def fingerprints(self, query):
+        """ Return the fingerprints of the errors matching 'query'. """
+        with self._lock:
+            return set(fingerprint
+                       for fingerprint, tokens in self._search(query))
+
+    def __len__(self):
+        return len(self._documents)
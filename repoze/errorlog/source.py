@@ -0,0 +1,97 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+from collections import OrderedDict
+import linecache
+import os
+import threading
+
+try:
+    from tokenize import open as _open_source
+except ImportError: #pragma NO COVER Python 2
+    def _open_source(filename):
+        return open(filename, 'rU')
+
+
+class SourceCache(object):
+    """ The lines of source files, for the context shown around the frames
+    of a traceback.
+
+    Files are read once per modification time and kept, least recently
+    used first out, while the sizes of the files held add up to at most
+    'max_bytes' (larger files are read but not kept).  Unlike
+    ``linecache``, which keeps every file it ever read, it can be shared by
+    the whole process without growing without bound.  Names which aren't
+    files on disk (``<string>``, modules in zip files) are looked up with
+    ``linecache``.
+    """
+    def __init__(self, max_bytes=4194304):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def getlines(self, filename):
+        """ Return the lines of 'filename' (with their line endings). """
+        try:
+            stat = os.stat(filename)
+        except (OSError, TypeError, ValueError):
+            return linecache.getlines(filename)
+        key = (filename, stat.st_mtime)
+        with self._lock:
+            cached = self._files.pop(filename, None)
+            if cached is not None:
+                if cached[0] == key:
+                    self._files[filename] = cached
+                    return cached[2]
+                # changed since it was read
+                self.bytes -= cached[1]
+        try:
+            with _open_source(filename) as f:
+                lines = f.readlines()
+        except (IOError, OSError, SyntaxError, UnicodeDecodeError):
+            # SyntaxError: a bad coding cookie
+            return []
+        size = stat.st_size
+        if size <= self.max_bytes:
+            with self._lock:
+                if filename not in self._files:
+                    self._files[filename] = (key, size, lines)
+                    self.bytes += size
+                    while self.bytes > self.max_bytes:
+                        name, evicted = self._files.popitem(last=False)
+                        self.bytes -= evicted[1]
+        return lines
+
+    def context(self, filename, lineno, lines=3):
+        """ Return the number of the first of up to 'lines' lines of
+        'filename' on either side of line 'lineno', and the lines from there
+        to as many after it (without their line endings).
+        """
+        source = self.getlines(filename)
+        first = max(lineno - lines, 1)
+        return first, [line.rstrip('\r\n')
+                       for line in source[first - 1:lineno + lines]]
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._files)
+
+
+# shared by every ErrorLog of the process which isn't given its own
+shared_cache = SourceCache()
@@ -0,0 +1,899 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+from collections import OrderedDict
+import binascii
+import contextlib
+import copy
+import itertools
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from ._compat import map_view
+from .record import RecordError
+from .record import dumps
+from .record import loads
+
+try:
+    import fcntl
+except ImportError: #pragma NO COVER Windows
+    fcntl = None
+
+
+class ErrorStore(object):
+    """ Base class for exception histories.
+
+    A store holds ``Error`` objects appended by ``ErrorLog.insert_error``
+    and serves them to ``ErrorLog.get_error`` and the views.  Subclasses
+    implement ``append``, ``get``, ``clear``, ``__len__`` and ``__iter__``
+    (which yields the newest error first).  Stores whose errors are visible
+    to other processes set ``shared``; the views then take occurrence
+    counts from ``groups`` rather than from the process' own counters.
+    """
+    shared = False
+
+    def append(self, error):
+        """ Add 'error' to the history.
+
+        Return the list of errors evicted to make room for it (including
+        'error' itself if it couldn't be stored), or None if unknown.
+        """
+        raise NotImplementedError
+
+    def get(self, identifier):
+        """ Return the error named 'identifier', or None. """
+        raise NotImplementedError
+
+    def contains(self, identifier):
+        """ Return True if the error named 'identifier' is still held.
+        """
+        return self.get(identifier) is not None
+
+    def clear(self):
+        """ Forget every error. """
+        raise NotImplementedError
+
+    def groups(self, exc_type=None, since=None, fingerprints=None,
+               offset=0, limit=None):
+        """ Return ``ErrorGroup`` objects for the errors in the history,
+        most recently seen first, selected as by ``select_groups``.
+        """
+        return select_groups(group_errors(self), exc_type, since,
+                             fingerprints, offset, limit)
+
+    def version(self):
+        """ Return a value which changes whenever the history does. """
+        raise NotImplementedError
+
+    def close(self):
+        """ Release any resources held by the store. """
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+
+class RingBuffer(ErrorStore):
+    """ Bounded exception history.
+
+    Holds at most 'size' ``Error`` objects in a fixed array of slots, and
+    if 'max_bytes' is not None, evicts the oldest ones while the ``size``
+    of those held adds up to more than that (the newest error is always
+    kept).  Appending (and evicting the oldest entry when full) is O(1), and
+    lookups by identifier go through an identifier -> slot index rather
+    than a scan.  Iteration yields the newest error first.
+
+    Safe to share between threads: appends are serialized by a lock held
+    only for a handful of assignments, while lookups and iteration never
+    wait on it for longer than it takes to copy the slot array.
+
+    If 'intern' is true, the strings and frames of the errors held are
+    replaced by the copies in an ``InternTable``, so that errors with the
+    same traceback share one copy of it (``bytes`` still counts each
+    error's ``size``, as measured when it was recorded, in full).
+    """
+    def __init__(self, size, max_bytes=None, intern=True):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.table = None
+        if intern:
+            self.table = InternTable()
+        self.bytes = 0
+        self._slots = [None] * size
+        self._index = {}
+        self._appended = 0
+        self._oldest = 0
+        self._lock = threading.Lock()
+
+    def append(self, error):
+        if not self.size:
+            return [error]
+        table = self.table
+        if table is not None:
+            table.acquire(error)
+        evicted = []
+        with self._lock:
+            if self._appended - self._oldest == self.size:
+                evicted.append(self._evict())
+            slot = self._appended % self.size
+            self._slots[slot] = error
+            self._index[error.identifier] = slot
+            self._appended += 1
+            self.bytes += getattr(error, 'size', 0)
+            if self.max_bytes is not None:
+                while (self.bytes > self.max_bytes and
+                       self._appended - self._oldest > 1):
+                    evicted.append(self._evict())
+        if table is not None:
+            for old in evicted:
+                table.release(old)
+        return evicted
+
+    def _evict(self):
+        # drop the oldest error; the lock must be held
+        slot = self._oldest % self.size
+        error = self._slots[slot]
+        self._slots[slot] = None
+        if self._index.get(error.identifier) == slot:
+            del self._index[error.identifier]
+        self._oldest += 1
+        self.bytes -= getattr(error, 'size', 0)
+        return error
+
+    def get(self, identifier):
+        slot = self._index.get(identifier)
+        if slot is not None:
+            error = self._slots[slot]
+            # the slot may have been reused since we read the index
+            if error is not None and error.identifier == identifier:
+                return error
+
+    def clear(self):
+        with self._lock:
+            self._slots = [None] * self.size
+            self._index = {}
+            # keep counting, so that the version still changes
+            self._oldest = self._appended
+            self.bytes = 0
+            if self.table is not None:
+                self.table.clear()
+
+    def version(self):
+        return self._appended
+
+    def __len__(self):
+        return self._appended - self._oldest
+
+    def __iter__(self):
+        with self._lock:
+            appended = self._appended
+            oldest = self._oldest
+            slots = self._slots[:]
+        for seq in range(appended - 1, oldest - 1, -1):
+            yield slots[seq % self.size]
+
+
+class InternTable(object):
+    """ Reference counted canonical copies of the strings and frames of
+    the errors in a history.
+
+    ``acquire`` replaces the description, exception type, fingerprint and
+    time of an error, the exception lines, the ``(filename, lineno, name)``
+    frames and the lists of both of its tracebacks (made tuples) and the
+    string keys and values of its environ by the equal objects already in
+    the table, adding those it hasn't got; ``release`` drops the error's
+    references to them, and the copies nothing refers to any more.  Only
+    native strings (besides frames) are interned, as ``1 == 1.0 == True``.
+    """
+    def __init__(self):
+        # value -> [canonical copy, references]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, error):
+        """ Make 'error' use the table's copies of its values. """
+        with self._lock:
+            get = self._get
+            for name in ('description', 'fingerprint', 'exc_type', 'time'):
+                value = getattr(error, name, None)
+                if type(value) is str:
+                    setattr(error, name, get(value))
+            environ = getattr(error, 'environ', None)
+            if environ:
+                # _get inlined, as environs may be large
+                values = self._values
+                interned = {}
+                for key, value in environ.items():
+                    if type(key) is str:
+                        entry = values.get(key)
+                        if entry is None:
+                            entry = values[key] = [key, 0]
+                        entry[1] += 1
+                        key = entry[0]
+                    if type(value) is str:
+                        entry = values.get(value)
+                        if entry is None:
+                            entry = values[value] = [value, 0]
+                        entry[1] += 1
+                        value = entry[0]
+                    interned[key] = value
+                error.environ = interned
+            rendering = getattr(error, 'traceback', None)
+            if type(rendering) is str:
+                error.traceback = get(rendering)
+            elif hasattr(rendering, 'walk'):
+                for snapshot in rendering.walk():
+                    snapshot.exc_type = get(snapshot.exc_type)
+                    # each line and frame, and all of them (as tuples)
+                    snapshot.exception = get(tuple([
+                        get(line) for line in snapshot.exception]))
+                    snapshot.frames = get(tuple([
+                        get(frame) for frame in snapshot.frames]))
+
+    def release(self, error):
+        """ Drop the references of 'error', acquired before. """
+        released = []
+        append = released.append
+        for name in ('description', 'fingerprint', 'exc_type', 'time'):
+            value = getattr(error, name, None)
+            if type(value) is str:
+                append(value)
+        for key, value in (getattr(error, 'environ', None) or {}).items():
+            if type(key) is str:
+                append(key)
+            if type(value) is str:
+                append(value)
+        rendering = getattr(error, 'traceback', None)
+        if type(rendering) is str:
+            append(rendering)
+        elif hasattr(rendering, 'walk'):
+            for snapshot in rendering.walk():
+                append(snapshot.exc_type)
+                for values in (snapshot.exception, snapshot.frames):
+                    if type(values) is tuple:
+                        append(values)
+                    released.extend(values)
+        with self._lock:
+            values = self._values
+            for value in released:
+                entry = values.get(value)
+                # not there if the table was cleared since
+                if entry is not None:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del values[value]
+
+    def _get(self, value):
+        entry = self._values.get(value)
+        if entry is None:
+            entry = self._values[value] = [value, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def __len__(self):
+        return len(self._values)
+
+
+class ErrorGroup(object):
+    """ Every occurrence of one kind of exception, as identified by its
+    'fingerprint'.
+
+    'samples' holds the identifiers of the occurrences kept in full in the
+    exception history, oldest first (it may be empty, if they have all been
+    evicted from the history or none was kept); the rest are only counted.
+    """
+    def __init__(self, fingerprint, description, first_seen, exc_type=None):
+        self.fingerprint = fingerprint
+        self.description = description
+        self.exc_type = exc_type
+        self.count = 0
+        self.first_seen = first_seen
+        self.last_seen = first_seen
+        self.samples = []
+
+
+class GroupIndex(object):
+    """ Occurrence counters for the most recently seen 'size' groups.
+
+    Keeps full detail for at most 'samples' occurrences of each group at
+    a time, so that one exception raised over and over doesn't push every
+    other one out of the exception history; once a sample is evicted from
+    the history (see ``discard``), the next occurrence takes its place.
+    Iteration yields the most recently seen group first.
+    """
+    def __init__(self, size, samples):
+        if samples < 1:
+            raise ValueError('samples must be at least 1')
+        self.size = size
+        self.samples = samples
+        self.occurrences = 0
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, fingerprint, description, identifier, now, exc_type=None,
+            sample=True):
+        """ Count an occurrence of 'fingerprint' at time 'now'.
+
+        Return True if the occurrence (named by 'identifier') should be
+        kept in full, False if it was only counted.  If 'sample' is false,
+        it is only counted.
+        """
+        with self._lock:
+            group = self._groups.pop(fingerprint, None)
+            if group is None:
+                group = ErrorGroup(fingerprint, description, now, exc_type)
+                if self._groups and len(self._groups) >= self.size:
+                    # forget the group seen least recently
+                    self._groups.pop(next(iter(self._groups)))
+            # (re)inserting keeps the dict ordered by last occurrence
+            self._groups[fingerprint] = group
+            group.count += 1
+            group.last_seen = now
+            self.occurrences += 1
+            if sample and len(group.samples) < self.samples:
+                group.samples.append(identifier)
+                return True
+            return False
+
+    def replace_expired(self, fingerprint, identifier, contains):
+        """ Keep 'identifier' as a sample of group 'fingerprint' in place
+        of the group's oldest one, if 'contains' (a function of an
+        identifier) says that one is no longer in the exception history.
+
+        Return True if it is kept.  For histories which don't tell us of
+        every eviction (those shared with other processes), after ``add``
+        declined to keep an occurrence.
+        """
+        group = self.get(fingerprint)
+        if group is None or not group.samples:
+            return False
+        oldest = group.samples[0]
+        # asked without the lock held: it may have to read a file
+        if contains(oldest):
+            return False
+        with self._lock:
+            if oldest not in group.samples:
+                # replaced by another thread meanwhile
+                return False
+            group.samples.remove(oldest)
+            group.samples.append(identifier)
+            return True
+
+    def discard(self, fingerprint, identifier):
+        """ Forget 'identifier' as a sample of group 'fingerprint' (once
+        it is no longer in the exception history).
+        """
+        with self._lock:
+            group = self._groups.get(fingerprint)
+            if group is not None and identifier in group.samples:
+                group.samples.remove(identifier)
+
+    def get(self, fingerprint):
+        return self._groups.get(fingerprint)
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+            self.occurrences = 0
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __iter__(self):
+        with self._lock:
+            groups = list(self._groups.values())
+        return reversed(groups)
+
+
+def select_groups(groups, exc_type=None, since=None, fingerprints=None,
+                  offset=0, limit=None):
+    """ Return the list of the ``ErrorGroup`` objects of 'groups' (an
+    iterable) whose exception type is or ends with ``.`` and 'exc_type',
+    which were last seen at or after 'since' (seconds since the epoch) and
+    whose fingerprint is in 'fingerprints', if those are not None.  The
+    first 'offset' of them are skipped, and at most 'limit' returned
+    unless it is None.
+    """
+    if fingerprints is not None:
+        groups = (g for g in groups if g.fingerprint in fingerprints)
+    if exc_type is not None:
+        dotted = '.' + exc_type
+        groups = (g for g in groups if g.exc_type is not None and
+                  (g.exc_type == exc_type or g.exc_type.endswith(dotted)))
+    if since is not None:
+        groups = (g for g in groups if g.last_seen >= since)
+    stop = None
+    if limit is not None:
+        stop = offset + limit
+    return list(itertools.islice(groups, offset, stop))
+
+def group_errors(errors):
+    """ Build ``ErrorGroup`` objects, most recently seen first, from
+    'errors' (an iterable of ``Error`` objects, newest first).
+
+    Used when the exception history is shared with other processes, whose
+    occurrence counts this process doesn't see: each group then counts the
+    occurrences still kept in the history.
+    """
+    groups = OrderedDict()
+    for error in errors:
+        key = error.fingerprint or error.description
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ErrorGroup(key, error.description,
+                                             error.timestamp, error.exc_type)
+        group.count += 1
+        group.first_seen = error.timestamp
+        group.samples.insert(0, error.identifier)
+    return list(groups.values())
+
+
+class MmapStore(ErrorStore):
+    """ Exception history shared by every process which opens the same file.
+
+    The file is memory-mapped and holds a header followed by 'size' slots
+    of 'slot_size' bytes, used as a ring buffer.  Each slot starts with the
+    sequence number of the error it holds (0 when empty), the length of
+    the error's record (``repoze.errorlog.record``) and its identifier, so
+    that lookups only need to scan slot headers.  Writers serialize on a
+    ``flock`` of the file (and a thread lock, as ``flock`` doesn't exclude
+    threads of one process); readers take no lock, and decode records in
+    place in the map, but discard a slot whose sequence number changed
+    while they were reading it.  Errors which don't fit in a slot are
+    stored with their traceback text truncated and without their environ.
+    """
+    shared = True
+
+    # magic, format version, slots, slot size, number of errors appended,
+    # generation (random, changed by clear)
+    _HEADER = struct.Struct('<8sIII4xQ8s')
+    _HEADER_SIZE = 64
+    _APPENDED_OFFSET = 24
+    _COUNTER = struct.Struct('<Q')
+    _GENERATION_OFFSET = 32
+    _GENERATION = struct.Struct('<8s')
+    _MAGIC = b'RZERRLOG'
+    _VERSION = 2
+    # sequence number + 1, length of record, identifier
+    _SLOT = struct.Struct('<QI40s')
+
+    def __init__(self, filename, size, slot_size=16384):
+        if fcntl is None: #pragma NO COVER
+            raise ValueError('The mmap store requires fcntl (Unix only)')
+        if slot_size <= self._SLOT.size:
+            raise ValueError('slot_size must be larger than %d' %
+                             self._SLOT.size)
+        self.filename = filename
+        self.size = size
+        self.slot_size = slot_size
+        self._lock = threading.Lock()
+        self._fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock_fd = self._fd
+        self._lock_pid = os.getpid()
+        length = self._HEADER_SIZE + size * slot_size
+        with self._locked():
+            header = os.read(self._fd, self._HEADER.size)
+            expected = self._HEADER.pack(self._MAGIC, self._VERSION, size,
+                                         slot_size, 0, os.urandom(8))
+            if (os.fstat(self._fd).st_size != length or
+                header[:20] != expected[:20]):
+                # new file, or laid out for another configuration
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, length)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, expected)
+            self._map = mmap.mmap(self._fd, length)
+        # slices of which are decoded in place, where possible
+        self._view = map_view(self._map)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            pid = os.getpid()
+            if self._lock_pid != pid:
+                # flock locks belong to the open file, which a forked
+                # child shares with its parent: open our own
+                self._lock_fd = os.open(self.filename, os.O_RDWR)
+                self._lock_pid = pid
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _appended(self):
+        return self._COUNTER.unpack_from(self._map, self._APPENDED_OFFSET)[0]
+
+    def _offset(self, seq):
+        return self._HEADER_SIZE + (seq % self.size) * self.slot_size
+
+    def _encode(self, error):
+        limit = self.slot_size - self._SLOT.size
+        data = dumps(error)
+        if len(data) > limit:
+            small = copy.copy(error)
+            small.environ = {}
+            text = str(error.traceback)
+            chars = limit
+            while len(data) > limit:
+                if not chars:
+                    # too big even without any traceback
+                    return None
+                chars //= 2
+                small.traceback = '(truncated)\n' + text[len(text) - chars:]
+                data = dumps(small)
+        return data
+
+    def _load(self, seq):
+        # return the error stored for 'seq', or None if it's gone
+        offset = self._offset(seq)
+        stored, length, identifier = self._SLOT.unpack_from(self._map,
+                                                            offset)
+        if stored != seq + 1:
+            return None
+        start = offset + self._SLOT.size
+        try:
+            error = loads(self._view[start:start + length])
+        except RecordError:
+            error = None
+        if self._SLOT.unpack_from(self._map, offset)[0] != stored:
+            # overwritten while we were reading it
+            return None
+        return error
+
+    def append(self, error):
+        if not self.size:
+            return [error]
+        data = self._encode(error)
+        if data is None:
+            return [error]
+        identifier = error.identifier.encode('utf-8')
+        with self._locked():
+            appended = self._appended()
+            offset = self._offset(appended)
+            evicted = []
+            if appended >= self.size:
+                oldest = self._load(appended - self.size)
+                if oldest is not None:
+                    evicted.append(oldest)
+            self._SLOT.pack_into(self._map, offset, 0, 0, b'')
+            start = offset + self._SLOT.size
+            self._map[start:start + len(data)] = data
+            self._SLOT.pack_into(self._map, offset, appended + 1, len(data),
+                                 identifier)
+            self._COUNTER.pack_into(self._map, self._APPENDED_OFFSET,
+                                    appended + 1)
+        return evicted
+
+    def contains(self, identifier):
+        # the slot headers are enough
+        if not self.size:
+            return False
+        identifier = identifier.encode('utf-8')[:40]
+        for slot in range(self.size):
+            offset = self._HEADER_SIZE + slot * self.slot_size
+            seq, length, stored = self._SLOT.unpack_from(self._map, offset)
+            if seq and stored.rstrip(b'\0') == identifier:
+                return True
+        return False
+
+    def get(self, identifier):
+        if not self.size:
+            return None
+        identifier = identifier.encode('utf-8')[:40]
+        for slot in range(self.size):
+            offset = self._HEADER_SIZE + slot * self.slot_size
+            seq, length, stored = self._SLOT.unpack_from(self._map, offset)
+            if seq and stored.rstrip(b'\0') == identifier:
+                error = self._load(seq - 1)
+                if error is not None and error.identifier == \
+                        identifier.decode('utf-8'):
+                    return error
+
+    def clear(self):
+        with self._locked():
+            self._map[:] = b'\0' * len(self._map)
+            # a new generation, so that versions from before don't match
+            self._HEADER.pack_into(self._map, 0, self._MAGIC, self._VERSION,
+                                   self.size, self.slot_size, 0,
+                                   os.urandom(8))
+
+    def close(self):
+        if self._view is not self._map:
+            self._view.release()
+        self._map.close()
+        if self._lock_fd != self._fd:
+            os.close(self._lock_fd)
+        os.close(self._fd)
+
+    def version(self):
+        generation = self._GENERATION.unpack_from(self._map,
+                                                  self._GENERATION_OFFSET)[0]
+        return '%s.%d' % (binascii.hexlify(generation).decode('ascii'),
+                          self._appended())
+
+    def __len__(self):
+        return min(self._appended(), self.size)
+
+    def __iter__(self):
+        appended = self._appended()
+        for seq in range(appended - 1, max(appended - self.size, 0) - 1, -1):
+            error = self._load(seq)
+            if error is not None:
+                yield error
+
+
+class SQLiteStore(ErrorStore):
+    """ Exception history kept in an SQLite database, which survives
+    restarts and may be shared by several processes.
+
+    The database is used in WAL mode, so that readers don't block the
+    writer.  Appended errors are buffered and written in one transaction
+    (through a single prepared statement) when 'batch_size' of them are
+    pending, 'flush_interval' seconds after the first of them was appended,
+    or before the history is read.  The newest 'size' errors are retained,
+    and if 'max_age' is not None, only those appended in the last 'max_age'
+    seconds:  older ones are deleted with each batch, and otherwise at most
+    every 'flush_interval' seconds when the history is read.
+    """
+    shared = True
+
+    _SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS errors (
+             seq INTEGER PRIMARY KEY AUTOINCREMENT,
+             identifier TEXT NOT NULL,
+             timestamp REAL,
+             exc_type TEXT,
+             fingerprint TEXT,
+             description TEXT,
+             data BLOB NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS errors_identifier ON errors (identifier)",
+        "CREATE INDEX IF NOT EXISTS errors_timestamp ON errors (timestamp)",
+        ]
+    # fewer than the oldest SQLite versions allow in a statement
+    _MAX_PARAMETERS = 900
+    _INSERT = ("INSERT INTO errors "
+               "(identifier, timestamp, exc_type, fingerprint, description, "
+               " data) VALUES (?, ?, ?, ?, ?, ?)")
+
+    def __init__(self, filename, size, max_age=None, batch_size=50,
+                 flush_interval=1.0):
+        self.filename = filename
+        self.size = size
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._pending = []
+        self._timer = None
+        self._expired = 0
+        self._pid = os.getpid()
+        self._connection = self._connect()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.filename, timeout=30,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for statement in self._SCHEMA:
+                connection.execute(statement)
+            if not connection.execute('PRAGMA user_version').fetchone()[0]:
+                self._new_generation(connection)
+        return connection
+
+    def _new_generation(self, db):
+        # a random number kept in the database header, part of version()
+        # so that versions from before the file was (re)created or cleared
+        # don't match
+        generation = struct.unpack('<I', os.urandom(4))[0] >> 1 or 1
+        db.execute('PRAGMA user_version = %d' % generation)
+
+    def _db(self):
+        # sqlite connections must not be used across a fork
+        pid = os.getpid()
+        if self._pid != pid:
+            self._connection = self._connect()
+            self._pending = []
+            self._timer = None
+            self._pid = pid
+        return self._connection
+
+    def append(self, error):
+        if not self.size:
+            return [error]
+        row = (error.identifier, error.timestamp, error.exc_type,
+               error.fingerprint, error.description,
+               # a str on Python 2, which would be bound as TEXT
+               sqlite3.Binary(dumps(error)))
+        with self._lock:
+            self._db()
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval,
+                                              self._flush_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        return None
+
+    def _flush_timer(self):
+        # a timer may be cancelled too late, once it is waiting for the lock
+        with self._lock:
+            if self._timer is threading.current_thread():
+                self.flush()
+
+    def flush(self):
+        """ Write the pending errors and apply the retention limits. """
+        with self._lock:
+            db = self._db()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending:
+                pending, self._pending = self._pending, []
+                with db:
+                    db.execute('BEGIN IMMEDIATE')
+                    db.executemany(self._INSERT, pending)
+                    db.execute("DELETE FROM errors WHERE seq <= "
+                               "(SELECT MAX(seq) FROM errors) - ?",
+                               (self.size,))
+                    if self.max_age is not None:
+                        self._expire(db)
+            elif (self.max_age is not None and
+                  time.time() - self._expired >= self.flush_interval):
+                # reads only take the write lock when something expired
+                cutoff = time.time() - self.max_age
+                if db.execute("SELECT 1 FROM errors WHERE timestamp < ? "
+                              "LIMIT 1", (cutoff,)).fetchall():
+                    with db:
+                        db.execute('BEGIN IMMEDIATE')
+                        self._expire(db)
+                else:
+                    self._expired = time.time()
+
+    def _expire(self, db):
+        self._expired = time.time()
+        db.execute("DELETE FROM errors WHERE timestamp < ?",
+                   (self._expired - self.max_age,))
+
+    def _query(self, sql, args=()):
+        self.flush()
+        with self._lock:
+            return self._db().execute(sql, args).fetchall()
+
+    def contains(self, identifier):
+        return bool(self._query("SELECT 1 FROM errors WHERE identifier = ? "
+                                "LIMIT 1", (identifier,)))
+
+    def get(self, identifier):
+        rows = self._query("SELECT data FROM errors WHERE identifier = ? "
+                           "ORDER BY seq DESC LIMIT 1", (identifier,))
+        if rows:
+            return loads(rows[0][0])
+
+    def groups(self, exc_type=None, since=None, fingerprints=None,
+               offset=0, limit=None):
+        where = []
+        having = []
+        args = []
+        if exc_type is not None:
+            # every error of a group has the same type
+            dotted = '.' + exc_type
+            where.append('(exc_type = ? OR substr(exc_type, ?) = ?)')
+            args.extend([exc_type, -len(dotted), dotted])
+        if fingerprints is not None:
+            if len(fingerprints) > self._MAX_PARAMETERS:
+                # more than a statement takes: select those in Python
+                return select_groups(self.groups(exc_type, since),
+                                     fingerprints=fingerprints,
+                                     offset=offset, limit=limit)
+            where.append('COALESCE(fingerprint, description) IN (%s)' %
+                         ', '.join('?' * len(fingerprints)))
+            args.extend(fingerprints)
+        if since is not None:
+            having.append('MAX(timestamp) >= ?')
+            args.append(since)
+        inner = ("SELECT COUNT(*) AS count, MIN(timestamp) AS first, "
+                 "MAX(timestamp) AS last, MAX(seq) AS seq FROM errors ")
+        if where:
+            inner += 'WHERE %s ' % ' AND '.join(where)
+        inner += "GROUP BY COALESCE(fingerprint, description)"
+        if having:
+            inner += ' HAVING %s' % ' AND '.join(having)
+        # the other columns come from the newest error of each group, looked
+        # up by its primary key
+        sql = ("SELECT e.fingerprint, e.description, e.exc_type, g.count, "
+               "g.first, g.last, e.identifier "
+               "FROM (%s) AS g JOIN errors AS e ON e.seq = g.seq "
+               "ORDER BY g.seq DESC" % inner)
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            args.extend([limit is None and -1 or limit, offset])
+        rows = self._query(sql, args)
+        groups = []
+        for (fingerprint, desc, exc_type, count, first, last,
+             identifier) in rows:
+            group = ErrorGroup(fingerprint or desc, desc, first, exc_type)
+            group.count = count
+            group.last_seen = last
+            group.samples.append(identifier)
+            groups.append(group)
+        return groups
+
+    def clear(self):
+        with self._lock:
+            self._pending = []
+            with self._db() as db:
+                db.execute('BEGIN IMMEDIATE')
+                db.execute('DELETE FROM errors')
+                self._new_generation(db)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def version(self):
+        # count too, as errors also expire by age
+        self.flush()
+        with self._lock:
+            db = self._db()
+            with db:
+                # one read transaction, so both come from the same snapshot
+                db.execute('BEGIN')
+                seq, count = db.execute(
+                    "SELECT MAX(seq), COUNT(*) FROM errors").fetchone()
+                generation = db.execute('PRAGMA user_version').fetchone()[0]
+        return '%s.%s.%s' % (generation, seq, count)
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM errors")[0][0]
+
+    def __iter__(self):
+        for row in self._query("SELECT data FROM errors ORDER BY seq DESC"):
+            yield loads(row[0])
+
+
+def make_store(spec, keep, max_age=None, max_bytes=None):
+    """ Make the exception history described by the ``store`` setting
+    'spec', holding up to 'keep' errors.
+
+    'spec' may be None or ``memory`` (a ``RingBuffer`` private to this
+    process, also holding at most 'max_bytes' bytes of errors unless it is
+    None), ``mmap:<filename>`` (an ``MmapStore``) or
+    ``sqlite:<filename>`` (an ``SQLiteStore`` also dropping errors older
+    than 'max_age' seconds, unless it is None).
+    """
+    if spec is None or spec == 'memory':
+        return RingBuffer(keep, max_bytes)
+    scheme, sep, filename = spec.partition(':')
+    if scheme == 'mmap' and filename:
+        return MmapStore(filename, keep)
+    if scheme == 'sqlite' and filename:
+        return SQLiteStore(filename, keep, max_age)
+    raise ValueError('Unknown store %r' % spec)
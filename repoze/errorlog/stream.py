@@ -0,0 +1,99 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+from collections import deque
+import threading
+
+
+class Broadcaster(object):
+    """ Fan events out to subscribers without ever waiting for them.
+
+    Each of at most 'max_subscribers' subscriptions buffers up to 'maxsize'
+    events; when a subscriber falls further behind, its oldest events are
+    dropped (and counted), so that publishing never blocks.  Streams send a
+    comment every 'heartbeat' seconds while there is nothing else to send,
+    so that proxies keep them open and servers notice closed connections.
+    """
+    def __init__(self, maxsize=100, max_subscribers=10, heartbeat=15.0):
+        self.maxsize = maxsize
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.subscribers = ()
+        self._lock = threading.Lock()
+
+    def subscribe(self, notify=None):
+        """ Return a new ``Subscription``, or None if there are too many.
+
+        'notify', if not None, is called (from the publishing thread) after
+        each event is buffered, e.g. to wake up an event loop.
+        """
+        subscription = Subscription(self, self.maxsize, notify)
+        with self._lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            # replaced rather than changed, so publish needs no lock
+            self.subscribers = self.subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscribers = tuple(s for s in self.subscribers
+                                     if s is not subscription)
+
+    def publish(self, event):
+        for subscription in self.subscribers:
+            subscription.put(event)
+
+
+class Subscription(object):
+    """ The events published since subscribing, up to 'maxsize' of them.
+
+    ``get`` waits for the next one in threaded servers; event loops can pass
+    a 'notify' callback to ``Broadcaster.subscribe`` and call ``pop``.
+    ``dropped`` counts the events lost because the buffer was full.
+    """
+    def __init__(self, broadcaster, maxsize, notify=None):
+        self.broadcaster = broadcaster
+        self.dropped = 0
+        self._events = deque(maxlen=maxsize)
+        self._notify = notify
+        self._ready = threading.Condition(threading.Lock())
+
+    def put(self, event):
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._ready.notify()
+        if self._notify is not None:
+            self._notify()
+
+    def pop(self):
+        """ Return the oldest buffered event, or None. """
+        with self._ready:
+            if self._events:
+                return self._events.popleft()
+
+    def get(self, timeout=None):
+        """ Return the oldest buffered event, waiting up to 'timeout'
+        seconds (forever if None) for one; None if none came.
+        """
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            if self._events:
+                return self._events.popleft()
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
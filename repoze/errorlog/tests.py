@@ -1,3 +1,4 @@
+import os
 import sys
 import unittest
 import logging
@@ -17,6 +18,152 @@ class TestTopLevelFuncs(unittest.TestCase):
         self.assertEqual(elog.errors, [])
         self.assertEqual(elog.ignored_exceptions, (KeyError, AttributeError,
                                                    DummyException))
+        self.assertEqual(elog.reload_templates, False)
+        self.assertEqual(elog.groups.samples, 5)
+        self.assertEqual(elog.groups.size, 100)
+        self.assertEqual(elog.log_writer, None)
+        self.assertEqual(elog.capture_policy, None)
+
+    def test_make_errorlog_dotted_ignore(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None,
+                             ignore='%s.DummyException' % __name__)
+        self.assertEqual(elog.ignored_exceptions, (DummyException,))
+        self.assertEqual(elog.ignore_rules, None)
+
+    def test_make_errorlog_ignore_rules(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None, ignore_modules='webob.exc',
+                             ignore_messages='^client gone\n\n  timed out$',
+                             ignore_statuses='404 500-502')
+        rules = elog.ignore_rules
+        self.assertEqual(rules.modules, ('webob.exc',))
+        self.assertEqual(rules.messages, ('^client gone', 'timed out$'))
+        self.assertEqual(sorted(rules.statuses), [404, 500, 501, 502])
+
+    def test_make_errorlog_export(self):
+        from repoze.errorlog import make_errorlog
+        from repoze.errorlog.export import FileSink
+        from repoze.errorlog.export import UDPSink
+        elog = make_errorlog(None, None)
+        self.assertEqual(elog.exporters, ())
+        elog = make_errorlog(None, None,
+                             export='file:/tmp/errors.jsonl udp:host:9999',
+                             export_spill_dir='/tmp/spill',
+                             export_compress='false',
+                             export_file_max_bytes='none',
+                             export_file_backups='2',
+                             export_queue_size='10', export_batch_size='5',
+                             export_interval='0.5', export_retries='1',
+                             export_max_spill_bytes='1000')
+        file, udp = elog.exporters
+        self.assertTrue(isinstance(file.sink, FileSink))
+        self.assertEqual(file.sink.filename, '/tmp/errors.jsonl')
+        self.assertEqual(file.sink.max_bytes, None)
+        self.assertEqual(file.sink.backups, 2)
+        self.assertEqual(file.maxsize, 10)
+        self.assertEqual(file.batch_size, 5)
+        self.assertEqual(file.interval, 0.5)
+        self.assertEqual(file.retries, 1)
+        self.assertEqual(file.max_spill_bytes, 1000)
+        self.assertTrue(file.spill_dir.startswith('/tmp/spill/'))
+        self.assertTrue(isinstance(udp.sink, UDPSink))
+        self.assertEqual(udp.sink.address, ('host', 9999))
+        self.assertEqual(udp.sink.compress, False)
+        self.assertNotEqual(udp.spill_dir, file.spill_dir)
+
+    def test_make_errorlog_capture_policy(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None, capture_rate='5',
+                             capture_burst='20', sample_rate='0.1')
+        self.assertEqual(elog.capture_policy.rate, 5.0)
+        self.assertEqual(elog.capture_policy.burst, 20.0)
+        self.assertEqual(elog.capture_policy.sample_rate, 0.1)
+        elog = make_errorlog(None, None, capture_rate='5')
+        self.assertEqual(elog.capture_policy.burst, 5.0)
+        self.assertEqual(elog.capture_policy.sample_rate, 0.0)
+
+    def test_make_errorlog_async_logging(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None, async_logging='true',
+                             log_queue_size='10', log_queue_policy='block',
+                             log_queue_timeout='0.5')
+        self.assertEqual(elog.log_writer.maxsize, 10)
+        self.assertEqual(elog.log_writer.block, True)
+        self.assertEqual(elog.log_writer.timeout, 0.5)
+        elog = make_errorlog(None, None, async_logging='true')
+        self.assertEqual(elog.log_writer.maxsize, 1000)
+        self.assertEqual(elog.log_writer.block, False)
+        self.assertEqual(elog.log_writer.timeout, None)
+
+    def test_make_errorlog_bad_log_queue_policy(self):
+        from repoze.errorlog import make_errorlog
+        self.assertRaises(ValueError, make_errorlog, None, None,
+                          async_logging='true', log_queue_policy='wait')
+
+    def test_make_errorlog_groups(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None, samples='1', max_groups='10')
+        self.assertEqual(elog.groups.samples, 1)
+        self.assertEqual(elog.groups.size, 10)
+
+    def test_make_errorlog_reload_templates(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None, reload_templates='true')
+        self.assertEqual(elog.reload_templates, True)
+
+    def test_make_errorlog_capture_locals(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None)
+        self.assertEqual(elog.capture_locals, None)
+        elog = make_errorlog(None, None, capture_locals='true',
+                             locals_max_frames='3', locals_max_vars='4',
+                             locals_max_length='50', locals_max_depth='1')
+        capture = elog.capture_locals
+        self.assertEqual(capture.max_frames, 3)
+        self.assertEqual(capture.max_vars, 4)
+        self.assertEqual(capture.max_length, 50)
+        self.assertEqual(capture.max_depth, 1)
+
+    def test_make_errorlog_context_lines(self):
+        from repoze.errorlog import make_errorlog
+        from repoze.errorlog.source import shared_cache
+        elog = make_errorlog(None, None)
+        self.assertEqual(elog.context_lines, 0)
+        self.assertTrue(elog.source_cache is shared_cache)
+        elog = make_errorlog(None, None, context_lines='5')
+        self.assertEqual(elog.context_lines, 5)
+
+    def test_make_errorlog_stream(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None)
+        self.assertEqual(elog.broadcaster.maxsize, 100)
+        self.assertEqual(elog.broadcaster.max_subscribers, 10)
+        self.assertEqual(elog.broadcaster.heartbeat, 15.0)
+        elog = make_errorlog(None, None, stream_buffer_size='5',
+                             stream_max_subscribers='2',
+                             stream_heartbeat='0.5')
+        self.assertEqual(elog.broadcaster.maxsize, 5)
+        self.assertEqual(elog.broadcaster.max_subscribers, 2)
+        self.assertEqual(elog.broadcaster.heartbeat, 0.5)
+
+    def test_make_errorlog_record_limits(self):
+        from repoze.errorlog import make_errorlog
+        elog = make_errorlog(None, None, max_record_size='1000',
+                             max_value_length='none',
+                             environ_include='HTTP_* PATH_INFO',
+                             environ_exclude='HTTP_COOKIE',
+                             max_history_size='100000')
+        limits = elog.record_limits
+        self.assertEqual(limits.max_size, 1000)
+        self.assertEqual(limits.max_value_length, None)
+        self.assertEqual(limits.include, ['HTTP_*', 'PATH_INFO'])
+        self.assertEqual(limits.exclude, ['HTTP_COOKIE'])
+        self.assertEqual(elog.history.max_bytes, 100000)
+        elog = make_errorlog(None, None)
+        self.assertEqual(elog.record_limits.max_size, 65536)
+        self.assertEqual(elog.record_limits.max_value_length, 4096)
+        self.assertEqual(elog.history.max_bytes, None)
 
 class TestErrorLogging(unittest.TestCase):
     def setUp(self):
@@ -63,6 +210,8 @@ class TestErrorLogging(unittest.TestCase):
         self.assertTrue('KeyError' in errors.getvalue())
         self.assertEqual(env['repoze.errorlog.path'], '/__error_log__')
         self.assertEqual(env['repoze.errorlog.entryid'], '0')
+        error = elog.history.get('0')
+        self.assertEqual(error.environ['repoze.errorlog.entryid'], '0')
 
     def test_log_exc_with_root_channel(self):
         app = DummyApplication(KeyError)
@@ -75,6 +224,97 @@ class TestErrorLogging(unittest.TestCase):
         self.assertEqual(env['repoze.errorlog.path'], '/__error_log__')
         self.assertEqual(env['repoze.errorlog.entryid'], '0')
 
+    def test_log_exc_with_log_writer(self):
+        from repoze.errorlog.writer import LogWriter
+        writer = LogWriter()
+        app = DummyApplication(KeyError)
+        elog = self._makeOne(app, channel='', keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             log_writer=writer)
+        env = {}
+        self.assertRaises(KeyError, elog, env, None)
+        writer.stop(5)
+        output = self.errorstream.getvalue()
+        self.assertTrue('Traceback (most recent call last)' in output)
+        self.assertTrue('raise self.exc' in output)
+        self.assertTrue(output.rstrip().endswith('KeyError'))
+        self.assertEqual(len(elog.errors), 1)
+
+    def test_log_exc_with_log_writer_disabled_level(self):
+        import logging
+        from repoze.errorlog.writer import LogWriter
+        writer = LogWriter()
+        app = DummyApplication(KeyError)
+        elog = self._makeOne(app, channel='repoze.errorlog.tests.off',
+                             keep=10, path='/__error_log__',
+                             ignored_exceptions=(), log_writer=writer)
+        logger = logging.getLogger('repoze.errorlog.tests.off')
+        logger.setLevel(logging.CRITICAL)
+        try:
+            self.assertRaises(KeyError, elog, {}, None)
+        finally:
+            logger.setLevel(logging.NOTSET)
+        self.assertEqual(writer._thread, None)
+        self.assertEqual(len(elog.errors), 1)
+
+    def test_log_exc_with_capture_policy(self):
+        from ._compat import NativeStream
+        from repoze.errorlog.policy import CapturePolicy
+        errors = NativeStream()
+        app = DummyApplication(KeyError)
+        policy = CapturePolicy(rate=0.001, burst=1)
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             capture_policy=policy)
+        env = {'wsgi.errors':errors}
+        for i in range(5):
+            self.assertRaises(KeyError, elog, env, None)
+        # the first (new) error took the bucket's token; the rest
+        # were only counted
+        self.assertEqual(errors.getvalue().count('KeyError'), 1)
+        self.assertEqual(len(elog.errors), 1)
+        group, = list(elog.groups)
+        self.assertEqual(group.count, 5)
+        self.assertEqual(group.samples, ['0'])
+        self.assertEqual(policy.suppressed, 4)
+        self.assertEqual(elog.metrics.errors, {'KeyError': 5})
+        self.assertEqual(elog.metrics.suppressed, {'KeyError': 4})
+        self.assertEqual(sum(elog.metrics.capture.counts), 5)
+
+    def test_log_exc_suppressed_without_snapshot(self):
+        if not hasattr(KeyError(), '__cause__'): #pragma NO COVER Python 2
+            return
+        import repoze.errorlog
+        from repoze.errorlog.policy import CapturePolicy
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             capture_policy=CapturePolicy(rate=0.001,
+                                                          burst=1))
+        made = []
+        saved = repoze.errorlog.TracebackSnapshot
+        class CountingSnapshot(saved):
+            def __init__(self, *arg, **kw):
+                made.append(arg)
+                saved.__init__(self, *arg, **kw)
+        repoze.errorlog.TracebackSnapshot = CountingSnapshot
+        try:
+            for i in range(3):
+                try:
+                    try:
+                        raise ValueError('first')
+                    except ValueError:
+                        raise KeyError(i)
+                except KeyError:
+                    elog.log_error(elog.new_identifier(), {})
+        finally:
+            repoze.errorlog.TracebackSnapshot = saved
+        # the snapshot of the first error snapshots its cause too
+        self.assertEqual(len(made), 2)
+        group, = list(elog.groups)
+        self.assertEqual(group.count, 3)
+        self.assertEqual(group.description, 'ValueError: first')
+        self.assertEqual(elog.metrics.suppressed, {'KeyError': 2})
+
     def test_log_ignored_builtin_exceptions(self):
         from ._compat import NativeStream
         errors = NativeStream()
@@ -86,6 +326,116 @@ class TestErrorLogging(unittest.TestCase):
         self.assertRaises(KeyError, elog, env, None)
         self.assertEqual(errors.getvalue(), '')
         self.assertEqual(elog.errors, [])
+        self.assertEqual(elog.metrics.ignored, {'KeyError': 1})
+        self.assertEqual(elog.metrics.errors, {})
+
+    def test_log_ignored_by_rules(self):
+        from ._compat import NativeStream
+        from repoze.errorlog.ignore import IgnoreRules
+        errors = NativeStream()
+        app = DummyApplication(DummyHTTPException(404))
+        env = {'wsgi.errors':errors}
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             ignore_rules=IgnoreRules(statuses=[404]))
+        self.assertRaises(DummyHTTPException, elog, env, None)
+        self.assertEqual(errors.getvalue(), '')
+        self.assertEqual(elog.errors, [])
+        self.assertEqual(elog.metrics.ignored,
+                         {'%s.DummyHTTPException' % __name__: 1})
+        app.exc = DummyHTTPException(500)
+        self.assertRaises(DummyHTTPException, elog, env, None)
+        self.assertEqual(len(elog.errors), 1)
+
+    def test_log_exc_during_iteration(self):
+        from ._compat import NativeStream
+        errors = NativeStream()
+        app = DummyStreamingApplication(['a', 'b'], iter_exc=KeyError)
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        env = {'wsgi.errors':errors}
+        app_iter = elog(env, None)
+        self.assertEqual(elog.errors, [])
+        chunks = []
+        def consume():
+            for chunk in app_iter:
+                chunks.append(chunk)
+        self.assertRaises(KeyError, consume)
+        self.assertEqual(chunks, ['a', 'b'])
+        self.assertTrue('KeyError' in errors.getvalue())
+        self.assertEqual([e.identifier for e in elog.errors], ['0'])
+        app_iter.close()
+        self.assertTrue(app.closed)
+
+    def test_log_exc_during_close(self):
+        from ._compat import NativeStream
+        errors = NativeStream()
+        app = DummyStreamingApplication(['a'], close_exc=ValueError)
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        env = {'wsgi.errors':errors}
+        app_iter = elog(env, None)
+        self.assertEqual(list(app_iter), ['a'])
+        self.assertRaises(ValueError, app_iter.close)
+        self.assertTrue('ValueError' in errors.getvalue())
+        self.assertEqual([e.identifier for e in elog.errors], ['0'])
+
+    def test_log_exc_during_iteration_and_close(self):
+        app = DummyStreamingApplication([], iter_exc=KeyError,
+                                        close_exc=ValueError)
+        elog = self._makeOne(app, channel='foo', keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        app_iter = elog({}, None)
+        self.assertRaises(KeyError, list, app_iter)
+        self.assertRaises(ValueError, app_iter.close)
+        self.assertEqual([e.identifier for e in elog.errors], ['1', '0'])
+
+    def test_ignored_exc_during_iteration_and_close(self):
+        app = DummyStreamingApplication([], iter_exc=KeyError,
+                                        close_exc=KeyError)
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__',
+                             ignored_exceptions=(KeyError,))
+        app_iter = elog({}, None)
+        self.assertRaises(KeyError, list, app_iter)
+        self.assertRaises(KeyError, app_iter.close)
+        self.assertEqual(elog.errors, [])
+
+    def test_app_iter_closed_early(self):
+        app = DummyStreamingApplication(['a', 'b'])
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        app_iter = elog({}, None)
+        iterator = iter(app_iter)
+        self.assertEqual(next(iterator), 'a')
+        iterator.close()
+        app_iter.close()
+        self.assertTrue(app.closed)
+        self.assertEqual(elog.errors, [])
+
+    def test_app_iter_without_close(self):
+        app = DummyStreamingApplication(['a'])
+        app.app_iter = iter(['a'])
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        app_iter = elog({}, None)
+        self.assertEqual(list(app_iter), ['a'])
+        app_iter.close()
+
+    def test_file_wrapper_passthrough(self):
+        app = DummyStreamingApplication(['a'])
+        app.app_iter = DummyFileWrapper()
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        env = {'wsgi.file_wrapper': DummyFileWrapper}
+        self.assertTrue(elog(env, None) is app.app_iter)
+
+    def test_file_wrapper_not_a_class(self):
+        app = DummyStreamingApplication(['a'])
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        env = {'wsgi.file_wrapper': lambda f, size=None: f}
+        self.assertEqual(list(elog(env, None)), ['a'])
 
     def test_identifier_counter(self):
         from ._compat import NativeStream
@@ -100,6 +450,57 @@ class TestErrorLogging(unittest.TestCase):
         self.assertEqual(env['repoze.errorlog.path'], '/__error_log__')
         self.assertEqual(env['repoze.errorlog.entryid'], '2')
 
+    def test_identifier_allocated_lazily(self):
+        app = DummyApplication()
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        first, second = {}, {}
+        elog(first, None)
+        elog(second, None)
+        self.assertEqual(elog.counter, 0)
+        identifier = second['repoze.errorlog.entryid']
+        self.assertEqual(str(identifier), '0')
+        self.assertEqual(str(identifier), '0')
+        self.assertEqual(elog.counter, 1)
+        self.assertEqual('entry=' + identifier, 'entry=0')
+        self.assertEqual(identifier + '!', '0!')
+        self.assertEqual('entry=%s' % identifier, 'entry=0')
+        self.assertTrue(identifier == '0')
+        self.assertFalse(identifier != '0')
+        self.assertEqual(hash(identifier), hash('0'))
+        self.assertEqual(repr(identifier), repr('0'))
+        self.assertEqual(first['repoze.errorlog.entryid'], '1')
+
+    def test_paths_below_view_passed_through(self):
+        app = DummyApplication()
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        for path in ('/__error_log__x', '/__error_log__/other',
+                     '/__error_log__/api/errorsx'):
+            env = {'PATH_INFO': path}
+            self.assertEqual(elog(env, None), ['hello world'])
+            self.assertEqual(app.environ, env)
+
+    def test_links_below_script_name(self):
+        import json
+        env = {'PATH_INFO':'/__error_log__', 'SCRIPT_NAME': '/mount',
+               'wsgi.url_scheme':'http', 'SERVER_NAME':'localhost',
+               'SERVER_PORT':'80'}
+        elog = self._makeOne(DummyApplication(KeyError), channel=None,
+                             keep=10, path='/__error_log__',
+                             ignored_exceptions=())
+        self.assertRaises(KeyError, elog,
+                          {'PATH_INFO': '/', 'SCRIPT_NAME': '/mount'}, None)
+        self.assertEqual(elog.get_error('0').url, '/mount/__error_log__'
+                                                  '?entry=0')
+        body = b''.join(elog(env, lambda status, headers: None))
+        self.assertTrue(b'href="/mount/__error_log__?entry=0"' in body)
+        env['PATH_INFO'] = '/__error_log__/api/errors'
+        body = b''.join(elog(env, lambda status, headers: None))
+        data = json.loads(body.decode('utf-8'))
+        self.assertEqual(data['groups'][0]['url'],
+                         '/mount/__error_log__?entry=0')
+
     def test_show_index_view(self):
         env = {'PATH_INFO':'/__error_log__', 'wsgi.url_scheme':'http',
                'SERVER_NAME':'localhost', 'SERVER_PORT':'8080'}
@@ -108,17 +509,21 @@ class TestErrorLogging(unittest.TestCase):
         L = []
         def start_response(code, headers):
             L.append((code, headers))
-        from repoze.errorlog import Error
-        elog.errors = [
-            Error('1','description1','rendering1','time1',env,'url1'),
-            Error('2','description2','rendering2','time2',env,'url2')
-            ]
+        for exc in (KeyError, KeyError, ValueError):
+            try:
+                raise exc
+            except:
+                elog.insert_error(elog.new_identifier(), sys.exc_info(), env)
         bodylist = elog(env, start_response)
-        body = bodylist[0]
-        self.assertTrue(b'time1' in body)
-        self.assertTrue(b'time2' in body)
-        self.assertTrue(b'description1' in body)
-        self.assertTrue(b'description2' in body)
+        body = b''.join(bodylist)
+        self.assertEqual(L, [('200 OK', [('content-type', 'text/html')])])
+        self.assertTrue(b'KeyError' in body)
+        self.assertTrue(b'ValueError' in body)
+        self.assertTrue(b'<span>2</span> times' in body)
+        self.assertTrue(b'<span>1</span> times' in body)
+        self.assertTrue(b'href="/__error_log__?entry=1"' in body)
+        self.assertTrue(b'href="/__error_log__?entry=2"' in body)
+        self.assertTrue(body.index(b'ValueError') < body.index(b'KeyError'))
         self.assertTrue(b'Recent Errors' in body)
 
     def test_show_index_view_noerrors(self):
@@ -131,9 +536,472 @@ class TestErrorLogging(unittest.TestCase):
             L.append((code, headers))
         elog.errors = []
         bodylist = elog(env, start_response)
-        body = bodylist[0]
+        body = b''.join(bodylist)
+        self.assertTrue(b'No Recent Errors' in body)
+
+    def _fill(self, elog, count, exc_types=None):
+        for i in range(count):
+            exc = (exc_types or {}).get(i)
+            if exc is None:
+                # a distinct exception type for each group
+                exc = type('Error%d' % i, (Exception,), {})
+            try:
+                raise exc('message %d' % i)
+            except Exception:
+                elog.insert_error(elog.new_identifier(), sys.exc_info(), {})
+
+    def _index(self, elog, query_string):
+        env = {'PATH_INFO':'/__error_log__', 'wsgi.url_scheme':'http',
+               'SERVER_NAME':'localhost', 'SERVER_PORT':'80',
+               'QUERY_STRING':query_string}
+        return b''.join(elog(env, lambda status, headers: None))
+
+    def _fill_search(self, elog):
+        # KeyErrors raised from two functions, and a ValueError
+        def lookup_cart(key):
+            return {}[key]
+        def lookup_user(key):
+            return {}[key]
+        def parse_cart(value):
+            return int(value)
+        for function, arg in ((lookup_cart, 'item'), (lookup_user, 'name'),
+                              (parse_cart, 'x')):
+            try:
+                function(arg)
+            except Exception:
+                elog.insert_error(elog.new_identifier(), sys.exc_info(), {})
+
+    def test_search(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill_search(elog)
+        fingerprints = [elog.get_error(str(i)).fingerprint for i in range(3)]
+        self.assertEqual(elog.search('KeyError lookup_cart'),
+                         set(fingerprints[:1]))
+        self.assertEqual(elog.search('keyerror tests.py'),
+                         set(fingerprints[:2]))
+        self.assertEqual(elog.search("'name'"), set(fingerprints[1:2]))
+        self.assertEqual(elog.search('invalid literal'),
+                         set(fingerprints[2:]))
+        self.assertEqual(elog.search('KeyError parse_cart'), set())
+        self.assertEqual(elog.search('nowhere'), set())
+        self.assertEqual(elog.search('...'), set())
+
+    def test_show_index_view_searched(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill_search(elog)
+        body = self._index(elog, 'q=KeyError+lookup_cart')
+        self.assertTrue(b"KeyError: 'item'" in body)
+        self.assertFalse(b"'name'" in body)
+        body = self._index(elog, 'q=cart&limit=1')
+        self.assertTrue(b'invalid literal' in body)
+        self.assertTrue(b'limit=1&amp;q=cart&amp;page=2">Older' in body)
+        body = self._index(elog, 'q=cart&limit=1&page=2')
+        self.assertTrue(b"KeyError: 'item'" in body)
+        body = self._index(elog, 'q=nowhere')
+        self.assertTrue(b'No Recent Errors' in body)
+
+    def test_search_forgets_evicted_errors(self):
+        elog = self._makeOne(None, channel=None, keep=2,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill_search(elog)
+        self.assertEqual(len(elog.search_index), 2)
+        self.assertEqual(elog.search('lookup_cart'), set())
+        self.assertEqual(len(elog.search('lookup_user')), 1)
+        elog.errors = []
+        self.assertEqual(len(elog.search_index), 0)
+
+    def test_search_shared_store(self):
+        import shutil
+        import tempfile
+        from repoze.errorlog.store import SQLiteStore
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        store = SQLiteStore(os.path.join(tempdir, 'errors.db'), 10)
+        self.addCleanup(store.close)
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             store=store)
+        self._fill_search(elog)
+        self.assertEqual(len(elog.search_index), 0)
+        oldest = list(elog.history)[-1]
+        self.assertEqual(elog.search('KeyError lookup_cart'),
+                         set([oldest.fingerprint]))
+
+    def test_show_index_view_root_cause(self):
+        if not hasattr(KeyError(), '__cause__'): #pragma NO COVER Python 2
+            return
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        try:
+            try:
+                {}['missing']
+            except KeyError:
+                raise ValueError('wrapped')
+        except ValueError:
+            elog.insert_error(elog.new_identifier(), sys.exc_info(), {})
+        body = self._index(elog, '')
+        self.assertTrue(b"KeyError: 'missing'" in body)
+        error = elog.get_error('0')
+        self.assertEqual(error.description, "KeyError: 'missing'")
+        self.assertEqual(error.exc_type, 'ValueError')
+
+    def test_show_index_view_paged(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 5)
+        body = self._index(elog, 'limit=2')
+        self.assertTrue(b'Error4' in body and b'Error3' in body)
+        self.assertFalse(b'Error2' in body)
+        self.assertFalse(b'Newer' in body)
+        self.assertTrue(b'href="http://localhost/__error_log__'
+                        b'?limit=2&amp;page=2">Older' in body)
+        body = self._index(elog, 'limit=2&page=2')
+        self.assertTrue(b'Error2' in body and b'Error1' in body)
+        self.assertTrue(b'page=1">Newer' in body)
+        self.assertTrue(b'page=3">Older' in body)
+        body = self._index(elog, 'limit=2&page=3')
+        self.assertTrue(b'Error0' in body)
+        self.assertFalse(b'Older' in body)
+        body = self._index(elog, 'limit=2&page=4')
+        self.assertTrue(b'No Recent Errors' in body)
+
+    def test_show_index_view_filtered_by_type(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 3, {1: KeyError})
+        body = self._index(elog, 'type=KeyError')
+        self.assertTrue(b'KeyError' in body)
+        self.assertFalse(b'Error0' in body or b'Error2' in body)
+        body = self._index(elog, 'type=Error2')
+        self.assertTrue(b'Error2' in body)
+        self.assertFalse(b'KeyError' in body)
+        body = self._index(elog, 'type=repoze.errorlog.tests.Error2')
+        self.assertTrue(b'Error2' in body)
+
+    def test_show_index_view_filtered_by_since(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 2)
+        list(elog.groups)[1].last_seen = 100.0
+        body = self._index(elog, 'since=1000')
+        self.assertTrue(b'Error1' in body)
+        self.assertFalse(b'Error0' in body)
+        body = self._index(elog, 'since=1000&limit=1&page=2')
         self.assertTrue(b'No Recent Errors' in body)
+
+    def test_page_url_keeps_filters(self):
+        from repoze.errorlog import _page_url
+        url = _page_url('http://localhost/__error_log__',
+                        {'limit': 5, 'type': 'KeyError', 'since': None}, 3)
+        self.assertEqual(url, 'http://localhost/__error_log__'
+                              '?limit=5&type=KeyError&page=3')
+
+    def test_show_index_view_escapes(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 1)
+        list(elog.groups)[0].description = '<b>100% "bad"</b>'
+        body = self._index(elog, '')
+        self.assertTrue(b'&lt;b&gt;100% &quot;bad&quot;&lt;/b&gt;' in body)
+
+    def test_show_index_view_streamed(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 3)
+        chunks = list(elog.iter_index('http://localhost/__error_log__'))
+        self.assertEqual(len(chunks), 5)
+        self.assertTrue(chunks[1].lstrip().startswith(b'<li>'))
+        self.assertEqual(elog.index('http://localhost/__error_log__'),
+                         b''.join(chunks))
         
+    def _api(self, elog, path='', query_string='', if_none_match=None):
+        env = {'PATH_INFO':'/__error_log__/api/errors' + path,
+               'wsgi.url_scheme':'http', 'SERVER_NAME':'localhost',
+               'SERVER_PORT':'80', 'QUERY_STRING':query_string}
+        if if_none_match is not None:
+            env['HTTP_IF_NONE_MATCH'] = if_none_match
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        body = b''.join(elog(env, start_response))
+        return response['status'], response['headers'], body
+
+    def test_api_list(self):
+        import json
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 3, {1: KeyError})
+        status, headers, body = self._api(elog, query_string='limit=2')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertEqual(headers['content-length'], str(len(body)))
+        data = json.loads(body.decode('utf-8'))
+        self.assertEqual(data['page'], 1)
+        self.assertEqual(data['limit'], 2)
+        self.assertTrue(data['more'])
+        self.assertEqual([g['latest'] for g in data['groups']], ['2', '1'])
+        group = data['groups'][1]
+        self.assertEqual(group['type'], 'KeyError')
+        self.assertEqual(group['count'], 1)
+        self.assertEqual(group['url'], '/__error_log__?entry=1')
+        status, headers, body = self._api(elog, query_string='type=KeyError')
+        data = json.loads(body.decode('utf-8'))
+        self.assertEqual([g['latest'] for g in data['groups']], ['1'])
+
+    def test_api_list_page_out_of_range(self):
+        import json
+        import os
+        import shutil
+        import tempfile
+        from repoze.errorlog.store import SQLiteStore
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        store = SQLiteStore(os.path.join(tmpdir, 'errors.db'), 10)
+        self.addCleanup(store.close)
+        for history in (None, store):
+            elog = self._makeOne(None, channel=None, keep=10,
+                                 path='/__error_log__',
+                                 ignored_exceptions=(), store=history)
+            self._fill(elog, 2)
+            status, headers, body = self._api(
+                elog, query_string='page=%s&limit=1000' % ('9' * 20))
+            self.assertEqual(status, '200 OK')
+            data = json.loads(body.decode('utf-8'))
+            self.assertEqual((data['groups'], data['more']), ([], False))
+
+    def test_api_list_without_samples(self):
+        import json
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        elog.groups.add('fp', 'desc', '0', 1.0, 'KeyError', sample=False)
+        status, headers, body = self._api(elog)
+        group, = json.loads(body.decode('utf-8'))['groups']
+        self.assertEqual(group['latest'], None)
+        self.assertEqual(group['url'], None)
+        body = b''.join(elog.iter_index('/__error_log__'))
+        self.assertTrue(b'href="/__error_log__"' in body)
+
+    def test_api_list_not_modified(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 1)
+        status, headers, body = self._api(elog)
+        etag = headers['etag']
+        status, headers, body = self._api(elog, if_none_match=etag)
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(headers['etag'], etag)
+        self.assertEqual(body, b'')
+        status, headers, body = self._api(elog,
+                                          if_none_match='"x", W/' + etag)
+        self.assertEqual(status, '304 Not Modified')
+
+    def test_api_list_etag_changes(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             samples=1)
+        etag = self._api(elog)[1]['etag']
+        self._fill(elog, 1)
+        changed = self._api(elog)[1]['etag']
+        self.assertNotEqual(changed, etag)
+        # an occurrence which is only counted changes it too
+        self._fill(elog, 1)
+        self.assertEqual(len(elog.history), 1)
+        self.assertNotEqual(self._api(elog)[1]['etag'], changed)
+        status, headers, body = self._api(elog, if_none_match=etag)
+        self.assertEqual(status, '200 OK')
+
+    def test_api_list_etag_differs_between_processes(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        other = self._makeOne(None, channel=None, keep=10,
+                              path='/__error_log__', ignored_exceptions=())
+        self._fill(elog, 2)
+        self._fill(other, 2)
+        etag = self._api(elog)[1]['etag']
+        self.assertNotEqual(self._api(other)[1]['etag'], etag)
+        elog._pid = -1   # as seen by a forked child
+        self.assertNotEqual(self._api(elog)[1]['etag'], etag)
+
+    def test_api_entry(self):
+        import json
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        try:
+            raise KeyError('thekey')
+        except KeyError:
+            elog.insert_error('0', sys.exc_info(),
+                              {'PATH_INFO': '/x', 'wsgi.input': object(),
+                               'HTTP_X': b'bytes'})
+        status, headers, body = self._api(elog, '/0')
+        self.assertEqual(status, '200 OK')
+        etag = '"%s-0"' % elog._process_token()
+        self.assertEqual(headers['etag'], etag)
+        data = json.loads(body.decode('utf-8'))
+        self.assertEqual(data['identifier'], '0')
+        self.assertEqual(data['type'], 'KeyError')
+        self.assertTrue("KeyError: 'thekey'" in data['traceback'])
+        self.assertEqual(data['environ']['PATH_INFO'], '/x')
+        self.assertEqual(data['environ']['wsgi.input'], '<object object>')
+        status, headers, body = self._api(elog, '/0', if_none_match=etag)
+        self.assertEqual(status, '304 Not Modified')
+        # entry 0 of another process is another error
+        status, headers, body = self._api(elog, '/0', if_none_match='"0"')
+        self.assertEqual(status, '200 OK')
+
+    def test_api_entry_missing(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        status, headers, body = self._api(elog, '/nope', if_none_match='*')
+        self.assertEqual(status, '404 Not Found')
+        self.assertEqual(body, b'{"error":"expired"}')
+
+    def _stream(self, elog):
+        env = {'PATH_INFO':'/__error_log__/stream', 'wsgi.url_scheme':'http',
+               'SERVER_NAME':'localhost', 'SERVER_PORT':'80'}
+        response = []
+        def start_response(status, headers):
+            response.append((status, dict(headers)))
+        return elog(env, start_response), response[0]
+
+    def _raise(self, elog, exc=KeyError):
+        try:
+            raise exc('boom')
+        except exc:
+            elog.insert_error(elog.new_identifier(), sys.exc_info(), {})
+
+    def test_stream(self):
+        import json
+        from repoze.errorlog.stream import Broadcaster
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             samples=1,
+                             broadcaster=Broadcaster(heartbeat=0.01))
+        body, (status, headers) = self._stream(elog)
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['content-type'], 'text/event-stream')
+        self.assertEqual(headers['cache-control'], 'no-cache')
+        events = iter(body)
+        self.assertEqual(next(events), b': repoze.errorlog\n\n')
+        self._raise(elog)
+        self._raise(elog)
+        event = next(events).decode('utf-8')
+        self.assertTrue(event.startswith('id: 0\nevent: error\ndata: '))
+        self.assertTrue(event.endswith('\n\n'))
+        data = json.loads(event.splitlines()[2][len('data: '):])
+        self.assertEqual(data['identifier'], '0')
+        self.assertEqual(data['type'], 'KeyError')
+        self.assertEqual(data['description'], "KeyError: 'boom'")
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['url'], '/__error_log__?entry=0')
+        # only counted: no id
+        event = next(events).decode('utf-8')
+        self.assertTrue(event.startswith('event: error\n'))
+        data = json.loads(event.splitlines()[1][len('data: '):])
+        self.assertEqual(data['identifier'], None)
+        self.assertEqual(data['url'], None)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(next(events), b': keepalive\n\n')
+        self.assertEqual(len(elog.broadcaster.subscribers), 1)
+        body.close()
+        self.assertEqual(elog.broadcaster.subscribers, ())
+
+    def test_stream_slow_subscriber(self):
+        from repoze.errorlog.stream import Broadcaster
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             broadcaster=Broadcaster(maxsize=2))
+        body, response = self._stream(elog)
+        events = iter(body)
+        next(events)
+        for exc in (KeyError, ValueError, TypeError):
+            self._raise(elog, exc)
+        self.assertEqual(next(events), b'event: dropped\ndata: 1\n\n')
+        self.assertTrue(b'ValueError' in next(events))
+        self.assertTrue(b'TypeError' in next(events))
+        body.close()
+
+    def test_stream_too_many_subscribers(self):
+        from repoze.errorlog.stream import Broadcaster
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             broadcaster=Broadcaster(max_subscribers=1))
+        body, (status, headers) = self._stream(elog)
+        other, (status, headers) = self._stream(elog)
+        self.assertEqual(status, '503 Service Unavailable')
+        body.close()
+        other, (status, headers) = self._stream(elog)
+        self.assertEqual(status, '200 OK')
+        other.close()
+
+    def test_metrics(self):
+        app = DummyApplication(KeyError)
+        elog = self._makeOne(app, channel=None, keep=1,
+                             path='/__error_log__',
+                             ignored_exceptions=(DummyException,))
+        for i in range(3):
+            self.assertRaises(KeyError, elog, {}, None)
+        app.exc = DummyException
+        self.assertRaises(DummyException, elog, {}, None)
+        env = {'PATH_INFO':'/__error_log__/metrics'}
+        response = []
+        def start_response(status, headers):
+            response.append((status, dict(headers)))
+        body, = elog(env, start_response)
+        status, headers = response[0]
+        self.assertEqual(status, '200 OK')
+        self.assertTrue(headers['content-type'].startswith(
+            'text/plain; version=0.0.4'))
+        self.assertEqual(headers['content-length'], str(len(body)))
+        lines = body.decode('utf-8').splitlines()
+        for line in [
+                'repoze_errorlog_errors_total{type="KeyError"} 3',
+                'repoze_errorlog_ignored_total{type="%s.DummyException"} 1'
+                % __name__,
+                'repoze_errorlog_evictions_total 2',
+                'repoze_errorlog_capture_seconds_bucket{le="+Inf"} 3',
+                'repoze_errorlog_capture_seconds_count 3',
+                'repoze_errorlog_logging_seconds_count 3',
+                'repoze_errorlog_history_errors 1.0',
+                'repoze_errorlog_groups 1.0',
+                'repoze_errorlog_stream_subscribers 0.0',
+                ]:
+            self.assertTrue(line in lines, line)
+
+    def test_export(self):
+        import json
+        exporter = DummyExporter()
+        app = DummyApplication(KeyError('cart'))
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             samples=1, exporters=[exporter])
+        for i in range(2):
+            self.assertRaises(KeyError, elog, {'SCRIPT_NAME': '/app'}, None)
+        first, second = [json.loads(line.decode('utf-8'))
+                         for line in exporter.lines()]
+        self.assertEqual(first['identifier'], '0')
+        self.assertEqual(first['type'], 'KeyError')
+        self.assertEqual(first['url'], '/app/__error_log__?entry=0')
+        self.assertEqual(first['count'], 1)
+        self.assertTrue("KeyError: 'cart'" in first['traceback'])
+        self.assertEqual(first['environ']['SCRIPT_NAME'], '/app')
+        # only counted
+        self.assertEqual(second['identifier'], None)
+        self.assertEqual(second['count'], 2)
+        self.assertFalse('traceback' in second)
+
+    def test_metrics_iteration_ignored(self):
+        app = DummyStreamingApplication(['a'], iter_exc=DummyException)
+        elog = self._makeOne(app, channel=None, keep=10,
+                             path='/__error_log__',
+                             ignored_exceptions=(DummyException,))
+        app_iter = elog({}, None)
+        self.assertRaises(DummyException, list, app_iter)
+        self.assertEqual(elog.metrics.ignored,
+                         {'%s.DummyException' % __name__: 1})
+
     def test_show_entry_view_present(self):
         env = {'PATH_INFO':'/__error_log__', 'wsgi.url_scheme':'http',
                'SERVER_NAME':'localhost', 'SERVER_PORT':'8080',
@@ -153,6 +1021,28 @@ class TestErrorLogging(unittest.TestCase):
         self.assertTrue(b'time1' in body)
         self.assertTrue(b'Error ' in body)
 
+    def test_show_entry_view_context_lines(self):
+        from repoze.errorlog.source import SourceCache
+        source = SourceCache()
+        elog = self._makeOne(DummyApplication(KeyError), channel=None,
+                             keep=10, path='/__error_log__',
+                             ignored_exceptions=(), context_lines=2,
+                             source_cache=source)
+        failed = {'SERVER_NAME': 'localhost'}
+        self.assertRaises(KeyError, elog, failed, None)
+        identifier = str(failed['repoze.errorlog.entryid'])
+        # nothing is read until the error is viewed
+        self.assertEqual(len(source), 0)
+        env = {'PATH_INFO':'/__error_log__', 'wsgi.url_scheme':'http',
+               'SERVER_NAME':'localhost', 'SERVER_PORT':'8080',
+               'QUERY_STRING':'entry=%s' % identifier}
+        body = elog(env, lambda *args: None)[0]
+        self.assertEqual(len(source), 2)
+        self.assertTrue(b'  -> ' in body)
+        self.assertTrue(b'self.environ = environ' in body)
+        # the text logged and cached stays without context
+        self.assertFalse('-> ' in elog.get_error(identifier).text)
+
     def test_show_entry_view_absent(self):
         env = {'PATH_INFO':'/__error_log__', 'wsgi.url_scheme':'http',
                'SERVER_NAME':'localhost', 'SERVER_PORT':'8080',
@@ -172,7 +1062,8 @@ class TestErrorLogging(unittest.TestCase):
                'SERVER_NAME':'localhost', 'SERVER_PORT':'8080',
                'QUERY_STRING':'entry=1'}
         elog = self._makeOne(None, channel=None, keep=10,
-                             path='/__error_log__', ignored_exceptions=())
+                             path='/__error_log__', ignored_exceptions=(),
+                             samples=100)
         import sys
         try:
             raise KeyError
@@ -182,80 +1073,2459 @@ class TestErrorLogging(unittest.TestCase):
         self.assertEqual(len(elog.errors), 1)
 
         # rollover
-        elog.errors = [None] * 10
+        for i in range(10):
+            elog.insert_error('fill%s' % i, exc_info, env)
+        self.assertEqual(len(elog.errors), 10)
         elog.insert_error('id2', exc_info, env)
         self.assertEqual(len(elog.errors), 10)
         from repoze.errorlog import Error
         self.assertEqual(elog.errors[0].__class__, Error)
+        self.assertEqual(elog.errors[0].identifier, 'id2')
+        self.assertEqual(elog.errors[-1].identifier, 'fill1')
+        self.assertEqual(elog.get_error('fill0'), None)
+        self.assertEqual(elog.get_error('id2').identifier, 'id2')
         del exc_info
 
+    def test_set_errors(self):
+        from repoze.errorlog import Error
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=())
+        elog.errors = [
+            Error('2','description2','rendering2','time2',{},'url2'),
+            Error('1','description1','rendering1','time1',{},'url1'),
+            ]
+        self.assertEqual([e.identifier for e in elog.errors], ['2', '1'])
+        self.assertEqual(elog.get_error('1').description, 'description1')
 
-class Test__parse_querystring(unittest.TestCase):
+    def test_concurrent_insert_error(self):
+        import threading
+        env = {}
+        threads, per_thread = 8, 200
+        elog = self._makeOne(None, channel=None, keep=threads * per_thread,
+                             path='/__error_log__', ignored_exceptions=(),
+                             samples=threads * per_thread)
+        try:
+            raise KeyError
+        except:
+            exc_info = sys.exc_info()
+        def worker(exc_info):
+            for i in range(per_thread):
+                elog.insert_error(elog.new_identifier(), exc_info, env)
+        interval = _setswitchinterval(1e-6)
+        try:
+            workers = [threading.Thread(target=worker, args=(exc_info,))
+                       for i in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+        finally:
+            _setswitchinterval(interval)
+        del exc_info
+        identifiers = [error.identifier for error in elog.errors]
+        self.assertEqual(len(identifiers), threads * per_thread)
+        self.assertEqual(len(set(identifiers)), threads * per_thread)
+        self.assertEqual(sorted(identifiers, key=int),
+                         [str(i) for i in range(threads * per_thread)])
+        for identifier in identifiers:
+            self.assertEqual(elog.get_error(identifier).identifier,
+                             identifier)
+        self.assertEqual(elog.counter, threads * per_thread)
+        group = list(elog.groups)[0]
+        self.assertEqual(group.count, threads * per_thread)
 
-    def _callFUT(self, environ):
-        from repoze.errorlog import _parse_querystring
-        return _parse_querystring(environ)
+    def test_insert_error_samples(self):
+        elog = self._makeOne(None, channel=None, keep=10,
+                             path='/__error_log__', ignored_exceptions=(),
+                             samples=2)
+        def fail(exc):
+            try:
+                raise exc
+            except:
+                elog.insert_error(elog.new_identifier(), sys.exc_info(), {})
+        for i in range(100):
+            fail(KeyError)
+        fail(ValueError)
+        self.assertEqual([e.identifier for e in elog.errors],
+                         ['100', '1', '0'])
+        value_group, key_group = list(elog.groups)
+        self.assertEqual(key_group.count, 100)
+        self.assertEqual(key_group.samples, ['0', '1'])
+        self.assertEqual(value_group.count, 1)
+        self.assertEqual(value_group.fingerprint,
+                         elog.get_error('100').fingerprint)
+        self.assertTrue(key_group.first_seen <= key_group.last_seen)
 
-    def test_no_qs(self):
-        environ = {}
-        found = self._callFUT(environ)
-        self.assertEqual(found, [])
+    def test_insert_error_samples_replaced_once_evicted(self):
+        elog = self._makeOne(None, channel=None, keep=3,
+                             path='/__error_log__', ignored_exceptions=(),
+                             samples=1)
+        for i in range(6):
+            for exc in (KeyError, ValueError, TypeError, IndexError):
+                try:
+                    raise exc(i)
+                except exc:
+                    elog.insert_error(elog.new_identifier(), sys.exc_info(),
+                                      {})
+        groups = list(elog.groups)
+        self.assertEqual([g.count for g in groups], [6, 6, 6, 6])
+        # each sample was evicted by the next groups' occurrences, and
+        # replaced by the group's next occurrence
+        self.assertEqual([g.samples for g in groups],
+                         [['23'], ['22'], ['21'], []])
+        for identifier in ('23', '22', '21'):
+            self.assertNotEqual(elog.get_error(identifier), None)
 
-    def test_simple(self):
-        environ = {'QUERY_STRING': 'a=1&b=2&c=3'}
-        found = self._callFUT(environ)
-        self.assertEqual(found,
-                         [('a', '1'), ('b', '2'), ('c', '3')])
+    def test_ctor_rejects_no_samples(self):
+        self.assertRaises(ValueError, self._makeOne, None, channel=None,
+                          keep=3, path='/__error_log__',
+                          ignored_exceptions=(), samples=0)
 
-    def test_w_repeats(self):
-        environ = {'QUERY_STRING': 'a=1&b=2&c=3&b=4'}
-        found = self._callFUT(environ)
-        self.assertEqual(found,
-                         [('a', '1'), ('b', '2'), ('c', '3'), ('b', '4')])
+    def test_fingerprint(self):
+        from repoze.errorlog import _fingerprint
+        frames = [('a.py', 1, 'f'), ('b.py', 2, 'g')]
+        moved = [('a.py', 10, 'f'), ('b.py', 20, 'g')]
+        other = [('a.py', 1, 'f'), ('b.py', 2, 'h')]
+        def snapshot(exc_type, frames, cause=None):
+            from repoze.errorlog import TracebackSnapshot
+            try:
+                raise exc_type()
+            except exc_type:
+                result = TracebackSnapshot(sys.exc_info(), frames)
+            result.cause = cause
+            return result
+        fp = _fingerprint(snapshot(KeyError, frames))
+        self.assertEqual(fp, _fingerprint(snapshot(KeyError, moved)))
+        self.assertNotEqual(fp, _fingerprint(snapshot(KeyError, other)))
+        self.assertNotEqual(fp, _fingerprint(snapshot(ValueError, frames)))
+        chained = snapshot(KeyError, frames, snapshot(ValueError, frames))
+        self.assertNotEqual(fp, _fingerprint(chained))
 
-    def test_w_empty(self):
-        environ = {'QUERY_STRING': 'a&b&c=&d=1'}
-        found = self._callFUT(environ)
-        self.assertEqual(found, [('a', ''), ('b', ''), ('c', ''), ('d', '1')])
 
+    def test_exception_fingerprint(self):
+        from repoze.errorlog import TracebackSnapshot
+        from repoze.errorlog import _exception_fingerprint
+        from repoze.errorlog import _fingerprint
+        from repoze.errorlog import _root_summary
+        def check(exc_info):
+            snapshot = TracebackSnapshot(exc_info)
+            self.assertEqual(_exception_fingerprint(exc_info),
+                             _fingerprint(snapshot))
+            self.assertEqual(_root_summary(exc_info),
+                             snapshot.root_cause.summary)
+        try:
+            _raise_nested(3)
+        except KeyError:
+            check(sys.exc_info())
+        try:
+            try:
+                raise ValueError('first')
+            except ValueError:
+                raise KeyError('second')
+        except KeyError:
+            check(sys.exc_info())
+        try:
+            ExceptionGroup
+        except NameError: #pragma NO COVER Python < 3.11
+            return
+        members = []
+        for i in range(20):
+            try:
+                raise KeyError(i)
+            except KeyError as e:
+                members.append(e)
+        try:
+            raise ExceptionGroup('many', [ExceptionGroup('nested', members)])
+        except ExceptionGroup:
+            check(sys.exc_info())
 
-class Test__construct_url(unittest.TestCase):
+class Test_load_template(unittest.TestCase):
+    def setUp(self):
+        import repoze.errorlog
+        self._saved = repoze.errorlog._templates.copy()
+        repoze.errorlog._templates.clear()
+        self._parse_xml = repoze.errorlog.meld3.parse_xml
+        self.parsed = []
+        def parse_xml(filename):
+            self.parsed.append(filename)
+            return self._parse_xml(filename)
+        repoze.errorlog.meld3.parse_xml = parse_xml
 
-    def _callFUT(self, environ):
-        from repoze.errorlog import _construct_url
-        return _construct_url(environ)
+    def tearDown(self):
+        import repoze.errorlog
+        repoze.errorlog.meld3.parse_xml = self._parse_xml
+        repoze.errorlog._templates.clear()
+        repoze.errorlog._templates.update(self._saved)
 
-    def test_w_HTTP_HOST_wo_port(self):
-        environ = _makeEnviron({'HTTP_HOST': 'example.com'})
-        self.assertEqual(self._callFUT(environ), 'http://example.com')
+    def _callFUT(self, name, reload=False):
+        from repoze.errorlog import _load_template
+        return _load_template(name, reload)
 
-    def test_w_HTTP_HOST_w_default_http_port(self):
-        environ = _makeEnviron({'HTTP_HOST': 'example.com:80'})
-        self.assertEqual(self._callFUT(environ), 'http://example.com')
+    def test_parsed_once(self):
+        first = self._callFUT('errors.html')
+        second = self._callFUT('errors.html')
+        self.assertEqual(len(self.parsed), 1)
+        self.assertFalse(first is second)
+        self.assertEqual(first.write_xhtmlstring(),
+                         second.write_xhtmlstring())
 
-    def test_w_HTTP_HOST_w_non_default_http_port(self):
-        environ = _makeEnviron({'HTTP_HOST': 'example.com:8080'})
-        self.assertEqual(self._callFUT(environ), 'http://example.com:8080')
+    def test_copies_are_independent(self):
+        first = self._callFUT('entry.html')
+        first.findmeld('header').content('changed')
+        second = self._callFUT('entry.html')
+        self.assertFalse(b'changed' in second.write_xhtmlstring())
 
-    def test_w_HTTP_HOST_w_default_https_port(self):
-        environ = _makeEnviron({'HTTP_HOST': 'example.com:443',
-                                'wsgi.url_scheme': 'https',
-                               })
-        self.assertEqual(self._callFUT(environ), 'https://example.com')
+    def test_reload_unchanged(self):
+        self._callFUT('errors.html', reload=True)
+        self._callFUT('errors.html', reload=True)
+        self.assertEqual(len(self.parsed), 1)
 
-    def test_w_HTTP_HOST_w_non_default_https_port(self):
-        environ = _makeEnviron({'HTTP_HOST': 'example.com:4443',
-                                'wsgi.url_scheme': 'https',
-                               })
-        self.assertEqual(self._callFUT(environ), 'https://example.com:4443')
+    def test_reload_changed(self):
+        import repoze.errorlog
+        self._callFUT('errors.html', reload=True)
+        for filename, (mtime, root) in list(
+                repoze.errorlog._templates.items()):
+            repoze.errorlog._templates[filename] = (mtime - 1, root)
+        self._callFUT('errors.html', reload=True)
+        self.assertEqual(len(self.parsed), 2)
 
-    def test_wo_HTTP_HOST_w_default_http_port(self):
-        environ = _makeEnviron({'SERVER_NAME': 'example.com',
-                                'SERVER_PORT': '80',
-                               })
-        self.assertEqual(self._callFUT(environ), 'http://example.com')
+    def test_views_use_cache(self):
+        from repoze.errorlog import ErrorLog
+        elog = ErrorLog(None, None, 10, '/__error_log__', ())
+        for i in range(3):
+            elog.index('http://localhost/__error_log__')
+            elog.entry('1')
+        self.assertEqual(len(self.parsed), 2)
 
-    def test_wo_HTTP_HOST_w_non_default_http_port(self):
+
+class Test_asbool(unittest.TestCase):
+    def _callFUT(self, value):
+        from repoze.errorlog import _asbool
+        return _asbool(value)
+
+    def test_strings(self):
+        for value in ('true', ' Yes', 'ON', '1'):
+            self.assertEqual(self._callFUT(value), True)
+        for value in ('false', 'No ', 'off', '0', ''):
+            self.assertEqual(self._callFUT(value), False)
+
+    def test_invalid_string(self):
+        self.assertRaises(ValueError, self._callFUT, 'maybe')
+
+    def test_non_strings(self):
+        self.assertEqual(self._callFUT(1), True)
+        self.assertEqual(self._callFUT(None), False)
+
+
+class TestMmapStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, size=3, slot_size=4096, name='errors.mmap'):
+        import os
+        from repoze.errorlog.store import MmapStore
+        store = MmapStore(os.path.join(self.tmpdir, name), size, slot_size)
+        self.addCleanup(store.close)
+        return store
+
+    def _makeError(self, identifier, environ=None, text='rendering'):
+        from repoze.errorlog import Error
+        return Error(identifier, 'desc', text, 'time', environ or {}, 'url',
+                     'fp', 1.0)
+
+    def test_contains(self):
+        store = self._makeOne(size=2)
+        for name in 'abc':
+            store.append(self._makeError(name))
+        self.assertFalse(store.contains('a'))
+        self.assertTrue(store.contains('c'))
+        self.assertFalse(self._makeOne(size=0, name='empty').contains('a'))
+
+    def test_errorlogs_resample_what_others_evicted(self):
+        from repoze.errorlog import ErrorLog
+        from repoze.errorlog.store import MmapStore
+        import os
+        filename = os.path.join(self.tmpdir, 'shared.mmap')
+        def make():
+            store = MmapStore(filename, 3, 4096)
+            self.addCleanup(store.close)
+            return ErrorLog(None, None, 3, '/__error_log__', (), samples=2,
+                            store=store)
+        first, second = make(), make()
+        _insert_errors(first, KeyError, 2)
+        for exc in (ValueError, TypeError, IndexError):
+            _insert_errors(second, exc, 1)
+        self.assertFalse('KeyError' in [e.exc_type for e in first.history])
+        _insert_errors(first, KeyError, 3)
+        kept = [e for e in first.history if e.exc_type == 'KeyError']
+        self.assertEqual(len(kept), 2)
+
+    def test_reads_slices_of_the_map(self):
+        # as on Python 2, where there is no memoryview of an mmap
+        store = self._makeOne()
+        store._view.release()
+        store._view = store._map
+        store.append(self._makeError('a'))
+        self.assertEqual(store.get('a').identifier, 'a')
+        self.assertEqual([e.identifier for e in store], ['a'])
+
+    def test_empty(self):
+        store = self._makeOne()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store), [])
+        self.assertEqual(store.get('a'), None)
+        self.assertEqual(store.shared, True)
+
+    def test_append_and_evict(self):
+        store = self._makeOne()
+        for name in 'abcd':
+            evicted = store.append(self._makeError(name))
+        self.assertEqual([e.identifier for e in evicted], ['a'])
+        self.assertEqual(len(store), 3)
+        self.assertEqual([e.identifier for e in store], ['d', 'c', 'b'])
+        self.assertEqual(store.get('a'), None)
+        error = store.get('d')
+        self.assertEqual(error.identifier, 'd')
+        self.assertEqual(error.text, 'rendering\n\n{}')
+        self.assertEqual(error.timestamp, 1.0)
+
+    def test_shared_between_instances(self):
+        first = self._makeOne()
+        second = self._makeOne()
+        first.append(self._makeError('a'))
+        second.append(self._makeError('b'))
+        self.assertEqual([e.identifier for e in first], ['b', 'a'])
+        self.assertEqual(second.get('a').identifier, 'a')
+
+    def test_shared_between_processes(self):
+        import os
+        if not hasattr(os, 'fork'): #pragma NO COVER
+            return
+        store = self._makeOne(size=100)
+        children = []
+        for n in range(4):
+            pid = os.fork()
+            if pid == 0: #pragma NO COVER child
+                try:
+                    for i in range(20):
+                        store.append(self._makeError('%d-%d' % (n, i)))
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+        identifiers = [e.identifier for e in store]
+        self.assertEqual(len(identifiers), 80)
+        self.assertEqual(len(set(identifiers)), 80)
+
+    def test_reinitialized_for_other_size(self):
+        store = self._makeOne()
+        store.append(self._makeError('a'))
+        other = self._makeOne(size=5)
+        self.assertEqual(len(other), 0)
+        self.assertEqual(other.get('a'), None)
+
+    def test_oversized_error_truncated(self):
+        store = self._makeOne(slot_size=1024)
+        environ = {'HTTP_COOKIE': 'x' * 2000}
+        store.append(self._makeError('a', environ, 'frame\n' * 1000))
+        error = store.get('a')
+        self.assertEqual(error.environ, {})
+        self.assertTrue(error.text.startswith('(truncated)'))
+
+    def test_unstorable_error_skipped(self):
+        from repoze.errorlog import Error
+        store = self._makeOne(slot_size=1024)
+        error = Error('a', 'x' * 2000, 'rendering', 'time', {}, 'url')
+        self.assertEqual(store.append(error), [error])
+        self.assertEqual(len(store), 0)
+
+    def test_bad_slot_size(self):
+        self.assertRaises(ValueError, self._makeOne, slot_size=10)
+
+    def test_zero_size(self):
+        store = self._makeOne(size=0)
+        error = self._makeError('a')
+        self.assertEqual(store.append(error), [error])
+        self.assertEqual(list(store), [])
+        self.assertEqual(store.get('a'), None)
+
+    def test_clear(self):
+        store = self._makeOne()
+        version = store.version()
+        store.append(self._makeError('a'))
+        store.clear()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.get('a'), None)
+        # emptied, but not the history that was
+        self.assertNotEqual(store.version(), version)
+        store.append(self._makeError('b'))
+        self.assertEqual([e.identifier for e in store], ['b'])
+
+    def test_version(self):
+        store = self._makeOne()
+        version = store.version()
+        store.append(self._makeError('a'))
+        self.assertNotEqual(store.version(), version)
+        self.assertEqual(self._makeOne().version(), store.version())
+
+    def test_overwritten_while_reading(self):
+        store = self._makeOne(size=1)
+        store.append(self._makeError('a'))
+        store.append(self._makeError('b'))
+        self.assertEqual(store._load(0), None)
+
+    def test_errorlog_workers(self):
+        import os
+        from repoze.errorlog import ErrorLog
+        filename = os.path.join(self.tmpdir, 'errors.mmap')
+        workers = []
+        for i in range(2):
+            store = self._makeOne(size=10)
+            workers.append(ErrorLog(DummyApplication(KeyError), None, 10,
+                                    '/__error_log__', (), store=store))
+        for worker in workers:
+            self.assertRaises(KeyError, worker, {}, None)
+        first, second = workers
+        identifiers = [e.identifier for e in first.errors]
+        self.assertEqual(len(set(identifiers)), 2)
+        self.assertTrue(first.get_error(identifiers[0]) is not None)
+        self.assertTrue(second.get_error(identifiers[1]) is not None)
+        body = second.index('http://localhost/__error_log__')
+        self.assertTrue(b'<span>2</span> times' in body)
+        self.assertFalse(b'Error Expired' in second.entry(identifiers[0]))
+
+
+class TestSQLiteStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, size=3, **kw):
+        import os
+        from repoze.errorlog.store import SQLiteStore
+        store = SQLiteStore(os.path.join(self.tmpdir, 'errors.db'), size,
+                            **kw)
+        self.addCleanup(store.close)
+        return store
+
+    def _makeError(self, identifier, fingerprint='fp', timestamp=1.0):
+        from repoze.errorlog import Error
+        return Error(identifier, 'desc', 'rendering', 'time', {}, 'url',
+                     fingerprint, timestamp)
+
+    def test_empty(self):
+        store = self._makeOne()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store), [])
+        self.assertEqual(store.get('a'), None)
+        self.assertEqual(store.groups(), [])
+        self.assertEqual(store.shared, True)
+
+    def test_wal_and_indexes(self):
+        store = self._makeOne()
+        db = store._connection
+        self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0],
+                         'wal')
+        indexes = set(row[1] for row in
+                      db.execute("PRAGMA index_list('errors')"))
+        self.assertEqual(indexes, set(['errors_identifier',
+                                       'errors_timestamp']))
+
+    def test_append_and_retain_by_count(self):
+        store = self._makeOne()
+        for name in 'abcd':
+            self.assertEqual(store.append(self._makeError(name)), None)
+        self.assertEqual(len(store), 3)
+        self.assertEqual([e.identifier for e in store], ['d', 'c', 'b'])
+        self.assertEqual(store.get('a'), None)
+        error = store.get('d')
+        self.assertEqual(error.text, 'rendering\n\n{}')
+        self.assertEqual(error.timestamp, 1.0)
+
+    def test_version(self):
+        store = self._makeOne()
+        versions = set([store.version()])
+        for name in 'abcd':
+            store.append(self._makeError(name))
+            versions.add(store.version())
+        self.assertEqual(len(versions), 5)
+
+    def test_retain_by_age(self):
+        import time
+        store = self._makeOne(max_age=60)
+        store.append(self._makeError('old', timestamp=time.time() - 120))
+        store.append(self._makeError('new', timestamp=time.time()))
+        self.assertEqual([e.identifier for e in store], ['new'])
+
+    def test_retain_by_age_on_read(self):
+        import time
+        store = self._makeOne(max_age=60, flush_interval=0)
+        store.append(self._makeError('old', timestamp=time.time() - 30))
+        store.flush()
+        store.max_age = 10
+        self.assertEqual(list(store), [])
+
+    def test_reads_dont_write(self):
+        import time
+        store = self._makeOne(max_age=60, flush_interval=60)
+        store.append(self._makeError('a', timestamp=time.time()))
+        store.flush()
+        statements = []
+        store._connection.set_trace_callback(statements.append)
+        version = store.version()
+        self.assertEqual(store.version(), version)
+        self.assertEqual(list(store)[0].identifier, 'a')
+        self.assertFalse([sql for sql in statements
+                          if 'DELETE' in sql or 'IMMEDIATE' in sql])
+
+    def test_batched(self):
+        store = self._makeOne(size=10, batch_size=3, flush_interval=60)
+        store.append(self._makeError('a'))
+        store.append(self._makeError('b'))
+        self.assertEqual(len(store._pending), 2)
+        store.append(self._makeError('c'))
+        self.assertEqual(store._pending, [])
+        self.assertEqual(store._timer, None)
+        count = store._connection.execute(
+            'SELECT COUNT(*) FROM errors').fetchone()[0]
+        self.assertEqual(count, 3)
+
+    def test_flushed_after_interval(self):
+        import time
+        store = self._makeOne(size=10, flush_interval=0.01)
+        store.append(self._makeError('a'))
+        deadline = time.time() + 5
+        while store._pending and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(store._pending, [])
+
+    def test_persistent_and_shared(self):
+        first = self._makeOne()
+        first.append(self._makeError('a'))
+        first.close()
+        second = self._makeOne()
+        self.assertEqual(second.get('a').identifier, 'a')
+
+    def test_groups(self):
+        store = self._makeOne(size=10)
+        store.append(self._makeError('a', 'fp1', 1.0))
+        store.append(self._makeError('b', 'fp2', 2.0))
+        store.append(self._makeError('c', 'fp1', 3.0))
+        groups = store.groups()
+        self.assertEqual([g.fingerprint for g in groups], ['fp1', 'fp2'])
+        self.assertEqual(groups[0].count, 2)
+        self.assertEqual(groups[0].first_seen, 1.0)
+        self.assertEqual(groups[0].last_seen, 3.0)
+        self.assertEqual(groups[0].samples, ['c'])
+
+    def test_groups_sample_newest(self):
+        # neither the earliest nor the latest timestamp
+        store = self._makeOne(size=10)
+        store.append(self._makeError('a', 'fp1', 5.0))
+        store.append(self._makeError('b', 'fp1', 10.0))
+        store.append(self._makeError('c', 'fp1', 7.0))
+        group, = store.groups()
+        self.assertEqual(group.first_seen, 5.0)
+        self.assertEqual(group.last_seen, 10.0)
+        self.assertEqual(group.samples, ['c'])
+
+    def test_groups_selected(self):
+        store = self._makeOne(size=10)
+        for identifier, fp, exc_type, timestamp in [
+                ('a', 'fp1', 'KeyError', 1.0),
+                ('b', 'fp2', 'pkg.KeyError', 2.0),
+                ('c', 'fp3', 'pkg.NotKeyError', 3.0),
+                ('d', 'fp1', 'KeyError', 4.0),
+                ('e', 'fp4', 'ValueError', 5.0)]:
+            error = self._makeError(identifier, fp, timestamp)
+            error.exc_type = exc_type
+            store.append(error)
+        def fingerprints(**kw):
+            return [g.fingerprint for g in store.groups(**kw)]
+        self.assertEqual(fingerprints(), ['fp4', 'fp1', 'fp3', 'fp2'])
+        self.assertEqual(fingerprints(exc_type='KeyError'), ['fp1', 'fp2'])
+        self.assertEqual(fingerprints(exc_type='pkg.KeyError'), ['fp2'])
+        self.assertEqual(fingerprints(since=3.0), ['fp4', 'fp1', 'fp3'])
+        self.assertEqual(fingerprints(fingerprints=set(['fp2', 'fp3'])),
+                         ['fp3', 'fp2'])
+        self.assertEqual(fingerprints(offset=1, limit=2), ['fp1', 'fp3'])
+        self.assertEqual(fingerprints(offset=3), ['fp2'])
+        self.assertEqual(fingerprints(exc_type='KeyError', since=2.0,
+                                      limit=1), ['fp1'])
+        group = store.groups(since=4.0, exc_type='KeyError')[0]
+        # counts over every occurrence, not only those selected by time
+        self.assertEqual(group.count, 2)
+        self.assertEqual(group.first_seen, 1.0)
+        store._MAX_PARAMETERS = 1
+        self.assertEqual(fingerprints(fingerprints=set(['fp2', 'fp3']),
+                                      limit=1), ['fp3'])
+
+    def test_contains(self):
+        store = self._makeOne(size=2)
+        for name in 'abc':
+            store.append(self._makeError(name))
+        self.assertFalse(store.contains('a'))
+        self.assertTrue(store.contains('c'))
+
+    def test_errorlog_resamples_after_retention(self):
+        from repoze.errorlog import ErrorLog
+        elog = ErrorLog(None, None, 4, '/__error_log__', (), samples=2,
+                        store=self._makeOne(size=4))
+        _insert_errors(elog, KeyError, 2)
+        for exc in (ValueError, TypeError, IndexError, AttributeError):
+            _insert_errors(elog, exc, 1)
+        _insert_errors(elog, KeyError, 5)
+        self.assertEqual([e.exc_type for e in elog.history].count('KeyError'),
+                         2)
+        self.assertTrue('KeyError' in
+                        [g.exc_type for g in elog.history.groups()])
+
+    def test_records_stored_as_blobs(self):
+        store = self._makeOne()
+        store.append(self._makeError('a'))
+        store.flush()
+        self.assertEqual(store._connection.execute(
+            'SELECT typeof(data) FROM errors').fetchall(), [('blob',)])
+
+    def test_zero_size(self):
+        store = self._makeOne(size=0)
+        error = self._makeError('a')
+        self.assertEqual(store.append(error), [error])
+        self.assertEqual(len(store), 0)
+
+    def test_clear(self):
+        store = self._makeOne()
+        version = store.version()
+        store.append(self._makeError('a'))
+        store.clear()
+        self.assertEqual(len(store), 0)
+        self.assertNotEqual(store.version(), version)
+
+    def test_version_differs_when_recreated(self):
+        import os
+        store = self._makeOne()
+        version = store.version()
+        store.close()
+        for name in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, name))
+        self.assertNotEqual(self._makeOne().version(), version)
+
+    def test_reconnect_after_fork(self):
+        store = self._makeOne()
+        store.append(self._makeError('a'))
+        connection = store._connection
+        store._pid = -1   # as seen by a forked child
+        store.append(self._makeError('b'))
+        self.assertFalse(store._connection is connection)
+        connection.close()
+        self.assertEqual([e.identifier for e in store], ['b'])
+
+    def test_rejects_other_rows(self):
+        from repoze.errorlog.record import RecordError
+        store = self._makeOne()
+        store._connection.execute(store._INSERT, (
+            'a', 1.0, None, 'fp', 'desc', b'\x80\x02not a record'))
+        self.assertRaises(RecordError, store.get, 'a')
+
+    def test_errorlog(self):
+        import os
+        from repoze.errorlog import make_errorlog
+        filename = os.path.join(self.tmpdir, 'errors.db')
+        elog = make_errorlog(DummyApplication(KeyError), None,
+                             store='sqlite:%s' % filename, max_age='3600')
+        self.addCleanup(elog.history.close)
+        self.assertEqual(elog.history.max_age, 3600)
+        env = {}
+        self.assertRaises(KeyError, elog, env, None)
+        identifier = env['repoze.errorlog.entryid']
+        self.assertEqual(elog.get_error(identifier).exc_type, 'KeyError')
+        body = elog.index('http://localhost/__error_log__')
+        self.assertTrue(b'<span>1</span> times' in body)
+
+
+class Test_make_store(unittest.TestCase):
+    def _callFUT(self, spec, keep=10):
+        from repoze.errorlog.store import make_store
+        return make_store(spec, keep)
+
+    def test_default(self):
+        from repoze.errorlog.store import RingBuffer
+        self.assertTrue(isinstance(self._callFUT(None), RingBuffer))
+        store = self._callFUT('memory', 5)
+        self.assertTrue(isinstance(store, RingBuffer))
+        self.assertEqual(store.size, 5)
+
+    def test_mmap(self):
+        import os
+        import tempfile
+        from repoze.errorlog.store import MmapStore
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'errors')
+            store = self._callFUT('mmap:%s' % filename)
+            self.assertTrue(isinstance(store, MmapStore))
+            self.assertEqual(store.filename, filename)
+            self.assertEqual(store.size, 10)
+            store.close()
+        finally:
+            import shutil
+            shutil.rmtree(tmpdir)
+
+    def test_sqlite(self):
+        import os
+        import tempfile
+        from repoze.errorlog.store import SQLiteStore
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'errors.db')
+            from repoze.errorlog.store import make_store
+            store = make_store('sqlite:%s' % filename, 10, 60)
+            self.assertTrue(isinstance(store, SQLiteStore))
+            self.assertEqual(store.filename, filename)
+            self.assertEqual(store.size, 10)
+            self.assertEqual(store.max_age, 60)
+            store.close()
+        finally:
+            import shutil
+            shutil.rmtree(tmpdir)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, self._callFUT, 'sqlite:')
+        self.assertRaises(ValueError, self._callFUT, 'mmap:')
+        self.assertRaises(ValueError, self._callFUT, 'redis://localhost')
+
+
+class TestLogWriter(unittest.TestCase):
+    def setUp(self):
+        import logging
+        self.logger = logging.getLogger('repoze.errorlog.tests.writer')
+        self.handler = DummyHandler()
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        # cleanups run after tearDown, and after the writers are stopped
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.addCleanup(setattr, self.logger, 'propagate', True)
+
+    def tearDown(self):
+        self.handler.proceed.set()
+
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.writer import LogWriter
+        writer = LogWriter(*arg, **kw)
+        self.addCleanup(writer.stop, 5)
+        return writer
+
+    def _log(self, writer, text='traceback\n'):
+        from repoze.errorlog.writer import make_record
+        record = make_record(self.logger, '\n')
+        writer.log(self.logger, record, text)
+
+    def test_log(self):
+        import logging
+        writer = self._makeOne()
+        self.handler.proceed.set()
+        self._log(writer)
+        writer.stop(5)
+        record, = self.handler.records
+        self.assertEqual(record.levelno, logging.ERROR)
+        self.assertEqual(record.exc_text, 'traceback')
+        self.assertEqual(writer.dropped, 0)
+
+    def test_drop_when_full(self):
+        writer = self._makeOne(1)
+        self._log(writer)
+        self.assertTrue(self.handler.entered.wait(5))
+        self._log(writer)   # queued
+        self._log(writer)   # dropped
+        self.assertEqual(writer.dropped, 1)
+        self.handler.proceed.set()
+        writer.stop(5)
+        self.assertEqual(len(self.handler.records), 2)
+
+    def test_block_with_timeout(self):
+        writer = self._makeOne(1, block=True, timeout=0.01)
+        self._log(writer)
+        self.assertTrue(self.handler.entered.wait(5))
+        self._log(writer)
+        self._log(writer)
+        self.assertEqual(writer.dropped, 1)
+
+    def test_restart_after_fork(self):
+        writer = self._makeOne()
+        self._log(writer)
+        queue = writer.queue
+        writer._pid = -1   # as seen by a forked child
+        self.handler.proceed.set()
+        self._log(writer)
+        self.assertFalse(writer.queue is queue)
+        writer.stop(5)
+        self.assertTrue(len(self.handler.records) >= 1)
+
+    def test_restart_after_stop(self):
+        writer = self._makeOne()
+        self.handler.proceed.set()
+        self._log(writer)
+        writer.stop(5)
+        self._log(writer)
+        writer.stop(5)
+        self.assertEqual(len(self.handler.records), 2)
+
+    def test_stop_not_started(self):
+        writer = self._makeOne()
+        writer.stop()
+
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, sink, **kw):
+        from repoze.errorlog.export import Exporter
+        kw.setdefault('backoff', 0.001)
+        exporter = Exporter(sink, **kw)
+        self.addCleanup(exporter.stop, 5)
+        return exporter
+
+    def _spilled(self):
+        return [n for n in os.listdir(self.tmpdir) if n.endswith('.gz')]
+
+    def test_batches_by_size(self):
+        sink = DummySink()
+        exporter = self._makeOne(sink, batch_size=2, interval=60)
+        for i in range(5):
+            exporter.export({'identifier': str(i)})
+        exporter.stop(5)
+        self.assertEqual([len(batch) for batch in sink.batches], [2, 2, 1])
+        self.assertEqual(sink.batches[0][0], b'{"identifier":"0"}\n')
+        self.assertEqual(exporter.exported, 5)
+
+    def test_batches_by_bytes(self):
+        sink = DummySink()
+        exporter = self._makeOne(sink, batch_bytes=30, interval=60)
+        for i in range(3):
+            exporter.export({'identifier': str(i)})
+        exporter.stop(5)
+        self.assertEqual([len(batch) for batch in sink.batches], [2, 1])
+
+    def test_batches_by_time(self):
+        sink = DummySink()
+        exporter = self._makeOne(sink, interval=0.01)
+        exporter.export({'identifier': '0'})
+        self.assertTrue(sink.sent.wait(5))
+        self.assertEqual(len(sink.batches), 1)
+
+    def test_drop_when_full(self):
+        import threading
+        sink = DummySink()
+        sink.proceed = threading.Event()
+        exporter = self._makeOne(sink, maxsize=1, batch_size=1)
+        exporter.export({})
+        self.assertTrue(sink.entered.wait(5))
+        exporter.export({})   # queued
+        exporter.export({})   # dropped
+        self.assertEqual(exporter.dropped, 1)
+        sink.proceed.set()
+        exporter.stop(5)
+        self.assertEqual(exporter.exported, 2)
+
+    def test_retry(self):
+        sink = DummySink(failures=2)
+        exporter = self._makeOne(sink, batch_size=1, retries=2)
+        exporter.export({})
+        exporter.stop(5)
+        self.assertEqual(len(sink.batches), 1)
+        self.assertEqual(exporter.failed, 0)
+
+    def test_retries_exhausted(self):
+        sink = DummySink(failures=3)
+        exporter = self._makeOne(sink, batch_size=1, retries=2)
+        exporter.export({})
+        exporter.stop(5)
+        self.assertEqual(sink.batches, [])
+        self.assertEqual(exporter.failed, 1)
+
+    def test_spill_and_resend(self):
+        sink = DummySink(failures=1)
+        exporter = self._makeOne(sink, batch_size=1, spill_dir=self.tmpdir,
+                                 backoff=0.05)
+        exporter.export({'identifier': '0'})
+        exporter.export({'identifier': '1'})
+        # stopping leaves what is still spilled for the next process, so
+        # wait for both batches to be resent
+        import time
+        deadline = time.time() + 5
+        while len(sink.batches) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        exporter.stop(5)
+        # sent in order once the sink came back
+        self.assertEqual(sink.batches, [[b'{"identifier":"0"}\n'],
+                                        [b'{"identifier":"1"}\n']])
+        self.assertEqual(exporter.spilled, 2)
+        self.assertEqual(exporter.exported, 2)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_spill_kept_across_restarts(self):
+        sink = DummySink(failures=100)
+        exporter = self._makeOne(sink, batch_size=1, spill_dir=self.tmpdir,
+                                 backoff=60)
+        exporter.export({'identifier': '0'})
+        exporter.stop(5)
+        self.assertEqual(len(self._spilled()), 1)
+        sink = DummySink()
+        exporter = self._makeOne(sink, spill_dir=self.tmpdir)
+        exporter.export({'identifier': '1'})
+        exporter.stop(5)
+        self.assertEqual(sink.batches, [[b'{"identifier":"0"}\n'],
+                                        [b'{"identifier":"1"}\n']])
+
+    def test_spill_bounded(self):
+        sink = DummySink(failures=100)
+        exporter = self._makeOne(sink, batch_size=1, spill_dir=self.tmpdir,
+                                 backoff=60, max_spill_bytes=100)
+        for i in range(3):
+            exporter.export({'identifier': str(i)})
+        exporter.stop(5)
+        self.assertEqual(len(self._spilled()), 2)
+        self.assertEqual(exporter.spilled, 3)
+        self.assertEqual(exporter.failed, 1)
+
+    def test_restart_after_fork(self):
+        sink = DummySink()
+        exporter = self._makeOne(sink, batch_size=1)
+        exporter.export({})
+        queue = exporter.queue
+        exporter._pid = -1   # as seen by a forked child
+        exporter.export({})
+        self.assertFalse(exporter.queue is queue)
+
+
+class TestFileSink(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'errors.jsonl')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.export import FileSink
+        return FileSink(self.filename, *arg, **kw)
+
+    def _read(self, suffix=''):
+        with open(self.filename + suffix, 'rb') as f:
+            return f.read()
+
+    def test_append(self):
+        sink = self._makeOne()
+        sink.send([b'a\n', b'b\n'])
+        sink.send([b'c\n'])
+        self.assertEqual(self._read(), b'a\nb\nc\n')
+
+    def test_rotate(self):
+        sink = self._makeOne(max_bytes=4, backups=2)
+        for line in (b'a\n', b'b\n', b'c\n', b'd\n', b'e\n', b'f\n',
+                     b'g\n'):
+            sink.send([line])
+        self.assertEqual(self._read(), b'g\n')
+        self.assertEqual(self._read('.1'), b'e\nf\n')
+        self.assertEqual(self._read('.2'), b'c\nd\n')
+        self.assertFalse(os.path.exists(self.filename + '.3'))
+
+    def test_rotate_no_backups(self):
+        sink = self._makeOne(max_bytes=2, backups=0)
+        sink.send([b'a\n'])
+        sink.send([b'b\n'])
+        self.assertEqual(self._read(), b'b\n')
+        self.assertEqual(os.listdir(self.tmpdir), ['errors.jsonl'])
+
+
+class TestHTTPSink(unittest.TestCase):
+    def setUp(self):
+        self.collector = DummyCollector()
+
+    def tearDown(self):
+        self.collector.close()
+
+    def _makeOne(self, path='/ingest?key=1', **kw):
+        from repoze.errorlog.export import HTTPSink
+        return HTTPSink(self.collector.url + path, **kw)
+
+    def test_send_compressed(self):
+        import zlib
+        sink = self._makeOne()
+        sink.send([b'{"a":1}\n', b'{"b":2}\n'])
+        (path, encoding, body), = self.collector.requests
+        self.assertEqual(path, '/ingest?key=1')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(zlib.decompress(body, 31), b'{"a":1}\n{"b":2}\n')
+
+    def test_send_uncompressed(self):
+        sink = self._makeOne('', compress=False)
+        sink.send([b'{"a":1}\n'])
+        (path, encoding, body), = self.collector.requests
+        self.assertEqual(path, '/')
+        self.assertEqual(encoding, None)
+        self.assertEqual(body, b'{"a":1}\n')
+
+    def test_error_status(self):
+        self.collector.status = 503
+        sink = self._makeOne()
+        self.assertRaises(IOError, sink.send, [b'{}\n'])
+
+    def test_https(self):
+        from repoze.errorlog._compat import HTTPSConnection
+        from repoze.errorlog.export import HTTPSink
+        sink = HTTPSink('https://example.com')
+        self.assertTrue(sink._connection_class is HTTPSConnection)
+
+
+class TestUDPSink(unittest.TestCase):
+    def setUp(self):
+        import socket
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(5)
+
+    def tearDown(self):
+        self.socket.close()
+
+    def _makeOne(self, **kw):
+        from repoze.errorlog.export import UDPSink
+        sink = UDPSink('127.0.0.1', self.socket.getsockname()[1], **kw)
+        self.addCleanup(sink.close)
+        return sink
+
+    def test_datagrams(self):
+        sink = self._makeOne(max_datagram=10)
+        sink.max_payload = 20
+        sink.send([b'aaaa\n', b'bbbb\n', b'cccc\n', b'd' * 30 + b'\n'])
+        self.assertEqual(self.socket.recv(100), b'aaaa\nbbbb\n')
+        self.assertEqual(self.socket.recv(100), b'cccc\n')
+        self.assertEqual(sink.oversized, 1)
+
+    def test_compressed(self):
+        import zlib
+        sink = self._makeOne(compress=True)
+        sink.send([b'{"a":1}\n'])
+        self.assertEqual(zlib.decompress(self.socket.recv(100), 31),
+                         b'{"a":1}\n')
+
+
+class Test_make_exporter(unittest.TestCase):
+    def _callFUT(self, spec, *arg, **kw):
+        from repoze.errorlog.export import make_exporter
+        return make_exporter(spec, *arg, **kw)
+
+    def test_http(self):
+        from repoze.errorlog.export import HTTPSink
+        exporter = self._callFUT('http://localhost:8080/errors',
+                                 compress=False, timeout=1.0, batch_size=7)
+        self.assertTrue(isinstance(exporter.sink, HTTPSink))
+        self.assertEqual(exporter.sink.url, 'http://localhost:8080/errors')
+        self.assertEqual(exporter.sink.compress, False)
+        self.assertEqual(exporter.sink.timeout, 1.0)
+        self.assertEqual(exporter.batch_size, 7)
+        self.assertEqual(exporter.spill_dir, None)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, self._callFUT, 'ftp://host/')
+        self.assertRaises(ValueError, self._callFUT, 'file:')
+        self.assertRaises(ValueError, self._callFUT, 'udp:host')
+
+
+class TestRecord(unittest.TestCase):
+    def _makeError(self, rendering='rendering', environ=None):
+        from repoze.errorlog import Error
+        return Error('1', 'desc', rendering, 'time', environ or {}, 'url',
+                     'fp', 1.5)
+
+    def _makeSnapshot(self):
+        from repoze.errorlog import TracebackSnapshot
+        try:
+            try:
+                _raise_nested(5)
+            except KeyError:
+                raise ValueError('chained')
+        except ValueError:
+            return TracebackSnapshot(sys.exc_info())
+
+    def _roundtrip(self, error):
+        from repoze.errorlog.record import dumps
+        from repoze.errorlog.record import loads
+        return loads(dumps(error))
+
+    def test_roundtrip_text(self):
+        error = self._makeError()
+        copy = self._roundtrip(error)
+        for name in ('identifier', 'description', 'time', 'url',
+                     'fingerprint', 'timestamp', 'exc_type', 'environ',
+                     'size'):
+            self.assertEqual(getattr(copy, name), getattr(error, name))
+        self.assertEqual(copy.text, error.text)
+
+    def test_roundtrip_environ_values(self):
+        environ = {'a': u'caf\xe9', 'b': b'\x00\xff', 'c': 0, 'd': -3,
+                   'e': 2 ** 70, 'f': 0.25, 'g': True, 'h': False,
+                   'i': None, 'j': (1, u'x', None), 'k': u'\udce9'}
+        error = self._makeError(environ=environ)
+        self.assertEqual(self._roundtrip(error).environ, environ)
+
+    def test_roundtrip_snapshot(self):
+        snapshot = self._makeSnapshot()
+        snapshot.omitted = 2
+        snapshot.locals = [None] * (len(snapshot.frames) - 1) + [
+            [('depth', '0'), ('x', "'y'")]]
+        error = self._makeError(snapshot)
+        copy = self._roundtrip(error)
+        self.assertEqual(copy.exc_type, 'ValueError')
+        self.assertEqual(copy.traceback.frames, snapshot.frames)
+        self.assertEqual(copy.traceback.omitted, 2)
+        self.assertEqual(copy.traceback.locals, snapshot.locals)
+        self.assertEqual(copy.traceback.explicit_cause, False)
+        self.assertEqual(copy.traceback.cause.exc_type, 'KeyError')
+        self.assertEqual(copy.text, error.text)
+
+    def test_roundtrip_group(self):
+        from repoze.errorlog import TracebackSnapshot
+        snapshot = TracebackSnapshot((KeyError, KeyError('a'), None))
+        member = TracebackSnapshot((ValueError, ValueError('b'), None))
+        snapshot.exceptions = [member]
+        snapshot.more_exceptions = 3
+        copy = self._roundtrip(self._makeError(snapshot)).traceback
+        self.assertEqual([m.exc_type for m in copy.exceptions],
+                         ['ValueError'])
+        self.assertEqual(copy.more_exceptions, 3)
+        self.assertEqual(str(copy), str(snapshot))
+
+    def test_other_rendering_stored_as_text(self):
+        copy = self._roundtrip(self._makeError(DummyRendering()))
+        self.assertEqual(copy.traceback, 'rendered')
+
+    def test_strings_stored_once(self):
+        from repoze.errorlog.record import dumps
+        error = self._makeError(self._makeSnapshot())
+        data = dumps(error)
+        filename = __file__.encode('utf-8')
+        self.assertEqual(data.count(filename), 1)
+        self.assertTrue(len(data) * 3 < len(error.text.encode('utf-8')))
+
+    def test_loads_buffers(self):
+        from repoze.errorlog.record import dumps
+        from repoze.errorlog.record import loads
+        data = dumps(self._makeError())
+        for buf in (bytearray(data), memoryview(b'xx' + data)[2:]):
+            self.assertEqual(loads(buf).identifier, '1')
+
+    def test_not_a_record(self):
+        from repoze.errorlog.record import RecordError
+        from repoze.errorlog.record import is_record
+        from repoze.errorlog.record import loads
+        self.assertFalse(is_record(b'\x80\x02'))
+        self.assertRaises(RecordError, loads, b'\x80\x02pickle')
+
+    def test_unknown_version(self):
+        from repoze.errorlog.record import RecordError
+        from repoze.errorlog.record import dumps
+        from repoze.errorlog.record import loads
+        data = bytearray(dumps(self._makeError()))
+        data[3] = 99
+        self.assertRaises(RecordError, loads, data)
+
+    def test_corrupt(self):
+        from repoze.errorlog.record import RecordError
+        from repoze.errorlog.record import dumps
+        from repoze.errorlog.record import loads
+        data = dumps(self._makeError(self._makeSnapshot()))
+        for end in (5, len(data) // 2, len(data) - 1):
+            self.assertRaises(RecordError, loads, data[:end])
+        # no strings, and an unknown tag for the identifier
+        self.assertRaises(RecordError, loads, b'RZE\x01\x00\xc8')
+
+
+class TestSourceCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.source import SourceCache
+        return SourceCache(*arg, **kw)
+
+    def _write(self, name, text, mtime=None):
+        import os
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+        return filename
+
+    def test_getlines_cached(self):
+        cache = self._makeOne()
+        filename = self._write('a.py', 'one\ntwo\n')
+        lines = cache.getlines(filename)
+        self.assertEqual(lines, ['one\n', 'two\n'])
+        self.assertTrue(cache.getlines(filename) is lines)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.bytes, 8)
+
+    def test_getlines_reread_when_modified(self):
+        cache = self._makeOne()
+        filename = self._write('a.py', 'one\n', mtime=1000)
+        cache.getlines(filename)
+        self._write('a.py', 'changed\n', mtime=2000)
+        self.assertEqual(cache.getlines(filename), ['changed\n'])
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.bytes, 8)
+
+    def test_byte_budget(self):
+        cache = self._makeOne(max_bytes=10)
+        first = self._write('a.py', 'aaaa\n')
+        second = self._write('b.py', 'bbbb\n')
+        third = self._write('c.py', 'cccc\n')
+        cache.getlines(first)
+        cache.getlines(second)
+        cache.getlines(first)
+        cache.getlines(third)
+        # the least recently used went
+        self.assertEqual(sorted(cache._files), sorted([first, third]))
+        self.assertEqual(cache.bytes, 10)
+        big = self._write('big.py', 'x' * 20 + '\n')
+        self.assertEqual(cache.getlines(big), ['x' * 20 + '\n'])
+        self.assertEqual(len(cache), 2)
+
+    def test_not_a_file(self):
+        import linecache
+        cache = self._makeOne()
+        self.assertEqual(cache.getlines('<string>'), [])
+        linecache.cache['<fake>'] = (3, None, ['a\n'], '<fake>')
+        try:
+            self.assertEqual(cache.getlines('<fake>'), ['a\n'])
+        finally:
+            del linecache.cache['<fake>']
+        self.assertEqual(cache.getlines(self.tmpdir), [])
+        self.assertEqual(len(cache), 0)
+
+    def test_context(self):
+        cache = self._makeOne()
+        filename = self._write('a.py', ''.join('%d\n' % i
+                                               for i in range(1, 11)))
+        self.assertEqual(cache.context(filename, 5, 2),
+                         (3, ['3', '4', '5', '6', '7']))
+        self.assertEqual(cache.context(filename, 1, 2), (1, ['1', '2', '3']))
+        self.assertEqual(cache.context(filename, 10, 1), (9, ['9', '10']))
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache.getlines(self._write('a.py', 'one\n'))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.bytes, 0)
+
+
+class TestRecordLimits(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.limits import RecordLimits
+        return RecordLimits(*arg, **kw)
+
+    def _makeError(self, rendering, environ, limits):
+        from repoze.errorlog import Error
+        return Error('1', 'desc', rendering, 'time', environ, 'url',
+                     limits=limits)
+
+    def test_wanted(self):
+        limits = self._makeOne(include=['HTTP_*', 'PATH_INFO'],
+                               exclude=['HTTP_COOKIE', '*_TOKEN'])
+        self.assertTrue(limits.wanted('PATH_INFO'))
+        self.assertTrue(limits.wanted('HTTP_HOST'))
+        self.assertFalse(limits.wanted('HTTP_COOKIE'))
+        self.assertFalse(limits.wanted('HTTP_X_API_TOKEN'))
+        self.assertFalse(limits.wanted('wsgi.input'))
+        self.assertTrue(self._makeOne().wanted('wsgi.input'))
+
+    def test_truncate(self):
+        limits = self._makeOne(max_value_length=3)
+        self.assertEqual(limits.truncate('abc'), 'abc')
+        self.assertEqual(limits.truncate('abcd'), 'abc... (1 more)')
+        self.assertEqual(limits.truncate(b'abcde'), b'abc... (2 more)')
+        self.assertEqual(limits.truncate(12345), 12345)
+        self.assertEqual(self._makeOne(max_value_length=None).truncate(
+            'x' * 10000), 'x' * 10000)
+
+    def test_snapshot_environ_tuples(self):
+        limits = self._makeOne(max_value_length=2)
+        snapshot = limits.snapshot_environ({'a': ('abc', 1), 'b': (object(),)})
+        self.assertEqual(snapshot, {'a': ('ab... (1 more)', 1),
+                                    'b': '<tuple object>'})
+
+    def test_snapshot_environ_entryid(self):
+        from repoze.errorlog import ErrorLog
+        from repoze.errorlog import _LazyIdentifier
+        elog = ErrorLog(None, channel=None, keep=10, path='/__error_log__',
+                        ignored_exceptions=())
+        identifier = _LazyIdentifier(elog)
+        snapshot = self._makeOne().snapshot_environ(
+            {'repoze.errorlog.entryid': identifier})
+        self.assertEqual(snapshot, {'repoze.errorlog.entryid': '0'})
+        self.assertEqual(type(snapshot['repoze.errorlog.entryid']), str)
+
+    def test_shrink_drops_largest_environ_values(self):
+        limits = self._makeOne(max_size=3000, max_value_length=None)
+        environ = {'HTTP_COOKIE': 'x' * 5000, 'HTTP_X': 'y' * 1000,
+                   'PATH_INFO': '/'}
+        error = self._makeError('rendering', environ, limits)
+        self.assertEqual(error.environ['HTTP_COOKIE'][:1], '<')
+        self.assertEqual(error.environ['HTTP_X'], 'y' * 1000)
+        self.assertEqual(error.environ['PATH_INFO'], '/')
+        self.assertTrue(error.size <= 3000)
+
+    def test_shrink_truncates_rendered_traceback(self):
+        limits = self._makeOne(max_size=2000)
+        error = self._makeError('frame\n' * 1000 + 'KeyError', {}, limits)
+        self.assertTrue(error.traceback.startswith('(truncated)\n'))
+        self.assertTrue(error.traceback.endswith('frame\nKeyError'))
+        self.assertTrue(error.size <= 2100)
+
+    def test_shrink_drops_outer_frames(self):
+        from repoze.errorlog import TracebackSnapshot
+        try:
+            _raise_nested(50)
+        except KeyError:
+            snapshot = TracebackSnapshot(sys.exc_info())
+        limits = self._makeOne(max_size=3000)
+        error = self._makeError(snapshot, {}, limits)
+        self.assertTrue(snapshot.omitted > 0)
+        self.assertEqual(len(snapshot.frames) + snapshot.omitted, 52)
+        self.assertEqual(snapshot.frames[-1][2], '_raise_nested')
+        self.assertTrue(error.size <= 3000)
+        text = str(snapshot)
+        self.assertTrue('[%d frames omitted]' % snapshot.omitted in text)
+        self.assertTrue(text.endswith("KeyError: 'nested'\n"))
+
+    def _makeGroupSnapshot(self, members, depth=20):
+        from repoze.errorlog import TracebackSnapshot
+        def snapshot():
+            try:
+                _raise_nested(depth)
+            except KeyError:
+                return TracebackSnapshot(sys.exc_info())
+        group = snapshot()
+        group.exceptions = [snapshot() for i in range(members)]
+        return group
+
+    def test_record_size_counts_group_members(self):
+        from repoze.errorlog.limits import record_size
+        limits = self._makeOne(max_size=None)
+        alone = self._makeError(self._makeGroupSnapshot(0), {}, limits)
+        group = self._makeError(self._makeGroupSnapshot(3), {}, limits)
+        self.assertTrue(record_size(group) > 3 * record_size(alone))
+        self.assertEqual(group.size, record_size(group))
+
+    def test_shrink_drops_group_members(self):
+        snapshot = self._makeGroupSnapshot(10)
+        limits = self._makeOne(max_size=20000)
+        error = self._makeError(snapshot, {}, limits)
+        self.assertTrue(0 < len(snapshot.exceptions) < 10)
+        self.assertEqual(len(snapshot.exceptions) + snapshot.more_exceptions,
+                         10)
+        self.assertEqual(snapshot.omitted, 0)
+        self.assertTrue(error.size <= 20000)
+        self.assertTrue('and %d more exception' % snapshot.more_exceptions
+                        in str(snapshot))
+
+    def test_shrink_drops_locals_of_group_members(self):
+        snapshot = self._makeGroupSnapshot(2)
+        for member in snapshot.exceptions:
+            member.locals = [[('x', 'y' * 5000)]] + [None] * 21
+        limits = self._makeOne(max_size=20000)
+        error = self._makeError(snapshot, {}, limits)
+        self.assertEqual([m.locals for m in snapshot.exceptions],
+                         [None, None])
+        self.assertEqual(len(snapshot.exceptions), 2)
+        self.assertTrue(error.size <= 20000)
+
+    def test_history_memory_ceiling(self):
+        try:
+            import tracemalloc
+        except ImportError: #pragma NO COVER Python 2
+            return
+        from repoze.errorlog import ErrorLog
+        from repoze.errorlog.store import RingBuffer
+        budget = 200000
+        elog = ErrorLog(None, None, 1000, '/__error_log__', (),
+                        samples=sys.maxsize,
+                        store=RingBuffer(1000, budget),
+                        record_limits=self._makeOne(max_size=20000))
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(500):
+            # fresh values for every request, as a server would pass
+            environ = _makeEnviron({'HTTP_COOKIE': 'c%d' % i * 20000,
+                                    'HTTP_X_BIG': 'h%d' % i * 10000})
+            try:
+                _raise_nested(i % 20)
+            except KeyError:
+                elog.insert_error(elog.new_identifier(), sys.exc_info(),
+                                  environ)
+            del environ
+        used = tracemalloc.get_traced_memory()[0] - before
+        self.assertTrue(elog.history.bytes <= budget)
+        self.assertTrue(len(elog.history) < 500)
+        # the estimate leaves out some interpreter overhead
+        self.assertTrue(used < 2 * budget, used)
+
+
+class TestCapturePolicy(unittest.TestCase):
+    def _makeOne(self, rate=1.0, burst=2, sample_rate=0.0, randoms=()):
+        from repoze.errorlog.policy import CapturePolicy
+        self.now = 1000.0
+        randoms = list(randoms)
+        return CapturePolicy(rate, burst, sample_rate,
+                             clock=lambda: self.now,
+                             random=lambda: randoms.pop(0))
+
+    def test_bucket(self):
+        policy = self._makeOne()
+        self.assertEqual(policy.allow('KeyError', False), True)
+        self.assertEqual(policy.allow('KeyError', False), True)
+        self.assertEqual(policy.allow('KeyError', False), False)
+        # buckets are per type
+        self.assertEqual(policy.allow('ValueError', False), True)
+        self.now += 1.5
+        self.assertEqual(policy.allow('KeyError', False), True)
+        self.assertEqual(policy.allow('KeyError', False), False)
+        self.assertEqual(policy.captured, 4)
+        self.assertEqual(policy.suppressed, 2)
+
+    def test_refill_capped_at_burst(self):
+        policy = self._makeOne()
+        policy.allow('KeyError', False)
+        self.now += 100
+        for i in range(2):
+            self.assertEqual(policy.allow('KeyError', False), True)
+        self.assertEqual(policy.allow('KeyError', False), False)
+
+    def test_new_always_captured(self):
+        policy = self._makeOne(burst=0)
+        self.assertEqual(policy.allow('KeyError', True), True)
+        self.assertEqual(policy.allow('KeyError', False), False)
+
+    def test_sampling_over_limit(self):
+        policy = self._makeOne(burst=0, sample_rate=0.5,
+                               randoms=[0.1, 0.9])
+        self.assertEqual(policy.allow('KeyError', False), True)
+        self.assertEqual(policy.allow('KeyError', False), False)
+
+    def test_default_burst(self):
+        from repoze.errorlog.policy import CapturePolicy
+        self.assertEqual(CapturePolicy(10).burst, 10)
+        self.assertEqual(CapturePolicy(0.1).burst, 1)
+
+    def test_buckets_bounded(self):
+        policy = self._makeOne()
+        policy.max_buckets = 2
+        for name in 'abc':
+            policy.allow(name, False)
+        self.assertEqual(len(policy._buckets), 1)
+
+
+class TestSearchIndex(unittest.TestCase):
+    def _makeOne(self):
+        from repoze.errorlog.search import SearchIndex
+        return SearchIndex()
+
+    def _makeError(self, identifier, description, fingerprint='fp'):
+        from repoze.errorlog import Error
+        return Error(identifier, description, 'rendering', 'time', {}, 'url',
+                     fingerprint)
+
+    def test_add_search_remove(self):
+        index = self._makeOne()
+        index.add(self._makeError('1', 'Cart is empty', 'fp1'))
+        index.add(self._makeError('2', 'cart-item missing', 'fp2'))
+        self.assertEqual(index.search('CART'), set(['1', '2']))
+        self.assertEqual(index.search('cart empty'), set(['1']))
+        self.assertEqual(index.fingerprints('cart'), set(['fp1', 'fp2']))
+        index.remove('1')
+        index.remove('unknown')
+        self.assertEqual(index.search('cart'), set(['2']))
+        self.assertEqual(index.search('empty'), set())
+        self.assertFalse('empty' in index._postings)
+        self.assertEqual(len(index), 1)
+        index.clear()
+        self.assertEqual(index.search('cart'), set())
+
+    def test_similar_errors_share_a_class(self):
+        index = self._makeOne()
+        index.add(self._makeError('1', 'Cart is empty'))
+        index.add(self._makeError('2', 'Cart is empty'))
+        index.add(self._makeError('3', 'Cart is empty', 'fp2'))
+        self.assertEqual(len(index._classes), 2)
+        self.assertTrue(index._documents['1'] is index._documents['2'])
+        self.assertEqual(index.search('cart'), set(['1', '2', '3']))
+        self.assertEqual(index.fingerprints('cart'), set(['fp', 'fp2']))
+        index.remove('1')
+        self.assertEqual(index.search('cart'), set(['2', '3']))
+        index.remove('2')
+        self.assertEqual(len(index._classes), 1)
+        self.assertEqual(index.fingerprints('empty'), set(['fp2']))
+
+    def test_readd_replaces(self):
+        index = self._makeOne()
+        index.add(self._makeError('1', 'old words'))
+        index.add(self._makeError('1', 'new words'))
+        self.assertEqual(index.search('old'), set())
+        self.assertEqual(index.search('new words'), set(['1']))
+
+    def test_tokenize(self):
+        from repoze.errorlog.search import tokenize
+        self.assertEqual(tokenize('KeyError in views/cart.py'),
+                         set(['keyerror', 'in', 'views', 'cart', 'py']))
+        self.assertEqual(tokenize('_lookup_cart'),
+                         set(['_lookup_cart', 'lookup', 'cart']))
+
+
+class Test_resolve(unittest.TestCase):
+    def _callFUT(self, name):
+        from repoze.errorlog.ignore import resolve
+        return resolve(name)
+
+    def test_builtin(self):
+        self.assertTrue(self._callFUT('KeyError') is KeyError)
+
+    def test_module_attribute(self):
+        self.assertTrue(self._callFUT('%s:DummyException' % __name__)
+                        is DummyException)
+        self.assertEqual(self._callFUT('os.path:join.__name__'), 'join')
+
+    def test_dotted(self):
+        from repoze.errorlog.store import ErrorStore
+        self.assertTrue(self._callFUT('repoze.errorlog.store.ErrorStore')
+                        is ErrorStore)
+        self.assertTrue(self._callFUT('repoze.errorlog.store')
+                        is sys.modules['repoze.errorlog.store'])
+
+    def test_missing(self):
+        self.assertRaises(ImportError, self._callFUT, 'NoSuchError')
+        self.assertRaises(ImportError, self._callFUT, 'nosuch.module.Error')
+        self.assertRaises(ImportError, self._callFUT,
+                          'repoze.errorlog.store.NoSuchError')
+        self.assertRaises(ImportError, self._callFUT,
+                          'repoze.errorlog.store:NoSuchError')
+
+
+class TestIgnoreRules(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.ignore import IgnoreRules
+        return IgnoreRules(*arg, **kw)
+
+    def test_empty(self):
+        rules = self._makeOne()
+        self.assertFalse(rules)
+        self.assertFalse(rules.matches(KeyError()))
+
+    def test_classes(self):
+        rules = self._makeOne(classes=[LookupError])
+        self.assertTrue(rules)
+        self.assertTrue(rules.matches(KeyError()))
+        self.assertFalse(rules.matches(ValueError()))
+
+    def test_modules(self):
+        rules = self._makeOne(modules=['repoze.errorlog'])
+        self.assertTrue(rules.matches(DummyException()))
+        self.assertTrue(rules.matches(DummyHTTPException(404)))
+        self.assertFalse(rules.matches(KeyError()))
+        rules = self._makeOne(modules=['repoze.error'])
+        self.assertFalse(rules.matches(DummyException()))
+
+    def test_messages(self):
+        rules = self._makeOne(messages=['^client', 'gone$'])
+        self.assertTrue(rules.matches(IOError('client disconnected')))
+        self.assertTrue(rules.matches(IOError('it is gone')))
+        self.assertFalse(rules.matches(IOError('disk full')))
+
+    def test_statuses(self):
+        rules = self._makeOne(statuses=[404])
+        self.assertTrue(rules.matches(DummyHTTPException(404)))
+        self.assertFalse(rules.matches(DummyHTTPException(500)))
+        exc = KeyError()
+        exc.status = '404 Not Found'
+        self.assertTrue(rules.matches(exc))
+        exc.status = True
+        self.assertFalse(rules.matches(exc))
+
+    def test_decision_cached_per_class(self):
+        rules = self._makeOne(classes=[KeyError], statuses=[404])
+        decide = rules._decide
+        calls = []
+        def counting(cls):
+            calls.append(cls)
+            return decide(cls)
+        rules._decide = counting
+        for i in range(3):
+            self.assertTrue(rules.matches(KeyError()))
+            self.assertFalse(rules.matches(DummyHTTPException(500)))
+        self.assertTrue(rules.matches(DummyHTTPException(404)))
+        self.assertEqual(calls, [KeyError, DummyHTTPException])
+
+    def test_cache_bounded(self):
+        rules = self._makeOne(classes=[KeyError])
+        rules.max_classes = 1
+        self.assertTrue(rules.matches(KeyError()))
+        self.assertFalse(rules.matches(ValueError()))
+        self.assertEqual(list(rules._cache), [ValueError])
+
+    def test_parse_statuses(self):
+        from repoze.errorlog.ignore import parse_statuses
+        self.assertEqual(parse_statuses(''), set())
+        self.assertEqual(parse_statuses(' 404\n301-303 '),
+                         set([301, 302, 303, 404]))
+
+
+class TestMetrics(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.metrics import Metrics
+        return Metrics(*arg, **kw)
+
+    def test_counters(self):
+        metrics = self._makeOne()
+        metrics.max_types = 2
+        for exc_type in ('KeyError', 'KeyError', 'a"b', 'ValueError'):
+            metrics.error(exc_type)
+        metrics.ignore('HTTPFound')
+        metrics.evict(3)
+        self.assertEqual(metrics.errors,
+                         {'KeyError': 2, 'a"b': 1, 'other': 1})
+        lines = metrics.render().splitlines()
+        self.assertTrue('# TYPE repoze_errorlog_errors_total counter'
+                        in lines)
+        self.assertTrue('repoze_errorlog_errors_total{type="a\\"b"} 1'
+                        in lines)
+        self.assertTrue('repoze_errorlog_ignored_total{type="HTTPFound"} 1'
+                        in lines)
+        self.assertTrue('repoze_errorlog_evictions_total 3' in lines)
+
+    def test_histogram(self):
+        metrics = self._makeOne(buckets=(0.1, 0.01))
+        for value in (0.001, 0.01, 0.05, 2):
+            metrics.capture.observe(value)
+        lines = metrics.render([('groups', 'Groups.', 4)]).splitlines()
+        start = lines.index(
+            '# TYPE repoze_errorlog_capture_seconds histogram')
+        self.assertEqual(lines[start + 1:start + 6], [
+            'repoze_errorlog_capture_seconds_bucket{le="0.01"} 2',
+            'repoze_errorlog_capture_seconds_bucket{le="0.1"} 3',
+            'repoze_errorlog_capture_seconds_bucket{le="+Inf"} 4',
+            'repoze_errorlog_capture_seconds_sum 2.061',
+            'repoze_errorlog_capture_seconds_count 4'])
+        self.assertEqual(lines[-3:], [
+            '# HELP repoze_errorlog_groups Groups.',
+            '# TYPE repoze_errorlog_groups gauge',
+            'repoze_errorlog_groups 4.0'])
+
+    def test_threads(self):
+        import threading
+        metrics = self._makeOne()
+        old = _setswitchinterval(1e-6)
+        try:
+            def bump():
+                for i in range(1000):
+                    metrics.error('KeyError')
+                    metrics.capture.observe(0.001)
+            threads = [threading.Thread(target=bump) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            _setswitchinterval(old)
+        self.assertEqual(metrics.errors, {'KeyError': 4000})
+        self.assertEqual(sum(metrics.capture.counts), 4000)
+
+
+class TestBroadcaster(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.stream import Broadcaster
+        return Broadcaster(*arg, **kw)
+
+    def test_fan_out(self):
+        broadcaster = self._makeOne()
+        first = broadcaster.subscribe()
+        second = broadcaster.subscribe()
+        broadcaster.publish('a')
+        self.assertEqual(first.pop(), 'a')
+        self.assertEqual(first.pop(), None)
+        second.close()
+        broadcaster.publish('b')
+        self.assertEqual(first.get(0), 'b')
+        self.assertEqual(second.pop(), 'a')
+        self.assertEqual(second.pop(), None)
+
+    def test_bounded(self):
+        broadcaster = self._makeOne(maxsize=2)
+        subscription = broadcaster.subscribe()
+        for event in 'abcd':
+            broadcaster.publish(event)
+        self.assertEqual(subscription.dropped, 2)
+        self.assertEqual(subscription.pop(), 'c')
+        self.assertEqual(subscription.pop(), 'd')
+
+    def test_max_subscribers(self):
+        broadcaster = self._makeOne(max_subscribers=1)
+        subscription = broadcaster.subscribe()
+        self.assertEqual(broadcaster.subscribe(), None)
+        subscription.close()
+        self.assertNotEqual(broadcaster.subscribe(), None)
+
+    def test_notify(self):
+        calls = []
+        broadcaster = self._makeOne()
+        broadcaster.subscribe(lambda: calls.append(True))
+        broadcaster.publish('a')
+        self.assertEqual(calls, [True])
+
+    def test_get_waits(self):
+        import threading
+        broadcaster = self._makeOne()
+        subscription = broadcaster.subscribe()
+        self.assertEqual(subscription.get(0.01), None)
+        timer = threading.Timer(0.01, broadcaster.publish, ('a',))
+        timer.start()
+        self.assertEqual(subscription.get(5), 'a')
+        timer.join()
+
+
+class TestGroupIndex(unittest.TestCase):
+    def _makeOne(self, size=3, samples=2):
+        from repoze.errorlog.store import GroupIndex
+        return GroupIndex(size, samples)
+
+    def test_samples(self):
+        groups = self._makeOne()
+        self.assertEqual(groups.add('fp', 'desc', '0', 1.0), True)
+        self.assertEqual(groups.add('fp', 'desc', '1', 2.0), True)
+        self.assertEqual(groups.add('fp', 'desc', '2', 3.0), False)
+        group = groups.get('fp')
+        self.assertEqual(group.count, 3)
+        self.assertEqual(group.samples, ['0', '1'])
+        self.assertEqual(group.first_seen, 1.0)
+        self.assertEqual(group.last_seen, 3.0)
+        self.assertEqual(group.description, 'desc')
+
+    def test_ordered_by_last_seen(self):
+        groups = self._makeOne()
+        groups.add('a', 'desc', '0', 1.0)
+        groups.add('b', 'desc', '1', 2.0)
+        groups.add('a', 'desc', '2', 3.0)
+        self.assertEqual([g.fingerprint for g in groups], ['a', 'b'])
+
+    def test_evicts_least_recently_seen(self):
+        groups = self._makeOne()
+        for fp in 'abca':
+            groups.add(fp, 'desc', fp, 1.0)
+        groups.add('d', 'desc', 'd', 1.0)
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(groups.get('b'), None)
+        self.assertEqual([g.fingerprint for g in groups], ['d', 'a', 'c'])
+
+    def test_replace_expired(self):
+        groups = self._makeOne()
+        groups.add('fp', 'desc', '0', 1.0)
+        groups.add('fp', 'desc', '1', 2.0)
+        self.assertEqual(groups.add('fp', 'desc', '2', 3.0), False)
+        held = set(['0', '1'])
+        self.assertEqual(groups.replace_expired('fp', '2', held.__contains__),
+                         False)
+        held.discard('0')
+        self.assertEqual(groups.replace_expired('fp', '2', held.__contains__),
+                         True)
+        self.assertEqual(groups.get('fp').samples, ['1', '2'])
+        self.assertEqual(groups.replace_expired('other', '3',
+                                                held.__contains__), False)
+
+    def test_discard(self):
+        groups = self._makeOne()
+        groups.add('fp', 'desc', '0', 1.0)
+        groups.add('fp', 'desc', '1', 2.0)
+        groups.discard('fp', '0')
+        groups.discard('fp', '2')
+        groups.discard('other', '0')
+        self.assertEqual(groups.get('fp').samples, ['1'])
+        self.assertEqual(groups.add('fp', 'desc', '2', 3.0), True)
+        self.assertEqual(groups.get('fp').samples, ['1', '2'])
+
+    def test_no_samples(self):
+        self.assertRaises(ValueError, self._makeOne, samples=0)
+
+    def test_clear(self):
+        groups = self._makeOne()
+        groups.add('a', 'desc', '0', 1.0)
+        groups.clear()
+        self.assertEqual(len(groups), 0)
+        self.assertEqual(list(groups), [])
+
+
+class TestError(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog import Error
+        return Error(*arg, **kw)
+
+    def test_text_from_string(self):
+        error = self._makeOne('1', 'desc', 'rendering', 'time', {'a': 'b'},
+                              'url')
+        self.assertEqual(error.text, "rendering\n\n{'a': 'b'}")
+
+    def test_text_rendered_when_asked_for(self):
+        rendering = DummyRendering()
+        error = self._makeOne('1', 'desc', rendering, 'time', {}, 'url')
+        self.assertEqual(rendering.calls, 0)
+        self.assertEqual(error.text, 'rendered\n\n{}')
+        self.assertEqual(error.text, 'rendered\n\n{}')
+        # not kept, where it would take memory ``size`` doesn't count
+        self.assertEqual(rendering.calls, 2)
+
+    def test_environ_is_filtered_copy(self):
+        environ = _makeEnviron({'repoze.other': object()})
+        error = self._makeOne('1', 'desc', 'rendering', 'time', environ,
+                              'url')
+        self.assertFalse(error.environ is environ)
+        self.assertEqual(error.environ['SERVER_NAME'], 'localhost')
+        self.assertEqual(error.environ['wsgi.version'], (1, 0))
+        self.assertEqual(error.environ['wsgi.multithread'], True)
+        self.assertTrue(error.environ['wsgi.input'].startswith('<'))
+        self.assertEqual(error.environ['repoze.other'], '<object object>')
+
+    def test_slots(self):
+        error = self._makeOne('1', 'desc', 'rendering', 'time', {}, 'url')
+        self.assertFalse(hasattr(error, '__dict__'))
+        self.assertTrue(error.size > 0)
+
+    def test_limits(self):
+        from repoze.errorlog.limits import RecordLimits
+        limits = RecordLimits(max_size=None, max_value_length=5,
+                              exclude=['HTTP_COOKIE'])
+        environ = {'HTTP_COOKIE': 'secret', 'PATH_INFO': '/abcdefgh'}
+        error = self._makeOne('1', 'desc', 'rendering', 'time', environ,
+                              'url', limits=limits)
+        self.assertEqual(error.environ, {'PATH_INFO': '/abcd... (4 more)'})
+
+    def test_pickle(self):
+        import pickle
+        from repoze.errorlog import TracebackSnapshot
+        try:
+            raise KeyError('abc')
+        except KeyError:
+            snapshot = TracebackSnapshot(sys.exc_info())
+        error = self._makeOne('1', 'desc', snapshot, 'time', _makeEnviron(),
+                              'url')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(error, protocol))
+            self.assertEqual(copy.identifier, '1')
+            self.assertEqual(copy.text, error.text)
+
+
+class TestLocalsCapture(unittest.TestCase):
+    def _makeOne(self, *arg, **kw):
+        from repoze.errorlog.variables import LocalsCapture
+        return LocalsCapture(*arg, **kw)
+
+    def test_repr_bounded(self):
+        capture = self._makeOne(max_length=30, max_depth=1)
+        self.assertEqual(capture.repr(1), '1')
+        self.assertEqual(capture.repr(list(range(100000))),
+                         '[0, 1, 2, 3, 4, 5, ...]')
+        self.assertEqual(capture.repr([[1, [2]]]), '[[...]]')
+        summary = capture.repr('x' * 1000)
+        self.assertTrue(len(summary) <= 30)
+
+    def test_repr_bytes_bounded(self):
+        from repoze.errorlog import variables
+        capture = self._makeOne(max_length=30)
+        value = b'\x00' * 1000
+        summary = capture.repr(value)
+        self.assertTrue(len(summary) <= 30)
+        self.assertTrue(summary.startswith(repr(b'\x00' * 2)[:-1]))
+        self.assertTrue('...' in summary)
+        # only the ends of the value are repr()ed
+        seen = []
+        class Recording(variables._BoundedRepr):
+            def repr_str(self, x, level):
+                seen.append(len(x))
+                return variables._BoundedRepr.repr_str(self, x, level)
+        capture._repr = Recording()
+        capture._repr.maxstring = 30
+        capture.repr(value)
+        self.assertEqual(seen, [1000])
+
+    def test_repr_failure(self):
+        class Broken(object):
+            def __repr__(self):
+                raise ValueError
+        capture = self._makeOne()
+        self.assertTrue(capture.repr(Broken()).startswith('<Broken'))
+        capture._repr = None
+        self.assertEqual(capture.repr(1), '<repr failed: AttributeError>')
+
+    def test_summarize(self):
+        capture = self._makeOne(max_vars=2)
+        self.assertEqual(capture.summarize({'c': 3, 'a': 'x', 'b': None}),
+                         [('a', "'x'"), ('b', 'None')])
+
+    def test_capture_innermost_frames(self):
+        import gc
+        import weakref
+        class Payload(object):
+            pass
+        payload = Payload()
+        ref = weakref.ref(payload)
+        def fail(payload, depth):
+            if depth:
+                fail(payload, depth - 1)
+            raise KeyError('x')
+        try:
+            fail(payload, 5)
+        except KeyError:
+            captured = self._makeOne(max_frames=2).capture(sys.exc_info()[2])
+        self.assertEqual(len(captured), 7)
+        self.assertEqual(captured[:5], [None] * 5)
+        self.assertEqual([name for name, summary in captured[-1]],
+                         ['depth', 'fail', 'payload'])
+        self.assertEqual(captured[-1][0], ('depth', '0'))
+        # nothing refers to the frames or their locals any more
+        del payload
+        if hasattr(sys, 'exc_clear'): #pragma NO COVER Python 2
+            sys.exc_clear()
+        gc.collect()
+        self.assertEqual(ref(), None)
+
+    def test_errorlog_captures_locals(self):
+        from repoze.errorlog import ErrorLog
+        elog = ErrorLog(None, None, 10, '/__error_log__', (),
+                        capture_locals=self._makeOne())
+        def fail():
+            secret = 'the value'
+            raise KeyError('x')
+        try:
+            fail()
+        except KeyError:
+            elog.insert_error('0', sys.exc_info(), {})
+        error = elog.get_error('0')
+        self.assertTrue("      secret = 'the value'\n" in error.text)
+        # logs get the plain traceback
+        self.assertFalse('secret' in str(error.traceback))
+
+    def test_dropped_first_when_too_big(self):
+        from repoze.errorlog import Error
+        from repoze.errorlog import TracebackSnapshot
+        from repoze.errorlog.limits import RecordLimits
+        def fail():
+            big = ['x' * 100] * 10
+            raise KeyError('x')
+        try:
+            fail()
+        except KeyError:
+            exc_info = sys.exc_info()
+            snapshot = TracebackSnapshot(exc_info)
+            snapshot.locals = self._makeOne().capture(exc_info[2])
+            del exc_info
+        limits = RecordLimits(max_size=sys.getsizeof('') * 50)
+        error = Error('0', 'desc', snapshot, 'time', {}, 'url', limits=limits)
+        self.assertEqual(snapshot.locals, None)
+        self.assertTrue('fail' in error.text)
+
+
+class TestTracebackSnapshot(unittest.TestCase):
+    def _makeOne(self, exc_info):
+        from repoze.errorlog import TracebackSnapshot
+        return TracebackSnapshot(exc_info)
+
+    def test_render_matches_traceback_module(self):
+        import traceback
+        try:
+            _raise_nested(3)
+        except KeyError:
+            exc_info = sys.exc_info()
+        snapshot = self._makeOne(exc_info)
+        expected = traceback.format_exception(*exc_info)
+        del exc_info
+        self.assertEqual(len(snapshot.frames), 5)
+        self.assertEqual(snapshot.frames[-1][2], '_raise_nested')
+        rendered = snapshot.render()
+        self.assertEqual(str(snapshot), rendered)
+        for line in ''.join(expected).splitlines():
+            # newer Pythons underline the failing expression
+            if line.strip().strip('^~'):
+                self.assertTrue(line in rendered, line)
+        self.assertTrue("raise KeyError('nested')" in rendered)
+
+    def test_render_context_lines(self):
+        from repoze.errorlog.source import SourceCache
+        try:
+            _raise_nested(0)
+        except KeyError:
+            snapshot = self._makeOne(sys.exc_info())
+        lineno = snapshot.frames[-1][1]
+        rendered = snapshot.render(context_lines=1, source=SourceCache())
+        lines = rendered.splitlines()
+        index = lines.index("  -> %d  raise KeyError('nested')" % lineno)
+        # dedented with the lines around it
+        self.assertEqual(lines[index - 1].split(), [str(lineno - 1),
+                                                   '_raise_nested(depth', '-',
+                                                   '1)'])
+        self.assertEqual(lines[index + 1].split(), [str(lineno + 1)])
+        self.assertEqual(snapshot.render(), str(snapshot))
+        self.assertFalse('->' in str(snapshot))
+
+    def test_render_context_lines_missing_source(self):
+        from repoze.errorlog.source import SourceCache
+        snapshot = self._makeOne((KeyError, KeyError('a'), None))
+        snapshot.frames = [('<missing>', 3, 'f'), (__file__, 10 ** 6, 'g')]
+        rendered = snapshot.render(context_lines=2, source=SourceCache())
+        self.assertEqual(rendered.splitlines()[1:],
+                         ['  File "<missing>", line 3, in f',
+                          '  File "%s", line 1000000, in g' % __file__,
+                          "KeyError: 'a'"])
+
+    def test_render_chained(self):
+        if not hasattr(KeyError(), '__cause__'): #pragma NO COVER Python 2
+            return
+        try:
+            try:
+                raise KeyError('inner')
+            except KeyError:
+                raise ValueError('outer')
+        except ValueError:
+            snapshot = self._makeOne(sys.exc_info())
+        self.assertEqual(snapshot.cause.exception, ["KeyError: 'inner'\n"])
+        self.assertFalse(snapshot.explicit_cause)
+        rendered = snapshot.render()
+        self.assertTrue(rendered.index('inner') < rendered.index('outer'))
+        self.assertTrue('During handling' in rendered)
+
+    def test_render_explicit_cause(self):
+        if not hasattr(KeyError(), '__cause__'): #pragma NO COVER Python 2
+            return
+        inner = KeyError('inner')
+        outer = ValueError('outer')
+        outer.__cause__ = inner
+        snapshot = self._makeOne((ValueError, outer, None))
+        self.assertTrue(snapshot.explicit_cause)
+        self.assertTrue('direct cause' in snapshot.render())
+        self.assertEqual(snapshot.frames, [])
+
+    def test_root_cause_and_summary(self):
+        if not hasattr(KeyError(), '__cause__'): #pragma NO COVER Python 2
+            return
+        try:
+            try:
+                raise KeyError('inner')
+            except KeyError:
+                raise ValueError('outer\nmore')
+        except ValueError:
+            snapshot = self._makeOne(sys.exc_info())
+        self.assertEqual(snapshot.summary, 'ValueError: outer')
+        self.assertTrue(snapshot.root_cause is snapshot.cause)
+        self.assertEqual(snapshot.root_cause.summary, "KeyError: 'inner'")
+        self.assertEqual([s.exc_type for s in snapshot.walk()],
+                         ['ValueError', 'KeyError'])
+
+    def test_summary_of_syntax_error(self):
+        try:
+            compile('1 +', 'broken.py', 'exec')
+        except SyntaxError:
+            snapshot = self._makeOne(sys.exc_info())
+        self.assertTrue(snapshot.summary.startswith('SyntaxError: '))
+
+    def _raise_group(self, count):
+        members = []
+        for i in range(count):
+            try:
+                if i % 2:
+                    raise KeyError(i)
+                raise ValueError(i)
+            except Exception as e:
+                members.append(e)
+        members[:2] = [ExceptionGroup('nested', members[:2])]
+        try:
+            try:
+                raise TypeError('first')
+            except TypeError:
+                # on one line: Python 3.13 quotes each line of a statement
+                raise ExceptionGroup('many', members)
+        except ExceptionGroup:
+            return sys.exc_info()
+
+    def test_exception_group(self):
+        import traceback
+        try:
+            ExceptionGroup
+        except NameError: #pragma NO COVER Python < 3.11
+            return
+        exc_info = self._raise_group(4)
+        snapshot = self._makeOne(exc_info)
+        expected = ''.join(traceback.format_exception(*exc_info))
+        del exc_info
+        self.assertEqual(len(snapshot.exceptions), 3)
+        self.assertEqual(len(snapshot.exceptions[0].exceptions), 2)
+        self.assertEqual([s.exc_type for s in snapshot.walk()],
+                         ['ExceptionGroup', 'TypeError', 'ExceptionGroup',
+                          'ValueError', 'KeyError', 'ValueError', 'KeyError'])
+        self.assertEqual(snapshot.root_cause.summary, 'TypeError: first')
+        self.assertTrue(snapshot.summary.startswith('ExceptionGroup: many'))
+        # the same layout as the traceback module, less the carets
+        expected = [line for line in expected.splitlines()
+                    if not _is_caret_line(line)]
+        self.assertEqual(snapshot.render().splitlines(), expected)
+
+    def test_exception_group_width_limited(self):
+        import traceback
+        try:
+            ExceptionGroup
+        except NameError: #pragma NO COVER Python < 3.11
+            return
+        exc_info = self._raise_group(20)
+        snapshot = self._makeOne(exc_info)
+        expected = ''.join(traceback.format_exception(*exc_info))
+        del exc_info
+        self.assertEqual(len(snapshot.exceptions), 15)
+        self.assertEqual(snapshot.more_exceptions, 4)
+        rendered = snapshot.render()
+        self.assertTrue('and 4 more exceptions' in rendered)
+        expected = [line for line in expected.splitlines()
+                    if not _is_caret_line(line)]
+        self.assertEqual(rendered.splitlines(), expected)
+
+    def test_context_cycle(self):
+        if not hasattr(KeyError(), '__cause__'): #pragma NO COVER Python 2
+            return
+        first = KeyError('first')
+        second = ValueError('second')
+        second.__context__ = first
+        first.__context__ = second
+        snapshot = self._makeOne((ValueError, second, None))
+        self.assertEqual(snapshot.cause.cause, None)
+
+
+class TestErrorStore(unittest.TestCase):
+    def _makeOne(self):
+        from repoze.errorlog.store import ErrorStore
+        return ErrorStore()
+
+    def test_interface(self):
+        store = self._makeOne()
+        self.assertRaises(NotImplementedError, store.append, None)
+        self.assertRaises(NotImplementedError, store.get, '1')
+        self.assertRaises(NotImplementedError, store.clear)
+        self.assertRaises(NotImplementedError, len, store)
+        self.assertRaises(NotImplementedError, iter, store)
+        self.assertRaises(NotImplementedError, store.version)
+        store.close()
+
+
+class TestRingBuffer(unittest.TestCase):
+    def _makeOne(self, size):
+        from repoze.errorlog.store import RingBuffer
+        return RingBuffer(size)
+
+    def test_empty(self):
+        buf = self._makeOne(3)
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(list(buf), [])
+        self.assertEqual(buf.get('a'), None)
+
+    def test_append_and_evict(self):
+        buf = self._makeOne(3)
+        for name in 'abcd':
+            evicted = buf.append(DummyError(name))
+        self.assertEqual([e.identifier for e in evicted], ['a'])
+        self.assertEqual(len(buf), 3)
+        self.assertEqual([e.identifier for e in buf], ['d', 'c', 'b'])
+        self.assertEqual(buf.get('a'), None)
+        self.assertEqual(buf.get('d').identifier, 'd')
+
+    def test_version(self):
+        buf = self._makeOne(1)
+        self.assertEqual(buf.version(), 0)
+        buf.append(DummyError('a'))
+        buf.append(DummyError('b'))
+        self.assertEqual(buf.version(), 2)
+
+    def test_evict_by_bytes(self):
+        from repoze.errorlog.store import RingBuffer
+        buf = RingBuffer(10, max_bytes=250)
+        evicted = []
+        for name in 'abcd':
+            error = DummyError(name)
+            error.size = 100
+            evicted.extend(buf.append(error))
+        self.assertEqual([e.identifier for e in evicted], ['a', 'b'])
+        self.assertEqual([e.identifier for e in buf], ['d', 'c'])
+        self.assertEqual(buf.bytes, 200)
+        self.assertEqual(buf.get('a'), None)
+        huge = DummyError('e')
+        huge.size = 1000
+        buf.append(huge)
+        # the newest error is kept, whatever its size
+        self.assertEqual([e.identifier for e in buf], ['e'])
+        buf.clear()
+        self.assertEqual(buf.bytes, 0)
+        self.assertEqual(len(buf), 0)
+
+    def test_append_duplicate_identifier(self):
+        buf = self._makeOne(2)
+        buf.append(DummyError('a'))
+        newest = DummyError('a')
+        buf.append(newest)
+        buf.append(DummyError('b'))
+        self.assertTrue(buf.get('a') is newest)
+
+    def test_zero_size(self):
+        buf = self._makeOne(0)
+        error = DummyError('a')
+        self.assertEqual(buf.append(error), [error])
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(list(buf), [])
+        self.assertEqual(buf.get('a'), None)
+
+    def test_clear(self):
+        buf = self._makeOne(2)
+        buf.append(DummyError('a'))
+        buf.clear()
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.get('a'), None)
+
+    def test_concurrent_append_wraps(self):
+        import threading
+        buf = self._makeOne(50)
+        threads, per_thread = 8, 500
+        def worker(n):
+            for i in range(per_thread):
+                buf.append(DummyError('%s-%s' % (n, i)))
+        interval = _setswitchinterval(1e-6)
+        try:
+            workers = [threading.Thread(target=worker, args=(n,))
+                       for n in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+        finally:
+            _setswitchinterval(interval)
+        identifiers = [e.identifier for e in buf]
+        self.assertEqual(len(identifiers), 50)
+        self.assertEqual(len(set(identifiers)), 50)
+        for identifier in identifiers:
+            self.assertEqual(buf.get(identifier).identifier, identifier)
+        self.assertEqual(len(buf._index), 50)
+
+    def test_interned(self):
+        buf = self._makeOne(2)
+        first = _makeInternedError('a')
+        second = _makeInternedError('b')
+        buf.append(first)
+        buf.append(second)
+        self.assertTrue(first.traceback.frames is second.traceback.frames)
+        self.assertTrue(first.environ['PATH_INFO'] is
+                        second.environ['PATH_INFO'])
+        size = len(buf.table)
+        buf.append(_makeInternedError('c'))
+        self.assertEqual(len(buf.table), size)
+        buf.clear()
+        self.assertEqual(len(buf.table), 0)
+
+    def test_not_interned(self):
+        from repoze.errorlog.store import RingBuffer
+        buf = RingBuffer(2, intern=False)
+        first = _makeInternedError('a')
+        second = _makeInternedError('b')
+        buf.append(first)
+        buf.append(second)
+        self.assertEqual(buf.table, None)
+        self.assertFalse(first.traceback.frames is second.traceback.frames)
+
+
+class TestInternTable(unittest.TestCase):
+    def _makeOne(self):
+        from repoze.errorlog.store import InternTable
+        return InternTable()
+
+    def test_acquire_shares_values(self):
+        table = self._makeOne()
+        first = _makeInternedError('a')
+        second = _makeInternedError('b')
+        table.acquire(first)
+        table.acquire(second)
+        for name in ('description', 'fingerprint', 'exc_type', 'time'):
+            self.assertTrue(getattr(first, name) is getattr(second, name))
+        one, two = first.traceback, second.traceback
+        self.assertTrue(one.frames is two.frames)
+        self.assertTrue(one.cause.frames is two.cause.frames)
+        self.assertTrue(one.exception[0] is two.exception[0])
+        for key in first.environ:
+            other = [k for k in second.environ if k == key][0]
+            self.assertTrue(key is other)
+        self.assertTrue(first.environ['PATH_INFO'] is
+                        second.environ['PATH_INFO'])
+        # the same traceback renders
+        self.assertEqual(first.text, second.text)
+
+    def test_only_strings_interned(self):
+        from repoze.errorlog import Error
+        table = self._makeOne()
+        first = Error('a', 'desc', 'text', 'time', {'a': 1, 'b': 'x'},
+                      'url')
+        second = Error('b', 'desc', 'text', 'time', {'a': True, 'b': 'x'},
+                       'url')
+        table.acquire(first)
+        table.acquire(second)
+        self.assertTrue(second.environ['a'] is True)
+        self.assertTrue(first.traceback is second.traceback)
+
+    def test_release(self):
+        table = self._makeOne()
+        first = _makeInternedError('a')
+        second = _makeInternedError('b')
+        table.acquire(first)
+        size = len(table)
+        table.acquire(second)
+        self.assertEqual(len(table), size)
+        table.release(first)
+        self.assertEqual(len(table), size)
+        table.release(second)
+        self.assertEqual(len(table), 0)
+        # released after a clear
+        table.acquire(first)
+        table.clear()
+        table.release(first)
+        self.assertEqual(len(table), 0)
+
+    def test_other_errors(self):
+        table = self._makeOne()
+        error = DummyError('a')
+        table.acquire(error)
+        table.release(error)
+        self.assertEqual(len(table), 0)
+
+
+class Test_index_params(unittest.TestCase):
+    def _callFUT(self, querydata):
+        from repoze.errorlog import _index_params
+        return _index_params(querydata)
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT({}), {})
+
+    def test_all(self):
+        self.assertEqual(self._callFUT({'page': '2', 'limit': '10',
+                                        'type': 'KeyError',
+                                        'since': '1.5', 'q': ' cart '}),
+                         {'page': 2, 'limit': 10, 'exc_type': 'KeyError',
+                          'since': 1.5, 'query': 'cart'})
+
+    def test_bad_values_ignored(self):
+        self.assertEqual(self._callFUT({'page': 'x', 'limit': '',
+                                        'since': 'yesterday', 'q': ' '}), {})
+        self.assertEqual(self._callFUT({'page': '0'}), {})
+
+    def test_page_clamped(self):
+        from repoze.errorlog import _MAX_PAGE
+        self.assertEqual(self._callFUT({'page': '9' * 20}),
+                         {'page': _MAX_PAGE})
+
+    def test_limit_clamped(self):
+        self.assertEqual(self._callFUT({'limit': '0'}), {'limit': 1})
+        self.assertEqual(self._callFUT({'limit': '100000'}),
+                         {'limit': 1000})
+
+
+class Test__parse_querystring(unittest.TestCase):
+
+    def _callFUT(self, environ):
+        from repoze.errorlog import _parse_querystring
+        return _parse_querystring(environ)
+
+    def test_no_qs(self):
+        environ = {}
+        found = self._callFUT(environ)
+        self.assertEqual(found, [])
+
+    def test_simple(self):
+        environ = {'QUERY_STRING': 'a=1&b=2&c=3'}
+        found = self._callFUT(environ)
+        self.assertEqual(found,
+                         [('a', '1'), ('b', '2'), ('c', '3')])
+
+    def test_w_repeats(self):
+        environ = {'QUERY_STRING': 'a=1&b=2&c=3&b=4'}
+        found = self._callFUT(environ)
+        self.assertEqual(found,
+                         [('a', '1'), ('b', '2'), ('c', '3'), ('b', '4')])
+
+    def test_w_empty(self):
+        environ = {'QUERY_STRING': 'a&b&c=&d=1'}
+        found = self._callFUT(environ)
+        self.assertEqual(found, [('a', ''), ('b', ''), ('c', ''), ('d', '1')])
+
+
+class Test__construct_url(unittest.TestCase):
+
+    def _callFUT(self, environ):
+        from repoze.errorlog import _construct_url
+        return _construct_url(environ)
+
+    def test_w_HTTP_HOST_wo_port(self):
+        environ = _makeEnviron({'HTTP_HOST': 'example.com'})
+        self.assertEqual(self._callFUT(environ), 'http://example.com')
+
+    def test_w_HTTP_HOST_w_default_http_port(self):
+        environ = _makeEnviron({'HTTP_HOST': 'example.com:80'})
+        self.assertEqual(self._callFUT(environ), 'http://example.com')
+
+    def test_w_HTTP_HOST_w_non_default_http_port(self):
+        environ = _makeEnviron({'HTTP_HOST': 'example.com:8080'})
+        self.assertEqual(self._callFUT(environ), 'http://example.com:8080')
+
+    def test_w_HTTP_HOST_w_default_https_port(self):
+        environ = _makeEnviron({'HTTP_HOST': 'example.com:443',
+                                'wsgi.url_scheme': 'https',
+                               })
+        self.assertEqual(self._callFUT(environ), 'https://example.com')
+
+    def test_w_HTTP_HOST_w_non_default_https_port(self):
+        environ = _makeEnviron({'HTTP_HOST': 'example.com:4443',
+                                'wsgi.url_scheme': 'https',
+                               })
+        self.assertEqual(self._callFUT(environ), 'https://example.com:4443')
+
+    def test_wo_HTTP_HOST_w_default_http_port(self):
+        environ = _makeEnviron({'SERVER_NAME': 'example.com',
+                                'SERVER_PORT': '80',
+                               })
+        self.assertEqual(self._callFUT(environ), 'http://example.com')
+
+    def test_wo_HTTP_HOST_w_non_default_http_port(self):
         environ = _makeEnviron({'SERVER_NAME': 'example.com',
                                 'SERVER_PORT': '8080',
                                })
@@ -312,9 +3582,185 @@ class DummyApplication:
         self.start_response = start_response
         return ['hello world']
 
+class DummyStreamingApplication:
+    closed = False
+
+    def __init__(self, chunks, iter_exc=None, close_exc=None):
+        self.chunks = chunks
+        self.iter_exc = iter_exc
+        self.close_exc = close_exc
+        self.app_iter = self
+
+    def __call__(self, environ, start_response):
+        return self.app_iter
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.iter_exc:
+            raise self.iter_exc
+
+    def close(self):
+        self.closed = True
+        if self.close_exc:
+            raise self.close_exc
+
+class DummyHandler(logging.Handler):
+    def __init__(self):
+        import threading
+        logging.Handler.__init__(self)
+        self.records = []
+        self.entered = threading.Event()
+        self.proceed = threading.Event()
+
+    def emit(self, record):
+        self.entered.set()
+        self.proceed.wait(5)
+        self.records.append(record)
+
+class DummySink:
+    proceed = None
+
+    def __init__(self, failures=0):
+        import threading
+        self.failures = failures
+        self.batches = []
+        self.entered = threading.Event()
+        self.sent = threading.Event()
+
+    def send(self, lines):
+        self.entered.set()
+        if self.proceed is not None:
+            self.proceed.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise IOError('collector down')
+        self.batches.append(list(lines))
+        self.sent.set()
+
+class DummyExporter:
+    def __init__(self):
+        self.exported = []
+
+    def export(self, data, error=None):
+        self.exported.append((data, error))
+
+    def lines(self):
+        from repoze.errorlog.export import encode
+        from repoze.errorlog.export import error_record
+        return [encode(error_record(data, error))
+                for data, error in self.exported]
+
+class DummyCollector:
+    """ A stand-in HTTP collector, recording the requests it gets. """
+    status = 200
+
+    def __init__(self):
+        import threading
+        try:
+            from http.server import BaseHTTPRequestHandler
+            from http.server import HTTPServer
+        except ImportError: #pragma NO COVER Python 2
+            from BaseHTTPServer import BaseHTTPRequestHandler
+            from BaseHTTPServer import HTTPServer
+        collector = self
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length'))
+                collector.requests.append(
+                    (self.path, self.headers.get('Content-Encoding'),
+                     self.rfile.read(length)))
+                self.send_response(collector.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *arg):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class DummyFileWrapper:
+    pass
+
 class DummyException(Exception):
     pass
 
+class DummyHTTPException(Exception):
+    def __init__(self, code):
+        Exception.__init__(self, code)
+        self.code = code
+
+class DummyRendering:
+    calls = 0
+    def __str__(self):
+        self.calls += 1
+        return 'rendered'
+
+class DummyError:
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+
+def _insert_errors(elog, exc_type, count):
+    # record 'count' occurrences of one kind of error ('exc_type' raised
+    # from here)
+    for i in range(count):
+        try:
+            raise exc_type(i)
+        except exc_type:
+            elog.insert_error(elog.new_identifier(), sys.exc_info(), {})
+
+def _makeInternedError(identifier):
+    # an error like any other raised by the same code, with values equal
+    # to theirs but not the same objects
+    from repoze.errorlog import Error
+    from repoze.errorlog import TracebackSnapshot
+    try:
+        try:
+            _raise_nested(2)
+        except KeyError:
+            raise ValueError('chained')
+    except ValueError:
+        snapshot = TracebackSnapshot(sys.exc_info())
+    environ = {''.join(['PATH', '_INFO']): ''.join(['/a', '/b']),
+               'wsgi.version': (1, 0)}
+    return Error(identifier, ''.join(['de', 'sc']), snapshot,
+                 ''.join(['ti', 'me']), environ, 'url',
+                 ''.join(['f', 'p']), 1.0)
+
+def _is_caret_line(line):
+    # newer Pythons underline the failing expression
+    line = line.strip(' |')
+    return bool(line) and not line.strip('^~')
+
+
+def _raise_nested(depth):
+    if depth:
+        _raise_nested(depth - 1)
+    raise KeyError('nested')
+
+
+def _setswitchinterval(interval):
+    # make thread switches as frequent as possible to shake out races
+    if hasattr(sys, 'setswitchinterval'):
+        old = sys.getswitchinterval()
+        sys.setswitchinterval(interval)
+        return old
+    old = sys.getcheckinterval() #pragma NO COVER Python 2
+    sys.setcheckinterval(max(int(interval), 1)) #pragma NO COVER
+    return old #pragma NO COVER
+
 
 def _makeEnviron(override=None):
     from ._compat import NativeStream
@@ -331,3 +3777,8 @@ def _makeEnviron(override=None):
     if override is not None:
         environ.update(override)
     return environ
+
+
+if sys.version_info >= (3, 5): #pragma NO COVER Python 2
+    from repoze.errorlog.tests_asgi import TestASGIErrorLog
+    from repoze.errorlog.tests_asgi import Test_scope_environ
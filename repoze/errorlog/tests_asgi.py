@@ -0,0 +1,248 @@
+# Tests of repoze.errorlog.asgi, imported by tests.py on Python 3.5+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import sys
+import threading
+import unittest
+
+
+class TestASGIErrorLog(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('repoze.errorlog.tests.asgi')
+        self.handler = DummyHandler()
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = True
+        self.loop.close()
+
+    def _makeOne(self, app, executor=None, **kw):
+        from repoze.errorlog import make_errorlog
+        from repoze.errorlog.asgi import ASGIErrorLog
+        kw.setdefault('channel', 'repoze.errorlog.tests.asgi')
+        errorlog = make_errorlog(None, None, **kw)
+        return ASGIErrorLog(app, errorlog, executor)
+
+    def _request(self, elog, scope, receive=None):
+        messages = []
+        async def send(message):
+            messages.append(message)
+        if receive is None:
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+        self.loop.run_until_complete(elog(scope, receive, send))
+        return messages
+
+    def test_passthrough(self):
+        app = DummyASGIApplication()
+        elog = self._makeOne(app)
+        messages = self._request(elog, _makeScope())
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(messages[1]['body'], b'hello world')
+        self.assertEqual(app.scope['repoze.errorlog.path'], '/__error_log__')
+        self.assertEqual(app.scope['repoze.errorlog.entryid'], '0')
+        self.assertEqual(elog.errorlog.errors, [])
+
+    def test_passthrough_lifespan(self):
+        app = DummyASGIApplication()
+        elog = self._makeOne(app)
+        self._request(elog, {'type': 'lifespan'})
+        self.assertEqual(app.scope, {'type': 'lifespan'})
+
+    def test_error_in_application(self):
+        app = DummyASGIApplication(KeyError('cart'))
+        elog = self._makeOne(app)
+        scope = _makeScope(path='/script/cart', root_path='/script',
+                           query_string=b'a=1')
+        self.assertRaises(KeyError, self._request, elog, scope)
+        error = elog.errorlog.errors[0]
+        self.assertEqual(error.identifier, '0')
+        self.assertEqual(error.exc_type, 'KeyError')
+        self.assertEqual(error.url, '/script/__error_log__?entry=0')
+        self.assertEqual(error.environ['PATH_INFO'], '/cart')
+        self.assertEqual(error.environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(len(self.handler.records), 1)
+        self.assertTrue(self.handler.records[0].exc_info)
+        self.assertEqual(app.scope['repoze.errorlog.entryid'], '0')
+
+    def test_error_in_send(self):
+        app = DummyASGIApplication()
+        elog = self._makeOne(app)
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                raise OSError('gone')
+        async def receive(): #pragma NO COVER
+            return {'type': 'http.request'}
+        self.assertRaises(OSError, self.loop.run_until_complete,
+                          elog(_makeScope(), receive, send))
+        self.assertEqual(elog.errorlog.errors[0].exc_type, 'OSError')
+
+    def test_ignored_and_cancelled(self):
+        app = DummyASGIApplication(ValueError())
+        elog = self._makeOne(app)
+        elog.errorlog.ignored_exceptions = (ValueError,)
+        self.assertRaises(ValueError, self._request, elog, _makeScope())
+        app.exc = asyncio.CancelledError()
+        self.assertRaises(asyncio.CancelledError, self._request, elog,
+                          _makeScope())
+        self.assertEqual(elog.errorlog.errors, [])
+
+    def test_capture_runs_in_executor(self):
+        executor = DummyExecutor(1)
+        app = DummyASGIApplication(KeyError('cart'))
+        elog = self._makeOne(app, executor)
+        logged = []
+        log_error = elog.errorlog.log_error
+        def record_thread(*arg):
+            logged.append(threading.current_thread())
+            log_error(*arg)
+        elog.errorlog.log_error = record_thread
+        self.assertRaises(KeyError, self._request, elog, _makeScope())
+        executor.shutdown()
+        self.assertEqual(executor.submitted, 1)
+        self.assertNotEqual(logged, [threading.current_thread()])
+        self.assertEqual(len(elog.errorlog.errors), 1)
+
+    def test_views(self):
+        app = DummyASGIApplication(KeyError('cart'))
+        elog = self._makeOne(app)
+        self.assertRaises(KeyError, self._request, elog, _makeScope())
+        messages = self._request(elog, _makeScope(path='/__error_log__'))
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertTrue((b'content-type', b'text/html')
+                        in messages[0]['headers'])
+        self.assertTrue(b'KeyError' in messages[1]['body'])
+        scope = _makeScope(path='/__error_log__/api/errors/0')
+        messages = self._request(elog, scope)
+        data = json.loads(messages[1]['body'].decode('utf-8'))
+        self.assertEqual(data['identifier'], '0')
+        scope = _makeScope(path='/__error_log__/api/errors/1')
+        messages = self._request(elog, scope)
+        self.assertEqual(messages[0]['status'], 404)
+        self.assertEqual(app.calls, 1)
+
+    def test_stream(self):
+        elog = self._makeOne(DummyASGIApplication(),
+                             stream_heartbeat='0.01')
+        errorlog = elog.errorlog
+        messages = []
+        disconnected = []
+        async def receive():
+            while not disconnected:
+                await asyncio.sleep(0.001)
+            return {'type': 'http.disconnect'}
+        async def send(message):
+            messages.append(message)
+        def bodies():
+            return [m['body'] for m in messages[1:]]
+        async def until(body):
+            while not any(b.startswith(body) for b in bodies()):
+                await asyncio.sleep(0.001)
+        def raise_error():
+            try:
+                raise KeyError('cart')
+            except KeyError:
+                errorlog.log_error('0', {}, sys.exc_info())
+        async def scenario():
+            scope = _makeScope(path='/__error_log__/stream')
+            task = asyncio.ensure_future(elog(scope, receive, send))
+            await until(b': repoze.errorlog')
+            self.assertEqual(len(errorlog.broadcaster.subscribers), 1)
+            await self.loop.run_in_executor(None, raise_error)
+            await until(b'id: 0\nevent: error\n')
+            await until(b': keepalive')
+            disconnected.append(True)
+            await task
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertTrue((b'content-type', b'text/event-stream')
+                        in messages[0]['headers'])
+        self.assertEqual(messages[1]['body'], b': repoze.errorlog\n\n')
+        self.assertTrue(all(m['more_body'] for m in messages[1:]))
+        self.assertEqual(errorlog.broadcaster.subscribers, ())
+
+    def test_stream_too_many_subscribers(self):
+        elog = self._makeOne(DummyASGIApplication(),
+                             stream_max_subscribers='0')
+        messages = self._request(elog,
+                                 _makeScope(path='/__error_log__/stream'))
+        self.assertEqual(messages[0]['status'], 503)
+        self.assertEqual(messages[1]['body'],
+                         b'{"error":"too many subscribers"}')
+
+
+class Test_scope_environ(unittest.TestCase):
+    def _callFUT(self, scope):
+        from repoze.errorlog.asgi import scope_environ
+        return scope_environ(scope)
+
+    def test_it(self):
+        scope = _makeScope(path='/app/x', root_path='/app',
+                           query_string=b'q=1',
+                           headers=[(b'host', b'example.com'),
+                                    (b'content-type', b'text/plain'),
+                                    (b'accept', b'text/html'),
+                                    (b'accept', b'*/*')])
+        environ = self._callFUT(scope)
+        self.assertEqual(environ['REQUEST_METHOD'], 'GET')
+        self.assertEqual(environ['SCRIPT_NAME'], '/app')
+        self.assertEqual(environ['PATH_INFO'], '/x')
+        self.assertEqual(environ['QUERY_STRING'], 'q=1')
+        self.assertEqual(environ['SERVER_NAME'], 'testserver')
+        self.assertEqual(environ['SERVER_PORT'], '80')
+        self.assertEqual(environ['REMOTE_ADDR'], '127.0.0.1')
+        self.assertEqual(environ['HTTP_HOST'], 'example.com')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,*/*')
+        self.assertEqual(environ['wsgi.url_scheme'], 'http')
+
+    def test_minimal(self):
+        environ = self._callFUT({'type': 'websocket', 'path': '/'})
+        self.assertEqual(environ['SERVER_NAME'], 'localhost')
+        self.assertEqual(environ['asgi.scope_type'], 'websocket')
+        self.assertFalse('REMOTE_ADDR' in environ)
+
+
+class DummyASGIApplication:
+    calls = 0
+    scope = None
+
+    def __init__(self, exc=None):
+        self.exc = exc
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        self.scope = scope
+        if self.exc:
+            raise self.exc
+        if scope['type'] == 'http':
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body',
+                        'body': b'hello world'})
+
+class DummyHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class DummyExecutor(ThreadPoolExecutor):
+    submitted = 0
+
+    def submit(self, *arg, **kw):
+        self.submitted += 1
+        return ThreadPoolExecutor.submit(self, *arg, **kw)
+
+def _makeScope(path='/', root_path='', query_string=b'', headers=()):
+    return {'type': 'http', 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'root_path': root_path,
+            'query_string': query_string, 'headers': list(headers),
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
@@ -0,0 +1,128 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+import heapq
+from itertools import islice
+import types
+
+from ._compat import Repr
+from ._compat import SIMPLE_TYPES
+
+
+class LocalsCapture(object):
+    """ Record the local variables of the frames of a traceback.
+
+    Only the innermost 'max_frames' frames are looked at, and in each of
+    them the first 'max_vars' variables by name.  Values are summarized by
+    a ``reprlib.Repr`` which looks no deeper than 'max_depth' levels into
+    containers and cuts strings (and the whole summary) to 'max_length'
+    characters, so that a huge list costs no more than a small one.  Only
+    builtin scalars, strings and containers are summarized that way: other
+    objects are shown by type and id, as their ``__repr__`` could take any
+    time.  Only these strings are kept: the frames themselves (and so the
+    objects they refer to) are not.
+    """
+    def __init__(self, max_frames=10, max_vars=20, max_length=200,
+                 max_depth=2):
+        self.max_frames = max_frames
+        self.max_vars = max_vars
+        self.max_length = max_length
+        self.max_depth = max_depth
+        self._repr = _BoundedRepr()
+        self._repr.maxlevel = max_depth
+        self._repr.maxstring = max_length
+        self._repr.maxlong = max_length
+        self._repr.maxother = max_length
+
+    def capture(self, tb):
+        """ Return a list holding, for each frame of traceback 'tb' from the
+        outermost, None or a list of ``(name, summary)`` pairs.
+        """
+        tbs = []
+        while tb is not None:
+            tbs.append(tb)
+            tb = tb.tb_next
+        result = [None] * len(tbs)
+        first = max(len(tbs) - self.max_frames, 0)
+        for index in range(first, len(tbs)):
+            result[index] = self.summarize(tbs[index].tb_frame.f_locals)
+        return result
+
+    def summarize(self, variables):
+        """ Return ``(name, summary)`` pairs for the mapping 'variables'. """
+        names = heapq.nsmallest(self.max_vars, variables)
+        return [(name, self.repr(variables[name])) for name in names]
+
+    def repr(self, value):
+        """ Return the bounded summary of 'value'. """
+        try:
+            text = self._repr.repr(value)
+        except Exception as e:
+            text = '<repr failed: %s>' % type(e).__name__
+        if len(text) > self.max_length:
+            text = text[:self.max_length - 3] + '...'
+        return text
+
+
+# builtins whose repr() costs no more than reprlib lets it
+_SUMMARIZED = frozenset(SIMPLE_TYPES + (
+    complex, list, tuple, dict, set, frozenset, type, types.FunctionType,
+    types.BuiltinFunctionType, types.ModuleType))
+
+class _BoundedRepr(Repr):
+    # never runs code from outside the standard library, and doesn't sort
+    # dicts and sets (which takes time proportional to their size)
+
+    def repr1(self, x, level):
+        if type(x) in _SUMMARIZED:
+            return Repr.repr1(self, x, level)
+        return '<%s object at %#x>' % (type(x).__name__, id(x))
+
+    def repr_bytes(self, x, level):
+        # Repr has no method for them, and would repr() them whole before
+        # cutting that down
+        return self.repr_str(x, level)
+
+    repr_unicode = repr_bytes
+
+    def repr_dict(self, x, level):
+        if not x:
+            return '{}'
+        if level <= 0:
+            return '{...}'
+        pieces = ['%s: %s' % (self.repr1(key, level - 1),
+                              self.repr1(value, level - 1))
+                  for key, value in islice(x.items(), self.maxdict)]
+        if len(x) > self.maxdict:
+            pieces.append('...')
+        return '{%s}' % ', '.join(pieces)
+
+    def _repr_set(self, x, level, left, right):
+        if level <= 0:
+            return left + '...' + right
+        pieces = [self.repr1(item, level - 1)
+                  for item in islice(x, self.maxset)]
+        if len(x) > self.maxset:
+            pieces.append('...')
+        return left + ', '.join(pieces) + right
+
+    def repr_set(self, x, level):
+        if not x:
+            return 'set()'
+        return self._repr_set(x, level, '{', '}')
+
+    def repr_frozenset(self, x, level):
+        if not x:
+            return 'frozenset()'
+        return self._repr_set(x, level, 'frozenset({', '})')
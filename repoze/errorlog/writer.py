@@ -0,0 +1,127 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+import atexit
+import logging
+import os
+import threading
+
+from ._compat import queue
+
+_STOP = object()
+
+
+class BackgroundQueue(object):
+    """ A queue of at most 'maxsize' items, consumed by a thread which runs
+    ``_run``.
+
+    The thread is started on first use (so that each process forked after
+    the queue is created gets its own) and drained when the interpreter
+    exits.
+    """
+    thread_name = 'repoze.errorlog'
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def stop(self, timeout=None):
+        """ Process the items already queued and stop the thread. """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._pid = None
+        if thread is not None and thread.is_alive():
+            self.queue.put(_STOP)
+            thread.join(timeout)
+
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                if self._thread is not None:
+                    # inherited across a fork: the thread is gone and so
+                    # is whatever it was about to process
+                    self.queue = queue.Queue(self.maxsize)
+                thread = threading.Thread(target=self._run,
+                                          name=self.thread_name)
+                thread.daemon = True
+                thread.start()
+                self._thread = thread
+                self._pid = pid
+                atexit.register(self.stop, 5)
+
+    def _run(self):
+        raise NotImplementedError
+
+
+class LogWriter(BackgroundQueue):
+    """ Write error log messages from a background thread.
+
+    Messages are handed over through a queue holding at most 'maxsize'
+    of them.  When the queue is full, a message is dropped (and counted in
+    ``dropped``) unless 'block' is true, in which case the caller waits up
+    to 'timeout' seconds (forever if None) for room before dropping it.
+    """
+    thread_name = 'repoze.errorlog writer'
+
+    def __init__(self, maxsize=1000, block=False, timeout=None):
+        BackgroundQueue.__init__(self, maxsize)
+        self.block = block
+        self.timeout = timeout
+        self.dropped = 0
+
+    def log(self, logger, record, tb_snapshot):
+        """ Have 'logger' handle 'record', with the rendering of
+        'tb_snapshot' as its traceback, in the writer thread.
+        """
+        self._start()
+        try:
+            self.queue.put((logger, record, tb_snapshot), self.block,
+                           self.timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        q = self.queue
+        while True:
+            item = q.get()
+            if item is _STOP:
+                break
+            logger, record, tb_snapshot = item
+            text = str(tb_snapshot)
+            if text.endswith('\n'):
+                text = text[:-1]
+            # what Formatter.formatException would have produced from
+            # the (long gone) exc_info
+            record.exc_text = text
+            try:
+                logger.handle(record)
+            except Exception: #pragma NO COVER
+                # handlers report their own errors via handleError; don't
+                # let anything else kill the thread
+                pass
+
+
+def make_record(logger, msg):
+    """ Make the record ``logger.exception(msg)`` would have, minus the
+    traceback, which the writer thread fills in.
+    """
+    return logger.makeRecord(logger.name, logging.ERROR, __file__, 0,
+                             msg, (), None)